@@ -96,6 +96,22 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# Each worker process caches in its own memory. The versions of cached data, such as those of the cached
+# choices, are kept in the database as well, so that a write handled by one worker is seen by every other.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'nod_cache',
+    },
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
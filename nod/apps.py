@@ -0,0 +1,44 @@
+from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+
+class NodConfig(AppConfig):
+    """
+    Configuration of the garage app, connecting the signal handlers which keep cached and derived
+    data in step with the database.
+    """
+    name = 'nod'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from nod.choices import invalidate_choices, invalidate_mechanic_choices
+        from nod.counters import refresh_customer_job_counts, remember_counted_customer
+        from nod.fitment import refresh_part_fitment
+        from nod.models import Bay, Customer, EmailModel, Job, Mechanic, Part, PhoneModel, Task, Vehicle
+        from nod.search import MODEL_KINDS, refresh_contact_owners, refresh_customer_contacts, refresh_search
+
+        # the catalogues offered as choices in job sheets and part formsets
+        for model in [Task, Bay, Mechanic]:
+            post_save.connect(invalidate_choices, sender=model, dispatch_uid='choices_save_' + model.__name__)
+            post_delete.connect(invalidate_choices, sender=model, dispatch_uid='choices_delete_' + model.__name__)
+        post_save.connect(invalidate_mechanic_choices, sender=User, dispatch_uid='choices_save_User')
+
+        # the vehicles each part fits, parsed from its vehicle type and years
+        post_save.connect(refresh_part_fitment, sender=Part, dispatch_uid='fitment_save_Part')
+
+        # the search index of customers, vehicles, jobs and invoices
+        for model in MODEL_KINDS:
+            post_save.connect(refresh_search, sender=model, dispatch_uid='search_save_' + model.__name__)
+            post_delete.connect(refresh_search, sender=model, dispatch_uid='search_delete_' + model.__name__)
+        for through in [Customer.emails.through, Customer.phone_numbers.through]:
+            m2m_changed.connect(refresh_customer_contacts, sender=through,
+                                dispatch_uid='search_contacts_' + through.__name__)
+        for model in [EmailModel, PhoneModel]:
+            post_save.connect(refresh_contact_owners, sender=model, dispatch_uid='search_save_' + model.__name__)
+
+        # the counts of jobs by type stored with each customer
+        for model in [Job, Vehicle]:
+            pre_save.connect(remember_counted_customer, sender=model, dispatch_uid='counts_pre_save_' + model.__name__)
+            post_save.connect(refresh_customer_job_counts, sender=model, dispatch_uid='counts_save_' + model.__name__)
+            post_delete.connect(refresh_customer_job_counts, sender=model,
+                                dispatch_uid='counts_delete_' + model.__name__)
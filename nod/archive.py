@@ -0,0 +1,96 @@
+import json
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from nod.models import ArchivedRow, EmailModel, InvoiceReminder, JobPart, JobTask, OrderPartRelationship, \
+    PhoneModel, SellPart, SparePart, Statement, TransferPartRelationship, Vehicle
+from nod.utils import seek_chunks
+
+
+# how long a row stays soft deleted in its table before it's archived
+ARCHIVE_AFTER = timedelta(days=365)
+
+# the models whose soft deleted rows are archived. Rows still referred to by other rows are left where they are.
+# Models split over several tables by inheritance, or referred to through generic relations, such as customers,
+# aren't archived, nor are invoices and jobs, whose numbers are worked out from the rows already in their tables.
+ARCHIVED_MODELS = [
+    EmailModel,
+    PhoneModel,
+    Vehicle,
+    JobTask,
+    JobPart,
+    SellPart,
+    OrderPartRelationship,
+    TransferPartRelationship,
+    InvoiceReminder,
+    SparePart,
+    Statement,
+]
+
+
+# returns the label the rows of a model are archived under, e.g. "nod.vehicle"
+def model_label(model):
+    return model._meta.app_label + "." + model._meta.model_name
+
+
+# returns the ids of the rows of a model which other rows refer to, as a queryset for each foreign key or many
+# to many relation pointing at the model, and for each of its own many to many fields
+def references(model):
+    for field in model._meta.get_fields(include_hidden=True):
+        if field.auto_created and not field.concrete:
+            if field.one_to_many or field.one_to_one:
+                name = field.field.name
+                yield field.related_model._base_manager.filter(**{name + '__isnull': False}).values(name)
+            elif field.many_to_many:
+                yield field.field.rel.through._base_manager.values(field.field.m2m_reverse_field_name())
+        elif field.many_to_many:
+            yield field.rel.through._base_manager.values(field.m2m_field_name())
+
+
+# returns the rows of a model which were soft deleted before the given moment and which no other row refers to
+def archivable(model, before):
+    rows = model.all_objects.filter(is_deleted=True, updated__lt=before)
+    for referenced in references(model):
+        rows = rows.exclude(id__in=referenced)
+    return rows
+
+
+# moves the archivable rows of a model into the archive, a chunk of rows at a time, each chunk copied across
+# with a single insert and deleted with a single delete. Returns the number of rows archived.
+def archive_model(model, before, dry_run=False):
+    rows = archivable(model, before)
+    if dry_run:
+        return rows.count()
+    label = model_label(model)
+    archived = 0
+    for chunk in seek_chunks(rows.values_list('id')):
+        ids = [row[0] for row in chunk]
+        with transaction.atomic():
+            instances = list(model.all_objects.filter(id__in=ids))
+            ArchivedRow.objects.bulk_create([
+                ArchivedRow(model=label, row_id=instance.id, row_uuid=getattr(instance, 'uuid', ''),
+                            deleted=instance.updated, data=json.dumps(row['fields'], cls=DjangoJSONEncoder))
+                for instance, row in zip(instances, serializers.serialize('python', instances))
+            ])
+            model.all_objects.filter(id__in=ids).delete()
+        archived += len(ids)
+    return archived
+
+
+# archives the rows of every archived model which have been soft deleted for longer than ARCHIVE_AFTER, so that
+# the live tables only hold live rows and those deleted recently. Returns the number of rows archived of each
+# model, by label.
+def archive_deleted(before=None, dry_run=False):
+    if before is None:
+        before = timezone.now() - ARCHIVE_AFTER
+    return OrderedDict((model_label(model), archive_model(model, before, dry_run)) for model in ARCHIVED_MODELS)
+
+
+# returns the archived rows of a model, for audits, the latest first
+def archived_rows(model):
+    return ArchivedRow.objects.filter(model=model_label(model)).order_by('-archived', '-id')
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.db import transaction
+
+from nod.events import record_assignments
+from nod.models import Job, JobTask, Mechanic
+
+
+# hours of estimated work assumed at a mechanic's normal pace before their history is trusted, so that
+# a single quick or slow job doesn't make them look much faster or slower than they are
+PRIOR_HOURS = 5.0
+
+# the pace of a mechanic is kept within these bounds, however unusual their history
+MIN_PACE = 0.5
+MAX_PACE = 3.0
+
+
+class Assignment(object):
+    """
+    A proposed assignment of an untaken job to a mechanic, with the hours the job is expected to
+    take that mechanic and the mechanic's outstanding hours once the job is assigned.
+    """
+
+    def __init__(self, job, mechanic, hours, load):
+        self.job = job
+        self.mechanic = mechanic
+        self.hours = hours
+        self.load = load
+
+    # flattens the assignment into a row for the preview table
+    def as_row(self):
+        return {
+            'uuid': self.job.uuid,
+            'job_number': self.job.job_number,
+            'type': self.job.get_type_display(),
+            'booking_date': self.job.booking_date,
+            'mechanic': str(self.mechanic),
+            'hours': round(self.hours, 2),
+            'load': round(self.load, 2),
+        }
+
+
+# converts a duration into hours
+def hours(duration):
+    if duration is None:
+        return 0.0
+    return duration.total_seconds() / 3600
+
+
+# returns the pace of every mechanic for every job type they have completed tasks for, as the ratio of
+# the time they actually took to the time estimated, in a single query over completed tasks
+def paces():
+    totals = {}
+    for mechanic_id, job_type, duration, estimated_time in JobTask.objects\
+            .filter(is_deleted=False, status='1', job__is_deleted=False, job__mechanic__isnull=False)\
+            .values_list('job__mechanic_id', 'job__type', 'duration', 'task__estimated_time'):
+        if duration is None or not estimated_time:
+            continue
+        actual, estimated = totals.get((mechanic_id, job_type), (0.0, 0.0))
+        totals[(mechanic_id, job_type)] = (actual + hours(duration), estimated + hours(estimated_time))
+
+    result = {}
+    for key, (actual, estimated) in totals.items():
+        pace = (actual + PRIOR_HOURS) / (estimated + PRIOR_HOURS)
+        result[key] = min(max(pace, MIN_PACE), MAX_PACE)
+    return result
+
+
+# returns the estimated hours of the tasks still to be done on every open (started or pending) job,
+# together with the open jobs themselves, in two queries
+def open_work():
+    jobs = list(Job.objects.filter(is_deleted=False, status__in=['2', '3']).order_by('booking_date', 'job_number'))
+    remaining = dict((job.id, timedelta()) for job in jobs)
+    for job_id, estimated_time in JobTask.objects\
+            .filter(is_deleted=False, job__is_deleted=False, job__status__in=['2', '3'])\
+            .exclude(status='1').values_list('job_id', 'task__estimated_time'):
+        if job_id in remaining and estimated_time:
+            remaining[job_id] += estimated_time
+    return jobs, dict((job_id, hours(duration)) for job_id, duration in remaining.items())
+
+
+# proposes a mechanic for every untaken job, balancing the outstanding estimated hours of each mechanic.
+# Jobs are handed out longest first, each to the mechanic who would have the least outstanding work once
+# it's scaled by their pace for that type of job, which keeps the loads even in a single pass.
+def propose_assignments():
+    mechanics = list(Mechanic.objects.filter(is_deleted=False).select_related('user'))
+    if not mechanics:
+        return []
+
+    pace = paces()
+    jobs, remaining = open_work()
+
+    load = dict((mechanic.id, 0.0) for mechanic in mechanics)
+    untaken = []
+    for job in jobs:
+        if job.mechanic_id is None:
+            untaken.append(job)
+        elif job.mechanic_id in load:
+            load[job.mechanic_id] += remaining[job.id] * pace.get((job.mechanic_id, job.type), 1.0)
+
+    untaken.sort(key=lambda job: -remaining[job.id])
+
+    assignments = []
+    for job in untaken:
+        best = None
+        for mechanic in mechanics:
+            job_hours = remaining[job.id] * pace.get((mechanic.id, job.type), 1.0)
+            if best is None or load[mechanic.id] + job_hours < best[0]:
+                best = (load[mechanic.id] + job_hours, mechanic, job_hours)
+        total, mechanic, job_hours = best
+        load[mechanic.id] = total
+        assignments.append(Assignment(job, mechanic, job_hours, total))
+
+    assignments.sort(key=lambda assignment: (assignment.job.booking_date, assignment.job.job_number))
+    return assignments
+
+
+# saves the given assignments, made by the given staff member, with one update per mechanic. Jobs taken by
+# someone since the assignments were proposed are left alone. Returns the number of jobs assigned.
+def apply_assignments(assignments, staff=None):
+    mechanics = {}
+    jobs = {}
+    for assignment in assignments:
+        mechanics[assignment.mechanic.id] = assignment.mechanic
+        jobs.setdefault(assignment.mechanic.id, []).append(assignment.job)
+
+    assigned = {}
+    with transaction.atomic():
+        for mechanic_id, mechanic_jobs in jobs.items():
+            untaken = set(Job.objects.filter(id__in=[job.id for job in mechanic_jobs], mechanic=None,
+                                             is_deleted=False).values_list('id', flat=True))
+            Job.objects.filter(id__in=untaken).update(mechanic=mechanics[mechanic_id])
+            for job in mechanic_jobs:
+                if job.id in untaken:
+                    assigned[job] = mechanics[mechanic_id]
+        record_assignments(assigned, staff)
+    return len(assigned)
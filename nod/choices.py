@@ -0,0 +1,110 @@
+from django import forms
+from django.core.cache import cache, caches
+
+
+# how long a cached list of choices is kept before it's loaded again, even if nothing was written
+CHOICES_TIMEOUT = 60 * 60
+
+# seconds a worker goes on using the version of a model's choices it last read from the shared cache, so that
+# rendering a formset doesn't look the version up for every field. A write handled by another worker reaches
+# this one's choices within this long; writes handled by this worker are seen straight away.
+VERSION_CHECK_TIMEOUT = 5
+
+# the cache every worker process shares, holding the versions of the choices; the lists of choices themselves
+# are cached in each worker's own memory under the version they were loaded at
+versions = caches['shared']
+
+
+# returns the name the choices of the given model are cached under
+def model_key(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+# returns the cache key holding the current version of the choices of the given model
+def version_key(model):
+    return 'choices:%s:version' % model_key(model)
+
+
+# returns the current version of the choices of the given model, as this worker last read it from the shared
+# cache within VERSION_CHECK_TIMEOUT
+def choices_version(model):
+    key = version_key(model)
+    version = cache.get(key)
+    if version is None:
+        version = versions.get(key)
+        if version is None:
+            versions.add(key, 1, None)
+            version = versions.get(key, 1)
+        cache.set(key, version, VERSION_CHECK_TIMEOUT)
+    return version
+
+
+# moves the choices of the given model on to a new version, so every cached list of them, in every worker, is
+# reloaded the next time it's used. Connected to the save and delete signals of every model choices are
+# cached for.
+def invalidate_choices(sender, **kwargs):
+    key = version_key(sender)
+    try:
+        versions.incr(key)
+    except ValueError:
+        versions.add(key, 1, None)
+    cache.delete(key)
+
+
+# the user names of mechanics are part of their labels, so their choices also depend on users
+def invalidate_mechanic_choices(sender, **kwargs):
+    from nod.models import Mechanic
+    invalidate_choices(Mechanic)
+
+
+# returns the choices of the given field as a list of (primary key, label), from the cache where the current
+# version of them was already loaded, otherwise from the database in a single query. Only the keys and labels
+# are cached, so a process whose cache missed a write offers a stale label at worst, never a stale instance.
+def cached_choices(field):
+    model = field.queryset.model
+    key = 'choices:%s:%s:%s' % (model_key(model), field.name, choices_version(model))
+    choices = cache.get(key)
+    if choices is None:
+        choices = [(obj.pk, field.label_from_instance(obj)) for obj in field.queryset.all()]
+        cache.set(key, choices, CHOICES_TIMEOUT)
+    return choices
+
+
+class CachedModelChoiceIterator(object):
+    """
+    Yields the choices of a CachedModelChoiceField from its cached keys and labels rather than
+    evaluating the field's queryset every time a form is rendered.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for choice in cached_choices(self.field):
+            yield choice
+
+    def __len__(self):
+        return len(cached_choices(self.field)) + (1 if self.field.empty_label is not None else 0)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    A ModelChoiceField whose choices come from a versioned cache shared by every field over
+    the same model, so a formset of these fields runs at most one query to render however many
+    forms it holds, and none at all when the cache is warm. Submitted values are still checked
+    against the database. Fields over the same model with different querysets or labels must be
+    given different names.
+    """
+
+    def __init__(self, queryset, name='default', *args, **kwargs):
+        self.name = name
+        super(CachedModelChoiceField, self).__init__(queryset, *args, **kwargs)
+
+    def _get_choices(self):
+        if hasattr(self, '_choices'):
+            return self._choices
+        return CachedModelChoiceIterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
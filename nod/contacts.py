@@ -0,0 +1,99 @@
+from collections import OrderedDict, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from nod.models import EmailModel, PhoneModel
+from nod.search import index_contact_owners
+from nod.utils import batches
+
+
+# returns an email address trimmed and lowercased, so that the same address typed differently is one contact
+def normalize_email(address):
+    return address.strip().lower()
+
+
+# returns a phone number without the spaces, dashes and brackets it may have been typed with
+def normalize_phone(number):
+    return ''.join(number.split()).replace('-', '').replace('(', '').replace(')', '')
+
+
+# returns the contacts filled in on a formset, as an OrderedDict of {normalised value: type}. Rows missing
+# either the value or the type are left out, as the formsets allow.
+def submitted_contacts(formset, value_field, type_field, normalize):
+    contacts = OrderedDict()
+    for form in formset:
+        value = form.cleaned_data.get(value_field)
+        contact_type = form.cleaned_data.get(type_field)
+        if value and contact_type:
+            contacts[normalize(value)] = contact_type
+    return contacts
+
+
+# checks every phone number against the format PhoneModel.save would check it against, raising a single
+# ValidationError naming each number which doesn't comply
+def validate_phone_numbers(numbers):
+    invalid = []
+    for number in numbers:
+        try:
+            PhoneModel.phone_regex(number)
+        except ValidationError:
+            invalid.append(number)
+    if invalid:
+        raise ValidationError(PhoneModel.phone_regex.message + " Invalid: " + ", ".join(invalid),
+                              code='invalid_phone_numbers')
+
+
+# returns the contacts of a model with the given values, as {value: contact}, with one IN query for each batch
+# of values. Contacts which aren't deleted are preferred where a value is held by more than one.
+def existing_contacts(model, field, values):
+    contacts = {}
+    for batch in batches(values):
+        for contact in model.all_objects.filter(**{field + '__in': batch}).order_by('is_deleted', 'id'):
+            contacts.setdefault(getattr(contact, field), contact)
+    return contacts
+
+
+# returns the contacts of a model for the given {value: type}, creating the missing ones with a single
+# bulk insert, restoring those which were deleted and updating the type of those whose type was changed, with
+# an update for each type rather than a save for each contact
+def upsert_contacts(model, field, submitted):
+    contacts = existing_contacts(model, field, list(submitted))
+    missing = [value for value in submitted if value not in contacts]
+    if missing:
+        # bulk_create skips save(), so phone numbers are expected to have been validated beforehand
+        model.objects.bulk_create([model(type=submitted[value], **{field: value}) for value in missing])
+        contacts.update(existing_contacts(model, field, missing))
+
+    changed = defaultdict(list)
+    for value, contact in contacts.items():
+        if contact.is_deleted or contact.type != submitted[value]:
+            changed[submitted[value]].append(contact.id)
+    for contact_type, ids in changed.items():
+        for batch in batches(ids):
+            model.all_objects.filter(id__in=batch).update(type=contact_type, is_deleted=False, updated=timezone.now())
+    # updates skip the save signals, so the customers already holding a restored contact are searchable by it
+    # again through here
+    index_contact_owners(model, [contact.id for contact in contacts.values() if contact.is_deleted])
+    return [contacts[value] for value in submitted]
+
+
+# sets the contacts of a relation of a customer or supplier to exactly the given ones, removing those no longer
+# given and adding the new ones, each with a single statement
+def set_contacts(relation, contacts):
+    ids = set(contact.id for contact in contacts)
+    current = set(relation.values_list('id', flat=True))
+    if current - ids:
+        relation.remove(*(current - ids))
+    if ids - current:
+        relation.add(*(ids - current))
+
+
+# saves the emails and phone numbers filled in on the contact formsets against a saved customer or supplier,
+# in place of those they had. Contacts are shared, so existing ones are reused by address or number.
+def sync_contacts(owner, email_formset, phone_formset):
+    emails = submitted_contacts(email_formset, 'email_address', 'email_type', normalize_email)
+    phones = submitted_contacts(phone_formset, 'phone_number', 'phone_type', normalize_phone)
+    validate_phone_numbers(phones)
+    set_contacts(owner.emails, upsert_contacts(EmailModel, 'address', emails))
+    set_contacts(owner.phone_numbers, upsert_contacts(PhoneModel, 'phone_number', phones))
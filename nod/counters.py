@@ -0,0 +1,83 @@
+from collections import defaultdict
+
+from django.db.models import Count
+
+from nod.models import Customer, Job, Vehicle
+from nod.utils import batches, seek_chunks
+
+
+# the counter of a customer holding the number of jobs of each type
+JOB_TYPE_COUNTERS = {
+    '1': 'mot_jobs',
+    '2': 'repair_jobs',
+    '3': 'annual_jobs',
+}
+
+
+# counts the jobs of each type done on the vehicles of the given customers, leaving out those which were deleted,
+# as {customer id: {counter: count}}, with a single grouped query for each batch of customers
+def job_type_counts(customer_ids):
+    counts = defaultdict(dict)
+    for batch in batches(customer_ids):
+        for customer_id, job_type, count in Job.objects.filter(
+                is_deleted=False, vehicle__is_deleted=False, vehicle__customer_id__in=batch)\
+                .values('vehicle__customer_id', 'type').annotate(count=Count('id'))\
+                .values_list('vehicle__customer_id', 'type', 'count'):
+            counts[customer_id][JOB_TYPE_COUNTERS[job_type]] = count
+    return counts
+
+
+# the counters in a fixed order
+COUNTERS = [JOB_TYPE_COUNTERS[job_type] for job_type in sorted(JOB_TYPE_COUNTERS)]
+
+
+# stores the counts of jobs by type of the given customers. Customers with the same counts are updated
+# together, so most customers, having few jobs, take few UPDATEs between them.
+def refresh_job_counts(customer_ids):
+    customer_ids = list(customer_ids)
+    counts = job_type_counts(customer_ids)
+    customers = defaultdict(list)
+    for customer_id in customer_ids:
+        customers[tuple(counts[customer_id].get(counter, 0) for counter in COUNTERS)].append(customer_id)
+    for values, ids in customers.items():
+        for batch in batches(ids):
+            Customer.objects.filter(id__in=batch).update(**dict(zip(COUNTERS, values)))
+
+
+# returns the customer whose counts a job or vehicle is counted towards, as saved in the database
+def counted_customer_id(sender, pk):
+    if sender is Vehicle:
+        return Vehicle.all_objects.filter(id=pk).values_list('customer_id', flat=True).first()
+    return Job.all_objects.filter(id=pk).values_list('vehicle__customer_id', flat=True).first()
+
+
+# remembers which customer a job or vehicle was counted towards before it's saved, so that the counts of that
+# customer are refreshed too if the vehicle moves to another customer or the job to another vehicle.
+# Connected to the pre save signals of Job and Vehicle.
+def remember_counted_customer(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._counted_customer_id = counted_customer_id(sender, instance.pk)
+
+
+# keeps the job counts of a customer in step as the jobs of their vehicles are created, edited and deleted,
+# and as their vehicles are deleted, along with those of the customer they were counted towards before.
+# Connected to the save and delete signals of Job and Vehicle.
+def refresh_customer_job_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is Vehicle:
+        customer_ids = set([instance.customer_id])
+    else:
+        customer_ids = set([Vehicle.all_objects.filter(id=instance.vehicle_id)
+                            .values_list('customer_id', flat=True).first()])
+    customer_ids.add(getattr(instance, '_counted_customer_id', None))
+    customer_ids.discard(None)
+    if customer_ids:
+        refresh_job_counts(customer_ids)
+
+
+# refreshes the job counts of every customer, a chunk of customers at a time, for the jobs and vehicles
+# changed by queryset updates, which skip the signals keeping the counts in step
+def recount_jobs():
+    for chunk in seek_chunks(Customer.all_objects.values_list('id')):
+        refresh_job_counts([row[0] for row in chunk])
@@ -0,0 +1,180 @@
+import re
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+
+from nod.counters import refresh_job_counts
+from nod.models import AccountHolder, BusinessCustomer, Customer, CustomerBlockingKey, CustomerPartsOrder, \
+    Dropin, Vehicle, contacts_by_customer
+from nod.search import index_documents
+from nod.utils import seek_chunks
+
+
+# kinds of blocking key, as stored on CustomerBlockingKey
+PHONE, EMAIL, NAME, POSTCODE = '1', '2', '3', '4'
+
+# how much sharing a key of each kind counts towards two customers being the same person. A phone number or
+# email is nearly enough on its own, a name or postcode only along with something else.
+WEIGHTS = {
+    PHONE: 0.5,
+    EMAIL: 0.5,
+    NAME: 0.3,
+    POSTCODE: 0.3,
+}
+
+# score from which a pair of customers is taken to be the same person
+MERGE_SCORE = 0.8
+
+# keys shared by more customers than this, such as the postcode of a block of flats, are too common to tell
+# anyone apart, and are left out rather than pairing every customer sharing them
+MAX_BLOCK_SIZE = 50
+
+NON_DIGITS = re.compile(r'\D')
+
+
+# returns a phone number with only its digits
+def phone_key(phone_number):
+    return NON_DIGITS.sub('', phone_number)
+
+
+# returns an email address lowercased and trimmed
+def email_key(address):
+    return address.strip().lower()
+
+
+# returns the surname of a customer along with the first letter of their forename, lowercased, so that
+# "Jon Smith" and "JOHN SMITH" share a key. Customers without a surname have no name key.
+def name_key(forename, surname):
+    surname = ' '.join(surname.lower().split())
+    if not surname:
+        return None
+    forename = forename.strip().lower()
+    return surname + ' ' + forename[:1]
+
+
+# returns a postcode uppercased without its spaces
+def postcode_key(postcode):
+    return ''.join((postcode or '').split()).upper() or None
+
+
+# returns the blocking keys of the given customers which aren't deleted, as a list of (customer id, kind, token)
+def blocking_keys(customer_ids):
+    emails, phones = contacts_by_customer(customer_ids)
+    keys = set()
+    for pk, forename, surname, postcode in Customer.objects.filter(id__in=customer_ids, is_deleted=False)\
+            .values_list('id', 'forename', 'surname', 'accountholder__postcode'):
+        for number in phones[pk]:
+            keys.add((pk, PHONE, phone_key(number)))
+        for address in emails[pk]:
+            keys.add((pk, EMAIL, email_key(address)))
+        name = name_key(forename, surname)
+        if name:
+            keys.add((pk, NAME, name))
+        postcode = postcode_key(postcode)
+        if postcode:
+            keys.add((pk, POSTCODE, postcode))
+    return [key for key in keys if key[2]]
+
+
+# replaces the blocking keys of every customer with ones built from the customers as they are now, a chunk of
+# customers at a time
+def rebuild_blocking_keys():
+    with transaction.atomic():
+        CustomerBlockingKey.objects.all().delete()
+        customers = Customer.objects.filter(is_deleted=False).values_list('id')
+        for chunk in seek_chunks(customers):
+            CustomerBlockingKey.objects.bulk_create([
+                CustomerBlockingKey(customer_id=pk, kind=kind, token=token)
+                for pk, kind, token in blocking_keys([customer[0] for customer in chunk])
+            ], batch_size=500)
+
+
+# returns the pairs of customers sharing at least one key, as {(lower id, higher id): set of kinds shared}.
+# The pairs come from joining the keys on themselves over their index, within the keys shared by no more than
+# MAX_BLOCK_SIZE customers, rather than from comparing every customer with every other.
+def candidate_pairs():
+    table = connection.ops.quote_name(CustomerBlockingKey._meta.db_table)
+    pairs = defaultdict(set)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT a.customer_id, b.customer_id, a.kind FROM "
+            "(SELECT kind, token FROM " + table + " GROUP BY kind, token HAVING COUNT(*) BETWEEN 2 AND %s) blocks "
+            "INNER JOIN " + table + " a ON a.kind = blocks.kind AND a.token = blocks.token "
+            "INNER JOIN " + table + " b ON b.kind = blocks.kind AND b.token = blocks.token "
+            "AND b.customer_id > a.customer_id", [MAX_BLOCK_SIZE])
+        for first, second, kind in cursor.fetchall():
+            pairs[(first, second)].add(kind)
+    return pairs
+
+
+# returns how likely two customers sharing the given kinds of key are to be the same person, out of 1
+def score(kinds):
+    return min(1.0, sum(WEIGHTS[kind] for kind in kinds))
+
+
+# returns the pairs of customers likely to be the same person, from the keys last built, as a list of
+# (score, first id, second id, kinds shared), the likeliest first
+def find_duplicates(min_score=MERGE_SCORE):
+    duplicates = []
+    for (first, second), kinds in candidate_pairs().items():
+        pair_score = score(kinds)
+        if pair_score >= min_score:
+            duplicates.append((pair_score, first, second, sorted(kinds)))
+    duplicates.sort(key=lambda duplicate: (-duplicate[0], duplicate[1], duplicate[2]))
+    return duplicates
+
+
+# returns which of a pair of customers is kept when they're merged, as (kept id, merged id). Business
+# customers are kept over account holders, who are kept over drop ins, so that no account is lost, then the
+# customer created first.
+def survivor(first, second):
+    rank = {}
+    for pk, business_customer_id, account_holder_id in Customer.objects.filter(id__in=[first, second])\
+            .values_list('id', 'accountholder__businesscustomer__id', 'accountholder__id'):
+        rank[pk] = (business_customer_id is None, account_holder_id is None, pk)
+    if rank.get(second, (True, True, second)) < rank.get(first, (True, True, first)):
+        return second, first
+    return first, second
+
+
+# returns the content type of the concrete class of a customer, which their part orders point at
+def customer_content_type(customer_id):
+    for model in (BusinessCustomer, AccountHolder, Dropin):
+        if model.objects.filter(id=customer_id).exists():
+            return ContentType.objects.get_for_model(model)
+    return None
+
+
+# merges a customer into another, moving their vehicles and part orders across with an update of each table,
+# so that their jobs and invoices go along with them, and adding their emails and phone numbers to the other
+# customer. The merged customer is then soft deleted. Returns the number of vehicles moved.
+def merge_customers(keep_id, duplicate_id):
+    content_types = [ContentType.objects.get_for_model(model) for model in (Dropin, AccountHolder, BusinessCustomer)]
+    now = timezone.now()
+    with transaction.atomic():
+        keep = Customer.objects.get(id=keep_id)
+        vehicle_ids = list(Vehicle.all_objects.filter(customer_id=duplicate_id).values_list('id', flat=True))
+        Vehicle.all_objects.filter(id__in=vehicle_ids).update(customer=keep_id, updated=now)
+        CustomerPartsOrder.all_objects.filter(content_type__in=content_types, object_id=duplicate_id)\
+            .update(content_type=customer_content_type(keep_id), object_id=keep_id, updated=now)
+
+        emails = list(Customer.emails.through.objects.filter(customer_id=duplicate_id)
+                      .values_list('emailmodel_id', flat=True))
+        if emails:
+            keep.emails.add(*emails)
+        phones = list(Customer.phone_numbers.through.objects.filter(customer_id=duplicate_id)
+                      .values_list('phonemodel_id', flat=True))
+        if phones:
+            keep.phone_numbers.add(*phones)
+
+        # updated directly, so the merged customer's stale version doesn't hold the merge up
+        Customer.objects.filter(id=duplicate_id).update(is_deleted=True, updated=now)
+        CustomerBlockingKey.objects.filter(customer_id=duplicate_id).delete()
+
+        # the updates above skip the signals which keep the job counts and search index in step
+        refresh_job_counts([keep_id, duplicate_id])
+        index_documents('customer', [keep_id, duplicate_id])
+        index_documents('vehicle', vehicle_ids)
+    return len(vehicle_ids)
@@ -0,0 +1,89 @@
+import uuid
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from nod.contacts import sync_contacts
+from nod.models import Vehicle, normalize_reg, reg_number_in_use
+from nod.search import index_documents
+
+
+# key of the session under which the customers being created are held until they're submitted
+DRAFTS_SESSION_KEY = 'customer_drafts'
+
+# how many drafts a session holds at once; the oldest are dropped, so abandoned forms don't grow the session
+MAX_DRAFTS = 10
+
+# fields of the vehicle form which are staged against a draft
+VEHICLE_FIELDS = ('reg_number', 'make', 'model', 'engine_serial', 'chassis_number', 'color', 'mot_base_date', 'type')
+
+
+# returns the key of a new draft customer. Nothing is stored until a vehicle is staged against it, so opening a
+# create customer page does no writes.
+def new_draft():
+    return uuid.uuid4().hex
+
+
+# returns the vehicles staged against a draft, as dicts of the vehicle form's fields along with a uuid
+def draft_vehicles(session, key):
+    return session.get(DRAFTS_SESSION_KEY, {}).get(key, {}).get('vehicles', [])
+
+
+# returns whether a registration number is taken, either by a saved vehicle or one already staged against the
+# draft, however it's spaced or cased
+def reg_number_taken(session, key, reg_number):
+    if any(normalize_reg(vehicle['reg_number']) == normalize_reg(reg_number)
+           for vehicle in draft_vehicles(session, key)):
+        return True
+    return reg_number_in_use(reg_number)
+
+
+# stages a vehicle against a draft customer, from the cleaned data of the vehicle form. It's saved along with
+# the customer when they're submitted.
+def stage_vehicle(session, key, data):
+    drafts = session.get(DRAFTS_SESSION_KEY, {})
+    draft = drafts.setdefault(key, {'started': timezone.now().isoformat(), 'vehicles': []})
+    vehicle = dict((field, data.get(field)) for field in VEHICLE_FIELDS)
+    # sessions are stored as JSON, so the date is kept as text
+    if vehicle['mot_base_date'] is not None:
+        vehicle['mot_base_date'] = vehicle['mot_base_date'].isoformat()
+    vehicle['uuid'] = uuid.uuid4().hex
+    draft['vehicles'].append(vehicle)
+
+    for old in sorted(drafts, key=lambda k: drafts[k]['started'])[:-MAX_DRAFTS]:
+        del drafts[old]
+    # assigned again so that the session knows it was changed
+    session[DRAFTS_SESSION_KEY] = drafts
+    return vehicle
+
+
+# drops a draft from the session, once its customer was saved
+def discard_draft(session, key):
+    drafts = session.get(DRAFTS_SESSION_KEY, {})
+    if drafts.pop(key, None) is not None:
+        session[DRAFTS_SESSION_KEY] = drafts
+
+
+# saves a new customer built from a submitted create customer form, together with their contacts and the
+# vehicles staged against their draft, then drops the draft. Meant to be called within a transaction, so that
+# the customer is saved whole or not at all.
+def save_draft(session, key, customer, email_formset, phone_formset):
+    customer.save()
+    sync_contacts(customer, email_formset, phone_formset)
+
+    vehicles = []
+    for staged in draft_vehicles(session, key):
+        vehicle = Vehicle(customer=customer, **dict((field, staged[field]) for field in VEHICLE_FIELDS))
+        if vehicle.mot_base_date is not None:
+            vehicle.mot_base_date = parse_date(vehicle.mot_base_date)
+        # bulk_create skips save(), so the uuid and search key are set here
+        vehicle.uuid = staged['uuid']
+        vehicle.reg_key = normalize_reg(vehicle.reg_number)
+        vehicles.append(vehicle)
+    Vehicle.objects.bulk_create(vehicles)
+    # bulk_create skips the save signal which keeps the search index in step
+    if vehicles:
+        index_documents('vehicle', customer.vehicle_set.values_list('id', flat=True))
+
+    discard_draft(session, key)
+    return customer
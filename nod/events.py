@@ -0,0 +1,126 @@
+import json
+import zlib
+from datetime import timedelta
+
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from nod.models import JobEvent
+from nod.utils import batches
+
+
+# packs the changed fields of an event into a compact payload
+def encode_changes(changes):
+    return zlib.compress(json.dumps(changes, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+
+
+# unpacks the changed fields of an event from its payload
+def decode_changes(payload):
+    if not payload:
+        return {}
+    return json.loads(zlib.decompress(bytes(payload)).decode('utf-8'))
+
+
+# returns the recorded fields of a job, along with the status and duration of its tasks and the quantity
+# of its parts, as plain values which can be compared and stored
+def job_snapshot(job):
+    snapshot = {
+        'status': job.status,
+        'type': job.type,
+        'bay': job.bay_id,
+        'mechanic': job.mechanic_id,
+        'booking_date': job.booking_date.isoformat() if job.booking_date else None,
+        'work_carried_out': job.work_carried_out,
+    }
+    for task_id, status, duration in job.jobtask_set.filter(is_deleted=False)\
+            .values_list('task_id', 'status', 'duration'):
+        snapshot['task:%s' % task_id] = [status, duration.total_seconds() if duration is not None else None]
+    for part_id, quantity in job.jobpart_set.filter(is_deleted=False).values_list('part_id', 'quantity'):
+        snapshot['part:%s' % part_id] = quantity
+    return snapshot
+
+
+# returns the fields which differ between two snapshots, as {field: [old value, new value]}
+def snapshot_changes(before, after):
+    changes = {}
+    for field in set(before) | set(after):
+        if before.get(field) != after.get(field):
+            changes[field] = [before.get(field), after.get(field)]
+    return changes
+
+
+# records what changed on a job since the given snapshot was taken (nothing, for a new job) by the given
+# staff member. Edits which didn't change anything aren't recorded.
+def record_job_event(job, before=None, staff=None):
+    changes = snapshot_changes(before or {}, job_snapshot(job))
+    if before is None:
+        kind = '1'
+    elif 'mechanic' in changes and before.get('mechanic') is None:
+        kind = '3'
+    elif changes:
+        kind = '2'
+    else:
+        return None
+    return JobEvent.objects.create(job=job, staff=staff, kind=kind, status=job.status,
+                                   payload=encode_changes(changes))
+
+
+# records the assignment of each of the given jobs to the given mechanics, as {job: mechanic}, in one insert
+def record_assignments(assignments, staff=None):
+    now = timezone.now()
+    JobEvent.objects.bulk_create([
+        JobEvent(job=job, created=now, staff=staff, kind='3', status=job.status,
+                 payload=encode_changes({'mechanic': [None, mechanic.id]}))
+        for job, mechanic in assignments.items()
+    ])
+
+
+# returns the status of each job just before the given moment, from the last event of each job before it
+def statuses_at(moment, job_ids=None):
+    events = JobEvent.objects.filter(created__lt=moment)
+    if job_ids is not None:
+        events = events.filter(job_id__in=job_ids)
+    # events are only ever appended, so the latest event of a job is also the one with the highest id
+    last_ids = [row['last_id'] for row in events.values('job_id').annotate(last_id=Max('id'))]
+    statuses = {}
+    for batch in batches(last_ids):
+        statuses.update(JobEvent.objects.filter(id__in=batch).values_list('job_id', 'status'))
+    return statuses
+
+
+# returns the time each job spent in each status between two moments, as {job id: {status: timedelta}},
+# worked out from the events of the jobs alone
+def time_in_status(start, end, job_ids=None):
+    end = min(end, timezone.now())
+    # jobs already complete by the start are left out, unless they're reopened during the period
+    current = dict((job_id, status) for job_id, status in statuses_at(start, job_ids).items() if status != '1')
+    since = dict((job_id, start) for job_id in current)
+    times = {}
+
+    events = JobEvent.objects.filter(created__gte=start, created__lt=end)
+    if job_ids is not None:
+        events = events.filter(job_id__in=job_ids)
+    for job_id, created, status in events.order_by('job', 'created', 'id').values_list('job_id', 'created', 'status'):
+        if job_id in current:
+            job_times = times.setdefault(job_id, {})
+            job_times[current[job_id]] = job_times.get(current[job_id], timedelta()) + \
+                (created - since[job_id])
+        current[job_id] = status
+        since[job_id] = created
+
+    for job_id, status in current.items():
+        job_times = times.setdefault(job_id, {})
+        job_times[status] = job_times.get(status, timedelta()) + (end - since[job_id])
+    return times
+
+
+# returns how long each job created between two moments waited before it was first assigned a mechanic,
+# as {job id: timedelta}; jobs still waiting are left out
+def waiting_times(start, end):
+    created = dict(JobEvent.objects.filter(kind='1', created__gte=start, created__lt=end)
+                   .values_list('job_id', 'created'))
+    # a job can only be assigned after it was created, so only assignments from the start onwards matter
+    assigned = JobEvent.objects.filter(kind='3', created__gte=start).values('job_id')\
+        .annotate(first=Min('created'))
+    return dict((row['job_id'], row['first'] - created[row['job_id']]) for row in assigned
+                if row['job_id'] in created)
@@ -0,0 +1,147 @@
+import csv
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from nod.models import Customer, Invoice, Job, Part, Vehicle, contacts_by_customer
+from nod.pricing import job_durations, parts_prices
+from nod.utils import seek_chunks
+
+
+# rows whose related data is fetched together while exporting
+EXPORT_CHUNK_SIZE = 500
+
+# formats rows can be exported in, with their content types
+FORMATS = OrderedDict([
+    ('csv', 'text/csv'),
+    ('jsonl', 'application/x-ndjson'),
+])
+
+
+class Echo(object):
+    """
+    A file-like object which hands back whatever is written to it, so that the csv writer can produce
+    rows one at a time to be streamed.
+    """
+
+    def write(self, value):
+        return value
+
+
+# returns the kind of a customer from the subclass rows they have
+def customer_kind(dropin_id, account_holder_id, business_customer_id):
+    if business_customer_id is not None:
+        return "Business Customer"
+    if account_holder_id is not None:
+        return "Account Holder"
+    if dropin_id is not None:
+        return "Drop In"
+    return ""
+
+
+CUSTOMER_COLUMNS = ['uuid', 'kind', 'forename', 'surname', 'company_name', 'rep_role', 'address', 'postcode',
+                    'date', 'emails', 'phones', 'mot_jobs', 'repair_jobs', 'annual_jobs']
+
+
+# returns every customer which isn't deleted as a row of CUSTOMER_COLUMNS, with the contacts of each chunk of
+# customers fetched together
+def customer_rows():
+    customers = Customer.objects.filter(is_deleted=False).values_list(
+        'id', 'uuid', 'forename', 'surname', 'dropin__id', 'accountholder__id', 'accountholder__businesscustomer__id',
+        'accountholder__businesscustomer__company_name', 'accountholder__businesscustomer__rep_role',
+        'accountholder__address', 'accountholder__postcode', 'date', 'mot_jobs', 'repair_jobs', 'annual_jobs')
+    for chunk in seek_chunks(customers, EXPORT_CHUNK_SIZE):
+        emails, phones = contacts_by_customer([customer[0] for customer in chunk])
+        for (pk, uuid, forename, surname, dropin_id, account_holder_id, business_customer_id, company_name,
+             rep_role, address, postcode, date, mot_jobs, repair_jobs, annual_jobs) in chunk:
+            yield [uuid, customer_kind(dropin_id, account_holder_id, business_customer_id), forename, surname,
+                   company_name or '', rep_role or '', address or '', postcode or '', date,
+                   "; ".join(emails[pk]), ", ".join(phones[pk]), mot_jobs, repair_jobs, annual_jobs]
+
+
+VEHICLE_COLUMNS = ['uuid', 'reg_number', 'make', 'model', 'engine_serial', 'chassis_number', 'color',
+                   'mot_base_date', 'type', 'customer_uuid']
+
+
+# returns every vehicle which isn't deleted as a row of VEHICLE_COLUMNS
+def vehicle_rows():
+    vehicles = Vehicle.objects.filter(is_deleted=False).values_list(
+        'id', 'uuid', 'reg_number', 'make', 'model', 'engine_serial', 'chassis_number', 'color', 'mot_base_date',
+        'type', 'customer__uuid')
+    for chunk in seek_chunks(vehicles, EXPORT_CHUNK_SIZE):
+        for vehicle in chunk:
+            yield list(vehicle[1:])
+
+
+JOB_COLUMNS = ['uuid', 'job_number', 'type', 'status', 'booking_date', 'reg_number', 'customer_uuid', 'bay_uuid',
+               'hours', 'labour_price', 'parts_price', 'price']
+
+
+# returns every job which isn't deleted as a row of JOB_COLUMNS, with the prices of each chunk of jobs worked
+# out together
+def job_rows():
+    jobs = Job.objects.filter(is_deleted=False).values_list(
+        'id', 'uuid', 'job_number', 'type', 'status', 'booking_date', 'vehicle__reg_number',
+        'vehicle__customer__uuid', 'bay__uuid', 'mechanic__hourly_pay')
+    for chunk in seek_chunks(jobs, EXPORT_CHUNK_SIZE):
+        prices = parts_prices(dict((job[0], job[5]) for job in chunk))
+        hours = job_durations([job[0] for job in chunk])
+        for pk, uuid, job_number, job_type, status, booking_date, reg_number, customer_uuid, bay_uuid, rate in chunk:
+            duration = round(hours.get(pk, 0), 2)
+            labour_price = round(duration * float(rate), 2) if rate is not None else None
+            parts_price = prices.get(pk, 0)
+            price = round(labour_price + parts_price, 2) if labour_price is not None else None
+            yield [uuid, job_number, job_type, status, booking_date, reg_number, customer_uuid, bay_uuid, duration,
+                   labour_price, parts_price, price]
+
+
+PART_COLUMNS = ['uuid', 'code', 'name', 'manufacturer', 'vehicle_type', 'years', 'price', 'quantity',
+                'low_level_threshold']
+
+
+# returns every part of the catalogue which isn't deleted as a row of PART_COLUMNS
+def part_rows():
+    parts = Part.objects.filter(is_deleted=False).values_list('id', *PART_COLUMNS)
+    for chunk in seek_chunks(parts, EXPORT_CHUNK_SIZE):
+        for part in chunk:
+            yield list(part[1:])
+
+
+INVOICE_COLUMNS = ['uuid', 'invoice_number', 'issue_date', 'reminder_phase', 'paid', 'job_number',
+                   'customer_uuid']
+
+
+# returns every invoice which isn't deleted as a row of INVOICE_COLUMNS, along with the job it's for and the
+# customer whose vehicle it was
+def invoice_rows():
+    invoices = Invoice.objects.filter(is_deleted=False).values_list(
+        'id', 'uuid', 'invoice_number', 'issue_date', 'reminder_phase', 'paid', 'job_done__job_number',
+        'job_done__vehicle__customer__uuid')
+    for chunk in seek_chunks(invoices, EXPORT_CHUNK_SIZE):
+        for invoice in chunk:
+            yield list(invoice[1:])
+
+
+# what can be exported, with the columns and rows of each
+EXPORTS = OrderedDict([
+    ('customers', (CUSTOMER_COLUMNS, customer_rows)),
+    ('vehicles', (VEHICLE_COLUMNS, vehicle_rows)),
+    ('jobs', (JOB_COLUMNS, job_rows)),
+    ('parts', (PART_COLUMNS, part_rows)),
+    ('invoices', (INVOICE_COLUMNS, invoice_rows)),
+])
+
+
+# returns the lines of an export in the given format, one row at a time, so that it can be streamed as it's
+# read from the database. csv exports start with a header; json lines exports give each row as an object.
+def export_lines(kind, format='csv'):
+    columns, rows = EXPORTS[kind]
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows():
+            yield writer.writerow(row)
+    else:
+        for row in rows():
+            yield json.dumps(OrderedDict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
@@ -0,0 +1,104 @@
+import re
+
+from django.db.models import Q
+
+from nod.models import Part, PartFitment
+from nod.utils import batches
+
+
+# separates the vehicles a part fits in its vehicle type, e.g. "Ford Focus/Fiesta, Vauxhall Astra"
+VEHICLE_SEPARATORS = re.compile(r'[,;/&+]')
+
+# a year, or range of years, a part fits, e.g. "2005", "2005-2011", "2005-" or "05-11"
+YEARS = re.compile(r'^\s*(\d{4}|\d{2})?\s*(-)?\s*(\d{4}|\d{2})?\s*$')
+
+# registration numbers of the current format, e.g. "AB12 CDE", whose digits give the year of registration
+CURRENT_REG = re.compile(r'^[A-Z]{2}(\d{2})[A-Z]{3}$')
+
+
+# returns a year written with two or four digits as a full year
+def full_year(year):
+    year = int(year)
+    if year < 100:
+        year += 2000 if year < 50 else 1900
+    return year
+
+
+# returns the first and last years of a range of years, either of which is None where it's left open.
+# Years which can't be read fit any year.
+def parse_years(years):
+    match = YEARS.match(years or '')
+    if match is None:
+        return None, None
+    start, dash, end = match.groups()
+    start = full_year(start) if start else None
+    end = full_year(end) if end else None
+    if not dash:
+        end = start
+    if start is not None and end is not None and start > end:
+        start, end = end, start
+    return start, end
+
+
+# returns the vehicles described by the free text vehicle type and years of a part, as a list of
+# (make, model, first year, last year) with the make and model lowercased. A model left blank fits every
+# model of the make, and a model given on its own belongs to the make before it.
+def parse_fitment(vehicle_type, years):
+    start, end = parse_years(years)
+    fitment = []
+    make = None
+    for vehicle in VEHICLE_SEPARATORS.split(vehicle_type or ''):
+        words = vehicle.lower().split()
+        if not words:
+            continue
+        if len(words) > 1 or make is None:
+            make, model = words[0], ' '.join(words[1:])
+        else:
+            model = words[0]
+        fitment.append((make, model, start, end))
+    return fitment
+
+
+# returns the year a vehicle was first registered from its registration number, where its format gives it
+def registration_year(reg_number):
+    match = CURRENT_REG.match(''.join(reg_number.split()).upper())
+    if match is None:
+        return None
+    age = int(match.group(1))
+    return 2000 + (age - 50 if age > 50 else age)
+
+
+# replaces the fitment rows of the given parts with those parsed from their vehicle types and years
+def rebuild_fitment(parts):
+    parts = list(parts)
+    for batch in batches([part.id for part in parts]):
+        PartFitment.objects.filter(part_id__in=batch).delete()
+    PartFitment.objects.bulk_create([
+        PartFitment(part_id=part.id, make=make, model=model, year_from=start, year_to=end)
+        for part in parts for make, model, start, end in parse_fitment(part.vehicle_type, part.years)
+    ], batch_size=500)
+
+
+# keeps the fitment of a part in step with its vehicle type and years. Connected to the save signal of Part.
+def refresh_part_fitment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_fitment([instance])
+
+
+# returns the fitment rows matching a vehicle: those for its make and model (or any model of its make),
+# covering the year it was registered where that's known
+def vehicle_fitment(vehicle):
+    model = vehicle.model.lower().strip()
+    # a part listed for a "Focus" also fits a "Focus ST"
+    models = set(['', model, model.split()[0] if model else ''])
+    fitment = PartFitment.objects.filter(make=vehicle.make.lower().strip(), model__in=models)
+    year = registration_year(vehicle.reg_number)
+    if year is not None:
+        fitment = fitment.filter(Q(year_from__isnull=True) | Q(year_from__lte=year),
+                                 Q(year_to__isnull=True) | Q(year_to__gte=year))
+    return fitment
+
+
+# returns the parts of the catalogue which fit the given vehicle
+def compatible_parts(vehicle):
+    return Part.objects.filter(is_deleted=False, id__in=vehicle_fitment(vehicle).values('part_id'))
@@ -0,0 +1,150 @@
+import math
+import uuid
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from nod.models import JobPart, OrderPartRelationship, Part, PartOrder, SellPart
+from nod.utils import batches
+
+
+# days of history the consumption of each part is measured over
+HISTORY_DAYS = 180
+
+# days between placing an order with a supplier and the parts arriving
+LEAD_TIME_DAYS = 7
+
+# days of consumption each order should cover beyond the lead time, before the next order is due
+REVIEW_DAYS = 14
+
+# number of standard deviations of daily consumption held as safety stock (about a 95% service level)
+SERVICE_FACTOR = 1.65
+
+
+class Forecast(object):
+    """
+    Consumption rates, variability and reorder points of a set of parts, computed with array
+    operations over the whole catalogue at once. Row i of every array belongs to part_ids[i].
+    """
+
+    def __init__(self, part_ids, stock, on_order, usage):
+        self.part_ids = part_ids
+        self.stock = stock
+        self.on_order = on_order
+
+        # mean and standard deviation of the number of each part used per day
+        self.rate = usage.mean(axis=1)
+        self.deviation = usage.std(axis=1)
+
+        # stock needed to last until an order placed now arrives, plus a margin for busier days
+        safety_stock = SERVICE_FACTOR * self.deviation * math.sqrt(LEAD_TIME_DAYS)
+        self.reorder_point = np.ceil(self.rate * LEAD_TIME_DAYS + safety_stock)
+        self.order_up_to = np.ceil(self.rate * (LEAD_TIME_DAYS + REVIEW_DAYS) + safety_stock)
+
+        # parts at or below their reorder point are ordered back up to their target level
+        position = self.stock + self.on_order
+        self.order_quantity = np.where((position <= self.reorder_point) & (self.rate > 0),
+                                       np.maximum(self.order_up_to - position, 0), 0).astype(int)
+
+    # returns {part id: quantity} for every part which needs ordering
+    def orders(self):
+        rows = np.nonzero(self.order_quantity)[0]
+        return dict((self.part_ids[i], int(self.order_quantity[i])) for i in rows)
+
+    # returns {part id: reorder point} for every part used at all during the history
+    def reorder_points(self):
+        rows = np.nonzero(self.rate)[0]
+        return dict((self.part_ids[i], int(self.reorder_point[i])) for i in rows)
+
+
+# returns a (parts x days) array of the quantity of each part used for jobs or sold on each day of the
+# history, from one query over job parts and one over parts sold
+def daily_usage(part_index, start, days):
+    usage = np.zeros((len(part_index), days))
+    history = [
+        JobPart.objects.filter(is_deleted=False, job__is_deleted=False, job__booking_date__gte=start)
+        .values_list('part_id', 'job__booking_date', 'quantity'),
+        SellPart.objects.filter(is_deleted=False, order__date__gte=start)
+        .values_list('part_id', 'order__date', 'quantity'),
+    ]
+    rows, columns, quantities = [], [], []
+    for queryset in history:
+        for part_id, date, quantity in queryset.iterator():
+            day = (date - start).days
+            if part_id in part_index and 0 <= day < days:
+                rows.append(part_index[part_id])
+                columns.append(day)
+                quantities.append(quantity)
+    # several uses of the same part on the same day all add up
+    np.add.at(usage, (np.array(rows, dtype=int), np.array(columns, dtype=int)), quantities)
+    return usage
+
+
+# returns {part id: quantity} already on order in draft orders which haven't been placed yet
+def draft_quantities():
+    return dict(OrderPartRelationship.objects.filter(is_deleted=False, order__is_draft=True, order__is_deleted=False)
+                .values('part_id').annotate(total=Sum('quantity')).values_list('part_id', 'total'))
+
+
+# forecasts the consumption of every part in the catalogue from the given number of days of history
+def forecast(days=HISTORY_DAYS):
+    now = timezone.now()
+    start = now - timedelta(days=days)
+    parts = list(Part.objects.filter(is_deleted=False).values_list('id', 'quantity'))
+    part_ids = [part_id for part_id, quantity in parts]
+    part_index = dict((part_id, i) for i, part_id in enumerate(part_ids))
+
+    drafts = draft_quantities()
+    stock = np.array([quantity for part_id, quantity in parts], dtype=float)
+    on_order = np.array([drafts.get(part_id, 0) for part_id in part_ids], dtype=float)
+    return Forecast(part_ids, stock, on_order, daily_usage(part_index, start, days))
+
+
+# returns {part id: supplier id} of the supplier each part was last delivered by
+def last_suppliers(part_ids):
+    last_ids = [row['last_id'] for row in OrderPartRelationship.objects
+                .filter(is_deleted=False, order__is_deleted=False, order__is_draft=False)
+                .values('part_id').annotate(last_id=Max('id'))]
+    suppliers = {}
+    for batch in batches(last_ids):
+        suppliers.update(OrderPartRelationship.objects.filter(id__in=batch)
+                         .values_list('part_id', 'order__supplier_id'))
+    return dict((part_id, suppliers[part_id]) for part_id in part_ids if part_id in suppliers)
+
+
+# creates one draft replenishment order per supplier holding the parts to reorder from them, from the
+# given {part id: quantity}. Parts never delivered by any supplier can't be ordered and are returned.
+def create_draft_orders(quantities):
+    suppliers = last_suppliers(list(quantities))
+    by_supplier = {}
+    for part_id, quantity in quantities.items():
+        if part_id in suppliers:
+            by_supplier.setdefault(suppliers[part_id], []).append((part_id, quantity))
+
+    orders = []
+    with transaction.atomic():
+        for supplier_id, parts in by_supplier.items():
+            order = PartOrder.objects.create(supplier_id=supplier_id, is_draft=True)
+            # bulk_create skips save(), so the uuids are generated here
+            OrderPartRelationship.objects.bulk_create([
+                OrderPartRelationship(order=order, part_id=part_id, quantity=quantity, uuid=uuid.uuid4().hex)
+                for part_id, quantity in parts
+            ], batch_size=500)
+            order.update_total_price()
+            orders.append(order)
+    return orders, [part_id for part_id in quantities if part_id not in suppliers]
+
+
+# sets the low level threshold of every part to its forecast reorder point, with one update per distinct
+# reorder point
+def update_thresholds(reorder_points):
+    parts = {}
+    for part_id, reorder_point in reorder_points.items():
+        parts.setdefault(reorder_point, []).append(part_id)
+    with transaction.atomic():
+        for reorder_point, part_ids in parts.items():
+            for batch in batches(part_ids):
+                Part.objects.filter(id__in=batch).update(low_level_threshold=reorder_point)
@@ -7,6 +7,11 @@ from crispy_forms_foundation.layout import *
 from datetime import timedelta
 from crispy_forms_foundation.forms import FoundationModelForm
 from nod.models import *
+from nod.choices import CachedModelChoiceField
+from nod.contacts import normalize_phone, validate_phone_numbers
+from django.core.urlresolvers import reverse
+from django.forms.utils import flatatt
+from django.utils.html import format_html
 
 
 class EmailForm(forms.Form):
@@ -96,8 +101,9 @@ class PhoneForm(forms.Form):
 class BasePhoneFormSet(BaseFormSet):
     def clean(self):
         """
-        Adds validation to check that no two phones have the same type and number
-        and that all phones have both a type and a number.
+        Adds validation to check that no two phones have the same type and number,
+        that all phones have both a type and a number, and that every number is
+        of the right format.
         """
         if any(self.errors):
             return
@@ -112,6 +118,7 @@ class BasePhoneFormSet(BaseFormSet):
 
                 # Check that no two phone numbers have the same number
                 if phone_number and phone_type:
+                    phone_number = normalize_phone(phone_number)
                     if phone_number in phone_numbers:
                         duplicates = True
                     phone_numbers.append(phone_number)
@@ -128,6 +135,9 @@ class BasePhoneFormSet(BaseFormSet):
                         code="missing_phone_type"
                     )
 
+        # Check the format of every number at once, as they're saved without PhoneModel.save
+        validate_phone_numbers(phone_numbers)
+
 
 class PhoneFormSetHelper(FormHelper):
     def __init__(self, *args, **kwargs):
@@ -143,7 +153,7 @@ class PhoneFormSetHelper(FormHelper):
 
 
 class JobCreateTaskForm(forms.Form):
-    task_name = forms.ModelChoiceField(queryset=Task.objects.filter(is_deleted=False), required=False,
+    task_name = CachedModelChoiceField(queryset=Task.objects.filter(is_deleted=False), required=False,
                                        empty_label="Select Task")
 
 
@@ -171,7 +181,7 @@ class TaskCreateFormSetHelper(FormHelper):
 
 
 class JobTaskForm(forms.Form):
-    task_name = forms.ModelChoiceField(queryset=Task.objects.filter(is_deleted=False), required=False,
+    task_name = CachedModelChoiceField(queryset=Task.objects.filter(is_deleted=False), required=False,
                                        empty_label="Select Task")
     TASK_STATUS = [
         ('1', 'Complete'),
@@ -242,9 +252,51 @@ class TaskFormSetHelper(FormHelper):
         self.render_required_fields = True
 
 
+class PartPickerWidget(forms.Widget):
+    """
+    Renders a part as a hidden input holding its primary key, next to a text input that searches
+    the catalogue as the user types, instead of a select list of every part.
+    """
+
+    def render(self, name, value, attrs=None):
+        part = value
+        if value not in (None, '') and not isinstance(value, Part):
+            part = Part.objects.filter(pk=value).first()
+        label = str(part) if isinstance(part, Part) else ''
+        pk = part.pk if isinstance(part, Part) else ''
+
+        final_attrs = self.build_attrs(attrs, type='hidden', name=name, value=pk)
+        text_attrs = {
+            'type': 'text',
+            'name': name + '_label',
+            'value': label,
+            'class': 'form-control part-picker',
+            'placeholder': "Start typing a part code or name...",
+            'data-source': reverse('get-parts-autocomplete'),
+        }
+        if 'id' in final_attrs:
+            text_attrs['id'] = final_attrs['id'] + '_label'
+        return format_html('<input{} /><input{} />', flatatt(final_attrs), flatatt(text_attrs))
+
+
+class PartPickerField(forms.ModelChoiceField):
+    """
+    Picks a single part by primary key through a PartPickerWidget.
+    """
+    widget = PartPickerWidget
+
+    # hands the part itself to the widget, so it can be labelled without looking it up again
+    def prepare_value(self, value):
+        return value
+
+    def has_changed(self, initial, data):
+        if isinstance(initial, Part):
+            initial = initial.pk
+        return super(PartPickerField, self).has_changed(initial, data)
+
+
 class JobPartForm(forms.Form):
-    part_name = forms.ModelChoiceField(queryset=Part.objects.filter(is_deleted=False), required=False,
-                                       empty_label="Select Part")
+    part = PartPickerField(queryset=Part.objects.filter(is_deleted=False), required=False)
     quantity = forms.IntegerField(min_value=0, initial=1, required=False)
 
 
@@ -258,19 +310,19 @@ class BaseJobPartForm(BaseFormSet):
         if any(self.errors):
             return
 
-        part_names = []
+        parts = []
         duplicates = False
 
         for form in self.forms:
             if form.cleaned_data:
-                part_name = form.cleaned_data['part_name']
+                part = form.cleaned_data['part']
                 quantity = form.cleaned_data['quantity']
 
-                # Checks that no two task objects have the same name
-                if part_name:
-                    if part_name in part_names:
+                # Checks that no two part objects are the same
+                if part:
+                    if part in parts:
                         duplicates = True
-                    part_names.append(part_name)
+                    parts.append(part)
 
                 if duplicates:
                     raise form.ValidationError(
@@ -279,7 +331,7 @@ class BaseJobPartForm(BaseFormSet):
                     )
 
                 # Check that all parts have a quantity
-                if part_name and not quantity:
+                if part and not quantity:
                     raise forms.ValidationError(
                         'All parts must have a quantity.',
                         code='missing_part_quantity'
@@ -293,14 +345,14 @@ class PartFormSetHelper(FormHelper):
         self.form_class = 'form-horizontal'
         self.form_tag = False
         self.layout = Layout(
-            'part_name',
+            'part',
             'quantity',
         )
         self.render_required_fields = True
 
 
 class MechanicJobForm(forms.Form):
-    mechanic = forms.ModelChoiceField(queryset=Mechanic.objects.filter(is_deleted=False))
+    mechanic = CachedModelChoiceField(queryset=Mechanic.objects.filter(is_deleted=False).select_related('user'))
 
     def __init__(self, *args, **kwargs):
         self.helper = FormHelper()
@@ -330,7 +382,9 @@ class JobCreateForm(forms.Form):
     today = timezone.now().date()
     booking_date = forms.DateField(label="Booking Date", input_formats=['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y'],
                                    initial=today, widget=forms.DateInput(attrs={'type': 'date', 'class': 'datepicker'}))
-    bay = forms.ModelChoiceField(queryset=Bay.objects.filter(is_deleted=False), empty_label="Select Bay")
+    booking_time = forms.TimeField(required=False, input_formats=['%H:%M', '%H:%M:%S'],
+                                   widget=forms.TimeInput(attrs={'type': 'time'}))
+    bay = CachedModelChoiceField(queryset=Bay.objects.filter(is_deleted=False), empty_label="Select Bay")
 
     def __init__(self, *args, **kwargs):
         self.helper = FormHelper()
@@ -342,6 +396,7 @@ class JobCreateForm(forms.Form):
             'vehicle',
             'type',
             'booking_date',
+            'booking_time',
             'bay',
         )
         # customer_uuid = kwargs.pop('customer_uuid', None)
@@ -351,6 +406,7 @@ class JobCreateForm(forms.Form):
         self.fields['vehicle'].label = "Vehicle Registration No."
         self.fields['type'].label = "Service Type"
         self.fields['booking_date'].label = "Booking Date"
+        self.fields['booking_time'].label = "Booking Time"
         self.fields['bay'].label = "Bay"
 
         # TODO: limit vehicles only to those assigned to the given customer
@@ -364,9 +420,11 @@ class JobEditForm(forms.Form):
         attrs={'placeholder': "Vehicle Registration No.", 'rows': '1', 'readonly': True}))
     booking_date = forms.DateField(label="Booking Date", input_formats=['%d/%m/%Y', '%Y-%m-%d'],
                                    widget=forms.DateInput(attrs={'type': 'date', 'class': 'datepicker'}))
+    booking_time = forms.TimeField(required=False, input_formats=['%H:%M', '%H:%M:%S'],
+                                   widget=forms.TimeInput(attrs={'type': 'time'}))
     work_carried_out = forms.CharField(max_length=1000, required=False, widget=forms.Textarea(
         attrs={'placeholder': "Work Carried Out", 'rows': '3'}))
-    bay = forms.ModelChoiceField(queryset=Bay.objects.filter(is_deleted=False), empty_label="Select Bay")
+    bay = CachedModelChoiceField(queryset=Bay.objects.filter(is_deleted=False), empty_label="Select Bay")
     JOB_TYPE = [
         ('1', 'MOT'),
         ('2', 'Repair'),
@@ -383,6 +441,7 @@ class JobEditForm(forms.Form):
             'job_number',
             'vehicle',
             'booking_date',
+            'booking_time',
             'type',
             'bay',
             'work_carried_out',
@@ -393,6 +452,7 @@ class JobEditForm(forms.Form):
         self.fields['vehicle'].label = "Vehicle"
         self.fields['type'].label = "Service Type"
         self.fields['booking_date'].label = "Booking Date"
+        self.fields['booking_time'].label = "Booking Time"
         self.fields['work_carried_out'].label = "Work Carried Out"
 
 
@@ -591,7 +651,7 @@ class EditPartForm(forms.Form):
             'low_level_threshold',
         )
         super(EditPartForm, self).__init__(*args, **kwargs)
-        self.fields['quantity'].label = "Quantity"
+        self.fields['quantity'].label = "Quantity at Your Site"
         self.fields['price'].label = "Price (£)"
         self.fields['low_level_threshold'].label = "Low Level Threshold"
 
@@ -637,6 +697,113 @@ class CreatePartForm(forms.Form):
         self.fields['low_level_threshold'].label = "Low Level Threshold"
 
 
+class ImportPartsForm(forms.Form):
+    file = forms.FileField()
+    dry_run = forms.BooleanField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_action = 'POST'
+        self.helper.form_class = 'form-horizontal'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            'file',
+            'dry_run',
+        )
+        super(ImportPartsForm, self).__init__(*args, **kwargs)
+        self.fields['file'].label = "Catalogue (CSV)"
+        self.fields['dry_run'].label = "Only check the file, without saving"
+
+
+class RepriceForm(forms.Form):
+    CHANGE_KIND = [
+        ('1', 'Percentage (%)'),
+        ('2', 'Amount (£)'),
+    ]
+
+    manufacturer = forms.CharField(max_length=100, required=False, widget=forms.TextInput(
+        attrs={'placeholder': "Manufacturer", 'rows': '1'}))
+    vehicle_type = forms.CharField(max_length=100, required=False, widget=forms.TextInput(
+        attrs={'placeholder': "Vehicle Type", 'rows': '1'}))
+    supplier = forms.ModelChoiceField(queryset=Supplier.objects.filter(is_deleted=False), required=False)
+    kind = forms.ChoiceField(choices=CHANGE_KIND, initial='1')
+    change = forms.FloatField()
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_action = 'POST'
+        self.helper.form_class = 'form-horizontal'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            'manufacturer',
+            'vehicle_type',
+            'supplier',
+            'kind',
+            'change',
+        )
+        super(RepriceForm, self).__init__(*args, **kwargs)
+        self.fields['manufacturer'].label = "Manufacturer"
+        self.fields['vehicle_type'].label = "Vehicle Type"
+        self.fields['supplier'].label = "Delivered By"
+        self.fields['kind'].label = "Change By"
+        self.fields['change'].label = "Change"
+
+    def clean(self):
+        cleaned_data = super(RepriceForm, self).clean()
+        if cleaned_data.get('kind') == '1' and cleaned_data.get('change') is not None \
+                and cleaned_data['change'] <= -100:
+            raise forms.ValidationError("A price can't be reduced by 100% or more.")
+        return cleaned_data
+
+
+class SiteForm(forms.Form):
+    name = forms.CharField(max_length=100, widget=forms.TextInput(
+        attrs={'placeholder': "Name", 'rows': '1'}))
+    address = forms.CharField(max_length=80, required=False, widget=forms.TextInput(
+        attrs={'placeholder': "Address", 'rows': '1'}))
+    postcode = forms.CharField(max_length=8, required=False, widget=forms.TextInput(
+        attrs={'placeholder': "Postcode", 'rows': '1'}))
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_action = 'POST'
+        self.helper.form_class = 'form-horizontal'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            'name',
+            'address',
+            'postcode',
+        )
+        super(SiteForm, self).__init__(*args, **kwargs)
+        self.fields['name'].label = "Name"
+        self.fields['address'].label = "Address"
+        self.fields['postcode'].label = "Postcode"
+
+
+class StockTransferForm(forms.Form):
+    from_site = forms.ModelChoiceField(queryset=Site.objects.filter(is_deleted=False))
+    to_site = forms.ModelChoiceField(queryset=Site.objects.filter(is_deleted=False))
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_action = 'POST'
+        self.helper.form_class = 'form-horizontal'
+        self.helper.form_tag = False
+        self.helper.layout = Layout(
+            'from_site',
+            'to_site',
+        )
+        super(StockTransferForm, self).__init__(*args, **kwargs)
+        self.fields['from_site'].label = "From"
+        self.fields['to_site'].label = "To"
+
+    def clean(self):
+        cleaned_data = super(StockTransferForm, self).clean()
+        if cleaned_data.get('from_site') is not None and cleaned_data.get('from_site') == cleaned_data.get('to_site'):
+            raise forms.ValidationError("Stock can only be transferred between two different sites.")
+        return cleaned_data
+
+
 class ReplenishmentOrderForm(forms.Form):
     today = timezone.now().date()
     date = forms.DateField(input_formats=['%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y'], initial=today,
@@ -734,6 +901,7 @@ class UserForm(forms.Form):
     ]
     role = forms.ChoiceField(choices=ROLES)
     hourly_rate = forms.FloatField(min_value=0, required=False)
+    site = forms.ModelChoiceField(queryset=Site.objects.filter(is_deleted=False), required=False)
 
     def __init__(self, *args, **kwargs):
         self.helper = FormHelper()
@@ -745,6 +913,7 @@ class UserForm(forms.Form):
             'last_name',
             'role',
             'hourly_rate',
+            'site',
             'user_name',
             'password'
         )
@@ -755,6 +924,7 @@ class UserForm(forms.Form):
         self.fields['role'].label = "Role"
         self.fields['password'].label = "Password"
         self.fields['hourly_rate'].label = "Hourly Rate"
+        self.fields['site'].label = "Site"
 
 
 class PriceControlForm(forms.Form):
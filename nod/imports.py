@@ -0,0 +1,196 @@
+import csv
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from nod.fitment import rebuild_fitment
+from nod.models import Part, PartPrice, PartStock, StockMovement
+from nod.stock import OPENING_BALANCE, staff_site
+from nod.utils import ID_BATCH_SIZE, chunks
+
+
+# rows validated and written per transaction; the codes of a batch are looked up with a single IN query,
+# so it stays within the limit of query parameters of sqlite
+IMPORT_BATCH_SIZE = ID_BATCH_SIZE
+
+# how many rejected rows are kept to be reported; any more are only counted
+MAX_REJECTS = 1000
+
+# columns every row must fill in
+REQUIRED_COLUMNS = ('code', 'price')
+
+# columns which must be filled in for parts which don't exist yet
+NEW_PART_COLUMNS = ('name', 'manufacturer', 'vehicle_type', 'years')
+
+# columns which are copied onto the parts as they are, with their maximum lengths
+TEXT_COLUMNS = [(name, Part._meta.get_field(name).max_length)
+                for name in ('name', 'manufacturer', 'vehicle_type', 'years', 'code')]
+
+# low level threshold given to new parts which don't have one, as on the create part form
+DEFAULT_THRESHOLD = 10
+
+
+class ImportResult(object):
+    """
+    Counts of the parts created, updated and left unchanged by an import, along with the rows
+    which were rejected and why.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.rejects = []
+
+    # records a row which couldn't be imported
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REJECTS:
+            self.rejects.append((line, message))
+
+    def __str__(self):
+        return "%d parts created, %d updated, %d unchanged and %d rows rejected." % (
+            self.created, self.updated, self.unchanged, self.rejected)
+
+
+# reads the rows of a catalogue one at a time from the given lines of CSV, as (line number, row) with the
+# column names of the header lowercased and spaces replaced with underscores
+def read_rows(lines):
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower().replace(' ', '_') for column in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError("The file has no %s column." % ", ".join(missing))
+    for row in reader:
+        if any(value.strip() for value in row):
+            yield reader.line_num, dict(zip(columns, (value.strip() for value in row)))
+
+
+# returns a non-negative number read from the given column of a row, or None where it's left blank
+def read_number(row, column, convert):
+    value = row.get(column, '')
+    if not value:
+        return None
+    try:
+        number = convert(value)
+    except ValueError:
+        raise ValueError("%s is not a valid %s." % (value, column.replace('_', ' ')))
+    if number < 0:
+        raise ValueError("%s can't be negative." % column.replace('_', ' ').capitalize())
+    return number
+
+
+# validates a row of a catalogue, returning the values it gives for a part. Columns left blank are left out.
+def clean_row(row):
+    values = {}
+    for column, max_length in TEXT_COLUMNS:
+        if row.get(column):
+            if len(row[column]) > max_length:
+                raise ValueError("%s is longer than %d characters." % (column.replace('_', ' ').capitalize(),
+                                                                       max_length))
+            values[column] = row[column]
+    if 'code' not in values:
+        raise ValueError("The code is missing.")
+
+    price = read_number(row, 'price', float)
+    if price is None:
+        raise ValueError("The price is missing.")
+    values['price'] = price
+    for column in ('quantity', 'low_level_threshold'):
+        number = read_number(row, column, int)
+        if number is not None:
+            values[column] = number
+    return values
+
+
+# creates the parts of a batch which don't exist yet and updates those which do, in a single transaction.
+# New parts are inserted together and their stock recorded as their opening balances at the given site.
+# Existing parts only have their catalogue details updated; their stock is left to the ledger.
+def import_batch(rows, result, staff=None, site=None):
+    # a later row for the same code replaces an earlier one, as it would in a later batch
+    parts = {}
+    for line, row in rows:
+        try:
+            values = clean_row(row)
+        except ValueError as e:
+            result.reject(line, str(e))
+        else:
+            parts[values['code']] = (line, values)
+
+    with transaction.atomic():
+        existing = dict((part.code, part) for part in Part.all_objects.filter(code__in=list(parts)))
+        now = timezone.now()
+        new_parts = []
+        prices = []
+        refitted = []
+        for code, (line, values) in parts.items():
+            part = existing.get(code)
+            if part is None:
+                missing = [column.replace('_', ' ') for column in NEW_PART_COLUMNS if column not in values]
+                if missing:
+                    result.reject(line, "New part %s has no %s." % (code, ", ".join(missing)))
+                    continue
+                values.setdefault('quantity', 0)
+                values.setdefault('low_level_threshold', DEFAULT_THRESHOLD)
+                # bulk_create skips save(), so the uuids and search keys are set here
+                new_parts.append(Part(uuid=uuid.uuid4().hex, name_key=values['name'].lower(),
+                                      code_key=code.lower(), **values))
+                continue
+
+            values.pop('quantity', None)
+            changes = dict((field, value) for field, value in values.items() if getattr(part, field) != value)
+            if changes or part.is_deleted:
+                if 'name' in changes:
+                    changes['name_key'] = changes['name'].lower()
+                Part.all_objects.filter(id=part.id).update(is_deleted=False, updated=now, **changes)
+                if 'price' in changes:
+                    prices.append(PartPrice(part_id=part.id, price=changes['price'], effective_from=now, staff=staff))
+                if 'vehicle_type' in changes or 'years' in changes:
+                    refitted.append(part.code)
+                result.updated += 1
+            else:
+                result.unchanged += 1
+
+        if new_parts:
+            Part.objects.bulk_create(new_parts)
+            # bulk_create doesn't return the ids of the new parts, so they're looked up to open their ledgers
+            # and price histories
+            created = list(Part.objects.filter(code__in=[part.code for part in new_parts])
+                           .values_list('id', 'quantity', 'price'))
+            StockMovement.objects.bulk_create([
+                StockMovement(part_id=part_id, date=now, kind=OPENING_BALANCE, quantity=quantity,
+                              balance=quantity, staff=staff, site=site)
+                for part_id, quantity, price in created
+            ])
+            if site is not None:
+                PartStock.objects.bulk_create([
+                    PartStock(part_id=part_id, site=site, quantity=quantity, uuid=uuid.uuid4().hex)
+                    for part_id, quantity, price in created
+                ])
+            prices.extend(PartPrice(part_id=part_id, price=price, effective_from=now, staff=staff)
+                          for part_id, quantity, price in created)
+            result.created += len(new_parts)
+            refitted.extend(part.code for part in new_parts)
+        PartPrice.objects.bulk_create(prices)
+        # update() and bulk_create skip the save signal which keeps fitment in step, so it's rebuilt here
+        if refitted:
+            rebuild_fitment(Part.objects.filter(code__in=refitted).only('id', 'vehicle_type', 'years'))
+
+
+# imports a catalogue from the given lines of CSV, reading and writing it a batch at a time so that only
+# one batch is ever held in memory. The stock of new parts is held at the staff member's site. Every batch
+# is saved as it's imported, unless this is a dry run.
+def import_parts(lines, staff=None, dry_run=False):
+    result = ImportResult()
+    site = staff_site(staff)
+    for rows in chunks(read_rows(lines), IMPORT_BATCH_SIZE):
+        with transaction.atomic():
+            import_batch(rows, result, staff=staff, site=site)
+            if dry_run:
+                transaction.set_rollback(True)
+    return result
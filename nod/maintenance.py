@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from nod.models import AccountHolder, BusinessCustomer, Customer, CustomerPartsOrder, Dropin, Statement, Vehicle
+from nod.search import index_documents
+from nod.utils import batches
+
+
+# how long a customer can be left without a name before they're taken to be abandoned
+ABANDONED_AFTER = timedelta(minutes=30)
+
+
+# returns the customers which were created empty by the create customer pages but never submitted, and which
+# haven't been touched since the given moment. Business customers are only abandoned without a company name.
+def abandoned_customers(before):
+    return Customer.objects.filter(forename="", surname="", updated__lt=before).filter(
+        Q(accountholder__businesscustomer=None) | Q(accountholder__businesscustomer__company_name=""))
+
+
+# returns the filter matching the customers which anything else refers to: vehicles, whose jobs and invoices
+# hang off them, part orders, which carry their own invoices, or statements
+def attached():
+    content_types = [ContentType.objects.get_for_model(model) for model in (Dropin, AccountHolder, BusinessCustomer)]
+    return Q(id__in=Vehicle.all_objects.values('customer_id')) | \
+        Q(id__in=CustomerPartsOrder.all_objects.filter(content_type__in=content_types).values('object_id')) | \
+        Q(id__in=Statement.all_objects.values('customer_id'))
+
+
+# purges the abandoned customers. Those which nothing refers to are deleted, with a delete over each table
+# rather than one customer at a time. Deleting the others would take their jobs, invoices and orders with them,
+# so they're soft deleted along with their vehicles instead. Returns the number of customers purged.
+def purge_abandoned_customers(before=None, dry_run=False):
+    if before is None:
+        before = timezone.now() - ABANDONED_AFTER
+    abandoned = abandoned_customers(before)
+    count = abandoned.count()
+    if count and not dry_run:
+        now = timezone.now()
+        with transaction.atomic():
+            kept = list(abandoned.filter(attached()).values_list('id', flat=True))
+            abandoned.exclude(attached()).delete()
+            for batch in batches(kept):
+                vehicle_ids = list(Vehicle.objects.filter(customer_id__in=batch).values_list('id', flat=True))
+                Vehicle.all_objects.filter(id__in=vehicle_ids).update(is_deleted=True, updated=now)
+                Customer.all_objects.filter(id__in=batch).update(is_deleted=True, updated=now)
+                # updates skip the save signals which keep the search index in step
+                index_documents('vehicle', vehicle_ids)
+                index_documents('customer', batch)
+    return count
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from nod.assignment import apply_assignments, propose_assignments
+
+
+class Command(BaseCommand):
+    help = "Assigns every untaken job to a mechanic, balancing the outstanding estimated hours of each mechanic."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only list the proposed assignments, without saving them.")
+
+    def handle(self, *args, **options):
+        assignments = propose_assignments()
+        for assignment in assignments:
+            self.stdout.write("Job No.%s -> %s (%.2f hours, %.2f outstanding)" % (
+                assignment.job.job_number, assignment.mechanic, assignment.hours, assignment.load))
+
+        if options['dry_run']:
+            self.stdout.write("%d jobs would be assigned." % len(assignments))
+        else:
+            self.stdout.write("%d jobs were assigned." % apply_assignments(assignments))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from nod.dedup import MERGE_SCORE, find_duplicates, merge_customers, rebuild_blocking_keys, survivor
+from nod.models import CustomerBlockingKey
+
+
+class Command(BaseCommand):
+    help = "Finds customers who are likely to be the same person, from the phone numbers, emails, names and " \
+           "postcodes they share, and optionally merges them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-score', type=float, default=MERGE_SCORE, dest='min_score',
+                            help="Score out of 1 from which a pair of customers is reported.")
+        parser.add_argument('--merge', action='store_true', dest='merge', default=False,
+                            help="Merge each pair found, rather than only listing them.")
+
+    def handle(self, *args, **options):
+        rebuild_blocking_keys()
+        self.stdout.write("%d blocking keys were built." % CustomerBlockingKey.objects.count())
+
+        merged = set()
+        duplicates = find_duplicates(options['min_score'])
+        for pair_score, first, second, kinds in duplicates:
+            names = ", ".join(dict(CustomerBlockingKey.KINDS)[kind] for kind in kinds)
+            if not options['merge']:
+                self.stdout.write("%d and %d: %.2f (%s)" % (first, second, pair_score, names))
+                continue
+            # a customer merged away earlier in the run is left for the next run, when its keys belong to the
+            # customer it was merged into
+            if first in merged or second in merged:
+                continue
+            keep_id, duplicate_id = survivor(first, second)
+            moved = merge_customers(keep_id, duplicate_id)
+            merged.add(duplicate_id)
+            self.stdout.write("%d was merged into %d, with %d vehicles: %.2f (%s)"
+                              % (duplicate_id, keep_id, moved, pair_score, names))
+
+        if options['merge']:
+            self.stdout.write("%d customers were merged." % len(merged))
+        else:
+            self.stdout.write("%d likely duplicates were found." % len(duplicates))
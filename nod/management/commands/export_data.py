@@ -0,0 +1,28 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nod.exports import EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = "Writes every customer, vehicle, job, part or invoice out as csv or json lines, a chunk of rows at " \
+           "a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS), help="What to export.")
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', help="Format to export in.")
+        parser.add_argument('--output', help="File to write to, rather than the standard output.")
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+        except IOError as e:
+            raise CommandError("Couldn't write to %s: %s" % (options['output'], e))
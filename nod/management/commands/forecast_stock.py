@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from nod.forecasting import HISTORY_DAYS, create_draft_orders, forecast, update_thresholds
+
+
+class Command(BaseCommand):
+    help = "Forecasts the consumption of every part and drafts replenishment orders, grouped by supplier, " \
+           "for the parts which have fallen to their reorder point."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=HISTORY_DAYS,
+                            help="Days of history to measure consumption over.")
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only report the parts which need ordering, without drafting any orders.")
+        parser.add_argument('--update-thresholds', action='store_true', dest='update_thresholds', default=False,
+                            help="Also set the low level threshold of each part to its forecast reorder point.")
+
+    def handle(self, *args, **options):
+        result = forecast(days=options['days'])
+        quantities = result.orders()
+        self.stdout.write("%d of %d parts need ordering." % (len(quantities), len(result.part_ids)))
+
+        if options['dry_run']:
+            return
+
+        orders, unordered = create_draft_orders(quantities)
+        self.stdout.write("%d draft orders were created." % len(orders))
+        if unordered:
+            self.stdout.write("%d parts have never been delivered by a supplier and were left out." % len(unordered))
+
+        if options['update_thresholds']:
+            update_thresholds(result.reorder_points())
+            self.stdout.write("Low level thresholds were updated.")
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nod.statements import generate_statements
+
+
+class Command(BaseCommand):
+    help = "Generates the monthly statements of every account holder and business customer, replacing any " \
+           "generated for the month before."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help="Month to generate the statements of, as YYYY-MM. Defaults to the "
+                                            "month before this one.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of processes rendering the statements. Defaults to one for each processor.")
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = datetime.datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("The month must be given as YYYY-MM.")
+        else:
+            month = (datetime.date.today().replace(day=1) - datetime.timedelta(days=1)).replace(day=1)
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError("There must be at least one worker.")
+
+        count = generate_statements(month, options['workers'])
+        self.stdout.write("%d statements were generated for %s." % (count, month.strftime('%B %Y')))
@@ -0,0 +1,29 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nod.imports import import_parts
+
+
+class Command(BaseCommand):
+    help = "Imports a catalogue of parts from a CSV file, creating new parts and updating existing ones by code."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row naming at least the code and price columns.")
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only validate the file and report what would change, without saving anything.")
+
+    def handle(self, *args, **options):
+        try:
+            with io.open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                result = import_parts(lines, dry_run=options['dry_run'])
+        except (IOError, UnicodeDecodeError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for line, message in result.rejects:
+            self.stdout.write("Line %d: %s" % (line, message))
+        if result.rejected > len(result.rejects):
+            self.stdout.write("... and %d more rejected rows." % (result.rejected - len(result.rejects)))
+        self.stdout.write(str(result))
+        if options['dry_run']:
+            self.stdout.write("Nothing was saved.")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from nod.fitment import rebuild_fitment
+from nod.models import Part, PartFitment
+from nod.utils import chunks
+
+
+class Command(BaseCommand):
+    help = "Parses the vehicles every part fits from its vehicle type and years again, replacing its fitment rows."
+
+    def handle(self, *args, **options):
+        parts = Part.objects.only('id', 'vehicle_type', 'years').order_by('id')
+        for batch in chunks(parts.iterator()):
+            rebuild_fitment(batch)
+        self.stdout.write("%d fitment rows were built for %d parts." % (PartFitment.objects.count(), parts.count()))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from nod.search import SEARCH_TABLE, rebuild_index, search_enabled
+
+
+class Command(BaseCommand):
+    help = "Indexes every customer, vehicle, job and invoice for search again, replacing the whole index."
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            self.stdout.write("Search needs an SQLite database with FTS5.")
+            return
+        rebuild_index()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM " + SEARCH_TABLE)
+            self.stdout.write("%d documents were indexed." % cursor.fetchone()[0])
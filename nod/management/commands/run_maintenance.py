@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from nod.archive import archive_deleted
+from nod.counters import recount_jobs
+from nod.maintenance import purge_abandoned_customers
+
+
+class Command(BaseCommand):
+    help = "Runs the scheduled upkeep of the database, purging the customers which were left empty on the " \
+           "create customer pages, archiving the rows which have been soft deleted for long enough and " \
+           "recounting the jobs of every customer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run', default=False,
+                            help="Only report what would be purged and archived, without changing anything.")
+
+    def handle(self, *args, **options):
+        purged = purge_abandoned_customers(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write("%d abandoned customers would be purged." % purged)
+        else:
+            self.stdout.write("%d abandoned customers were purged." % purged)
+
+        for label, archived in archive_deleted(dry_run=options['dry_run']).items():
+            if options['dry_run']:
+                self.stdout.write("%d deleted rows of %s would be archived." % (archived, label))
+            else:
+                self.stdout.write("%d deleted rows of %s were archived." % (archived, label))
+
+        if not options['dry_run']:
+            recount_jobs()
+            self.stdout.write("The jobs of every customer were recounted.")
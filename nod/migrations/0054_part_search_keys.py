@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# fills in the search keys of the parts which already exist
+def populate_search_keys(apps, schema_editor):
+    Part = apps.get_model('nod', 'Part')
+    for part in Part.objects.all():
+        Part.objects.filter(id=part.id).update(name_key=part.name.strip().lower(),
+                                               code_key=part.code.strip().lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0053_job_bay_booking_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='part',
+            name='name_key',
+            field=models.CharField(default='', max_length=100, editable=False, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='part',
+            name='code_key',
+            field=models.CharField(default='', max_length=20, editable=False, db_index=True),
+        ),
+        migrations.RunPython(populate_search_keys, migrations.RunPython.noop),
+    ]
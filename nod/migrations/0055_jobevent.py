@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0054_part_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, db_index=True)),
+                ('kind', models.CharField(max_length=1, choices=[('1', 'Created'), ('2', 'Edited'), ('3', 'Assigned')])),
+                ('status', models.CharField(max_length=1, choices=[('1', 'Complete'), ('2', 'Started'), ('3', 'Pending')])),
+                ('payload', models.BinaryField()),
+                ('job', models.ForeignKey(to='nod.Job')),
+                ('staff', models.ForeignKey(to='nod.StaffMember', null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='jobevent',
+            index_together=set([('job', 'created')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+# starts the ledger of every existing part from its current stock
+def seed_opening_balances(apps, schema_editor):
+    Part = apps.get_model('nod', 'Part')
+    StockMovement = apps.get_model('nod', 'StockMovement')
+    now = django.utils.timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(part_id=part_id, date=now, kind='5', quantity=quantity, balance=quantity)
+        for part_id, quantity in Part.objects.values_list('id', 'quantity')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0055_jobevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.CharField(max_length=1, choices=[('1', 'Delivery'), ('2', 'Job'), ('3', 'Sale'), ('4', 'Adjustment'), ('5', 'Opening Balance')])),
+                ('quantity', models.IntegerField()),
+                ('balance', models.IntegerField()),
+                ('customer_order', models.ForeignKey(to='nod.CustomerPartsOrder', null=True)),
+                ('job', models.ForeignKey(to='nod.Job', null=True)),
+                ('part', models.ForeignKey(to='nod.Part')),
+                ('part_order', models.ForeignKey(to='nod.PartOrder', null=True)),
+                ('staff', models.ForeignKey(to='nod.StaffMember', null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='stockmovement',
+            index_together=set([('part', 'date')]),
+        ),
+        migrations.RunPython(seed_opening_balances, migrations.RunPython.noop),
+    ]
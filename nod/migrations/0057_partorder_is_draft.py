@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0056_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partorder',
+            name='is_draft',
+            field=models.BooleanField(default=False),
+        ),
+    ]
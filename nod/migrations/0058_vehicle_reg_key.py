@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# fills in the search key of the vehicles which already exist
+def populate_reg_keys(apps, schema_editor):
+    Vehicle = apps.get_model('nod', 'Vehicle')
+    for vehicle_id, reg_number in Vehicle.objects.values_list('id', 'reg_number'):
+        Vehicle.objects.filter(id=vehicle_id).update(reg_key=''.join(reg_number.split()).upper())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0057_partorder_is_draft'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='reg_key',
+            field=models.CharField(default='', max_length=100, editable=False, db_index=True),
+        ),
+        migrations.RunPython(populate_reg_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+# starts the price history of every existing part from its current price, in effect since it was created
+def seed_prices(apps, schema_editor):
+    Part = apps.get_model('nod', 'Part')
+    PartPrice = apps.get_model('nod', 'PartPrice')
+    PartPrice.objects.bulk_create([
+        PartPrice(part_id=part_id, price=price, effective_from=created)
+        for part_id, price, created in Part.objects.order_by('id').values_list('id', 'price', 'created')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0058_vehicle_reg_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartPrice',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('price', models.FloatField()),
+                ('effective_from', models.DateTimeField(default=django.utils.timezone.now)),
+                ('part', models.ForeignKey(to='nod.Part')),
+                ('staff', models.ForeignKey(to='nod.StaffMember', null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='partprice',
+            index_together=set([('part', 'effective_from')]),
+        ),
+        migrations.RunPython(seed_prices, migrations.RunPython.noop),
+    ]
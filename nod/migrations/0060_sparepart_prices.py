@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F, FloatField, Sum
+
+
+# existing reports were always costed at the current price of their parts, so that's the price they keep
+def seed_report_prices(apps, schema_editor):
+    Part = apps.get_model('nod', 'Part')
+    SparePart = apps.get_model('nod', 'SparePart')
+    SparePartsReport = apps.get_model('nod', 'SparePartsReport')
+    for part_id, price in Part.objects.values_list('id', 'price'):
+        SparePart.objects.filter(part_id=part_id).update(initial_price=price, unit_price=price)
+    for report in SparePartsReport.objects.all():
+        totals = SparePart.objects.filter(report=report, is_deleted=False).aggregate(
+            initial=Sum(F('initial_stock_level') * F('initial_price'), output_field=FloatField()),
+            stock=Sum(F('new_stock_level') * F('unit_price'), output_field=FloatField()))
+        SparePartsReport.objects.filter(id=report.id).update(total_initial_cost=round(totals['initial'] or 0, 2),
+                                                             total_stock_cost=round(totals['stock'] or 0, 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0059_partprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sparepart',
+            name='initial_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sparepart',
+            name='unit_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sparepartsreport',
+            name='total_initial_cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sparepartsreport',
+            name='total_stock_cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(seed_report_prices, migrations.RunPython.noop),
+    ]
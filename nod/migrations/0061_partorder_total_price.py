@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F, FloatField, Sum
+
+
+# stores the value of every existing order, worked out for all of them in one grouped query
+def seed_total_prices(apps, schema_editor):
+    PartOrder = apps.get_model('nod', 'PartOrder')
+    OrderPartRelationship = apps.get_model('nod', 'OrderPartRelationship')
+    totals = OrderPartRelationship.objects.filter(is_deleted=False).values('order_id').annotate(
+        total=Sum(F('quantity') * F('part__price'), output_field=FloatField()))
+    for row in totals:
+        PartOrder.objects.filter(id=row['order_id']).update(total_price=round(row['total'] or 0, 2))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0060_sparepart_prices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partorder',
+            name='total_price',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(seed_total_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import concurrency.fields
+import django.utils.timezone
+import uuid
+
+
+# puts everything which already exists at a single site, holding all of the stock
+def seed_main_site(apps, schema_editor):
+    Site = apps.get_model('nod', 'Site')
+    Bay = apps.get_model('nod', 'Bay')
+    StaffMember = apps.get_model('nod', 'StaffMember')
+    Part = apps.get_model('nod', 'Part')
+    PartStock = apps.get_model('nod', 'PartStock')
+    StockMovement = apps.get_model('nod', 'StockMovement')
+
+    site = Site.objects.create(name='Main Workshop', uuid=uuid.uuid4().hex)
+    Bay.objects.update(site=site)
+    StaffMember.objects.update(site=site)
+    StockMovement.objects.update(site=site)
+    PartStock.objects.bulk_create([
+        PartStock(part_id=part_id, site=site, quantity=quantity, uuid=uuid.uuid4().hex)
+        for part_id, quantity in Part.objects.values_list('id', 'quantity')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0061_partorder_total_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', concurrency.fields.IntegerVersionField(help_text='record revision number', default=1)),
+                ('uuid', models.CharField(default='', editable=False, max_length=32, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('address', models.CharField(max_length=80, blank=True)),
+                ('postcode', models.CharField(max_length=8, blank=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PartStock',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', concurrency.fields.IntegerVersionField(help_text='record revision number', default=1)),
+                ('uuid', models.CharField(default='', editable=False, max_length=32, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('part', models.ForeignKey(to='nod.Part')),
+                ('site', models.ForeignKey(to='nod.Site')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='partstock',
+            unique_together=set([('part', 'site')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='partstock',
+            index_together=set([('site', 'quantity')]),
+        ),
+        migrations.CreateModel(
+            name='StockTransfer',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', concurrency.fields.IntegerVersionField(help_text='record revision number', default=1)),
+                ('uuid', models.CharField(default='', editable=False, max_length=32, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('from_site', models.ForeignKey(related_name='transfers_out', to='nod.Site')),
+                ('to_site', models.ForeignKey(related_name='transfers_in', to='nod.Site')),
+                ('staff', models.ForeignKey(to='nod.StaffMember', null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TransferPartRelationship',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', concurrency.fields.IntegerVersionField(help_text='record revision number', default=1)),
+                ('uuid', models.CharField(default='', editable=False, max_length=32, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('quantity', models.PositiveIntegerField()),
+                ('part', models.ForeignKey(to='nod.Part')),
+                ('transfer', models.ForeignKey(to='nod.StockTransfer')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='stocktransfer',
+            name='parts',
+            field=models.ManyToManyField(to='nod.Part', through='nod.TransferPartRelationship'),
+        ),
+        migrations.AddField(
+            model_name='bay',
+            name='site',
+            field=models.ForeignKey(to='nod.Site', null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='staffmember',
+            name='site',
+            field=models.ForeignKey(to='nod.Site', null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='site',
+            field=models.ForeignKey(to='nod.Site', null=True),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='transfer',
+            field=models.ForeignKey(to='nod.StockTransfer', null=True),
+        ),
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='kind',
+            field=models.CharField(max_length=1, choices=[('1', 'Delivery'), ('2', 'Job'), ('3', 'Sale'), ('4', 'Adjustment'), ('5', 'Opening Balance'), ('6', 'Transfer')]),
+        ),
+        migrations.RunPython(seed_main_site, migrations.RunPython.noop),
+    ]
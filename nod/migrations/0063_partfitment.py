@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# parses the fitment of every existing part from its vehicle type and years
+def seed_fitment(apps, schema_editor):
+    from nod.fitment import parse_fitment
+    Part = apps.get_model('nod', 'Part')
+    PartFitment = apps.get_model('nod', 'PartFitment')
+    PartFitment.objects.bulk_create([
+        PartFitment(part_id=part_id, make=make, model=model, year_from=start, year_to=end)
+        for part_id, vehicle_type, years in Part.objects.values_list('id', 'vehicle_type', 'years')
+        for make, model, start, end in parse_fitment(vehicle_type, years)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0062_sites'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartFitment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('make', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100, blank=True)),
+                ('year_from', models.PositiveSmallIntegerField(null=True)),
+                ('year_to', models.PositiveSmallIntegerField(null=True)),
+                ('part', models.ForeignKey(to='nod.Part')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='partfitment',
+            index_together=set([('make', 'model', 'year_from')]),
+        ),
+        migrations.RunPython(seed_fitment, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0063_partfitment'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='customer',
+            index_together=set([('forename', 'surname', 'updated')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# the index is an FTS5 table, so it's only created on SQLite. It's filled by 0072_populate_search_index.
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("CREATE VIRTUAL TABLE nod_search USING fts5("
+                              "kind UNINDEXED, url UNINDEXED, label, terms, "
+                              "tokenize = 'unicode61', prefix = '2 3')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS nod_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0064_customer_draft_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+
+
+# counts the jobs of each type done on the vehicles of every existing customer
+def count_jobs(apps, schema_editor):
+    Customer = apps.get_model('nod', 'Customer')
+    Job = apps.get_model('nod', 'Job')
+    counters = {'1': 'mot_jobs', '2': 'repair_jobs', '3': 'annual_jobs'}
+    for customer_id, job_type, count in Job.objects.filter(is_deleted=False, vehicle__is_deleted=False)\
+            .values('vehicle__customer_id', 'type').annotate(count=Count('id'))\
+            .values_list('vehicle__customer_id', 'type', 'count'):
+        Customer.objects.filter(id=customer_id).update(**{counters[job_type]: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0065_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='annual_jobs',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='mot_jobs',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='repair_jobs',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_jobs, migrations.RunPython.noop),
+    ]
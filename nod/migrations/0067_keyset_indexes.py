@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0066_customer_job_counts'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='customer',
+            index_together=set([('forename', 'surname', 'updated'), ('surname', 'forename')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('bay', 'booking_date'), ('status', 'job_number'), ('mechanic', 'job_number')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='part',
+            index_together=set([('is_deleted', 'name')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0067_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerBlockingKey',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=1, choices=[('1', 'Phone'), ('2', 'Email'), ('3', 'Name'), ('4', 'Postcode')])),
+                ('token', models.CharField(max_length=120)),
+                ('customer', models.ForeignKey(to='nod.Customer')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='customerblockingkey',
+            index_together=set([('kind', 'token', 'customer')]),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import concurrency.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0068_customerblockingkey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Statement',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', concurrency.fields.IntegerVersionField(help_text='record revision number', default=1)),
+                ('uuid', models.CharField(default='', editable=False, max_length=32, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('month', models.DateField()),
+                ('invoiced', models.FloatField(default=0)),
+                ('paid', models.FloatField(default=0)),
+                ('balance', models.FloatField(default=0)),
+                ('html', models.TextField()),
+                ('customer', models.ForeignKey(to='nod.AccountHolder')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='statement',
+            index_together=set([('customer', 'month')]),
+        ),
+    ]
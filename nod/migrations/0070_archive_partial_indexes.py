@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+# indexes over only the rows which aren't deleted, for the lookups which the default manager makes on live rows,
+# as (name, table, columns)
+PARTIAL_INDEXES = [
+    ('nod_vehicle_live_customer', 'nod_vehicle', ['customer_id']),
+    ('nod_job_live_vehicle', 'nod_job', ['vehicle_id']),
+    ('nod_jobtask_live_job', 'nod_jobtask', ['job_id']),
+    ('nod_jobpart_live_job', 'nod_jobpart', ['job_id']),
+    ('nod_sellpart_live_order', 'nod_sellpart', ['order_id']),
+    ('nod_invoice_live_unpaid', 'nod_invoice', ['paid', 'issue_date']),
+    ('nod_statement_live_month', 'nod_statement', ['month', 'customer_id']),
+]
+
+
+# returns the condition of the partial indexes on the given database, or None where it doesn't support them
+def live_condition(connection):
+    if connection.vendor == 'sqlite':
+        return "is_deleted = 0"
+    if connection.vendor == 'postgresql':
+        return "NOT is_deleted"
+    return None
+
+
+def create_partial_indexes(apps, schema_editor):
+    condition = live_condition(schema_editor.connection)
+    if condition is None:
+        return
+    for name, table, columns in PARTIAL_INDEXES:
+        schema_editor.execute("CREATE INDEX %s ON %s (%s) WHERE %s" % (name, table, ", ".join(columns), condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if live_condition(schema_editor.connection) is None:
+        return
+    for name, table, columns in PARTIAL_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0069_statement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRow',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('model', models.CharField(max_length=100)),
+                ('row_id', models.PositiveIntegerField()),
+                ('row_uuid', models.CharField(max_length=32, blank=True, db_index=True)),
+                ('deleted', models.DateTimeField()),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.TextField()),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedrow',
+            index_together=set([('model', 'row_id')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# gives a distinct registration number to every vehicle whose registration only differs from another's in
+# spacing or case, so that the search key can be made unique. The vehicle which isn't deleted, then the one
+# saved first, keeps its registration; the others are marked as duplicates by their id, for staff to correct.
+def resolve_reg_key_collisions(apps, schema_editor):
+    Vehicle = apps.get_model('nod', 'Vehicle')
+    groups = {}
+    for vehicle_id, reg_number in Vehicle.objects.order_by('is_deleted', 'id').values_list('id', 'reg_number'):
+        groups.setdefault(''.join(reg_number.split()).upper(), []).append((vehicle_id, reg_number))
+
+    for reg_key, vehicles in groups.items():
+        Vehicle.objects.filter(id=vehicles[0][0]).update(reg_key=reg_key)
+        for vehicle_id, reg_number in vehicles[1:]:
+            suffix = ' (duplicate %d)' % vehicle_id
+            reg_number = reg_number[:100 - len(suffix)] + suffix
+            Vehicle.objects.filter(id=vehicle_id).update(reg_number=reg_number,
+                                                         reg_key=''.join(reg_number.split()).upper())
+
+
+# rebuilding the table to add the unique constraint on SQLite drops the partial index made on it by hand
+def restore_partial_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("CREATE INDEX IF NOT EXISTS nod_vehicle_live_customer ON nod_vehicle (customer_id) "
+                              "WHERE is_deleted = 0")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0070_archive_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_reg_key_collisions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vehicle',
+            name='reg_key',
+            field=models.CharField(default='', max_length=100, editable=False, unique=True),
+        ),
+        migrations.RunPython(restore_partial_index, migrations.RunPython.noop),
+    ]
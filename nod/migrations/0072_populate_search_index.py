@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.core.urlresolvers import reverse
+from django.db import migrations
+
+
+# the index and the layout of its documents as they were when this migration was written; nod.search builds
+# them from the current models, which can't be relied on here, so the documents are built afresh from the
+# models as they stand at this migration
+SEARCH_TABLE = 'nod_search'
+KINDS = ['customer', 'vehicle', 'job', 'invoice']
+INSERT_BATCH_SIZE = 500
+
+
+def document_id(kind, pk):
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def customer_url(uuid, dropin_id):
+    return reverse('view-dropin' if dropin_id else 'view-customer', args=[uuid])
+
+
+# returns the emails and phone numbers which aren't deleted of every customer, as two dicts of
+# {customer id: [addresses or numbers]}
+def customer_contacts(Customer):
+    emails = defaultdict(list)
+    for customer_id, address in Customer._meta.get_field('emails').remote_field.through.objects.filter(
+            emailmodel__is_deleted=False).values_list('customer_id', 'emailmodel__address'):
+        emails[customer_id].append(address)
+    phones = defaultdict(list)
+    for customer_id, number in Customer._meta.get_field('phone_numbers').remote_field.through.objects.filter(
+            phonemodel__is_deleted=False).values_list('customer_id', 'phonemodel__phone_number'):
+        phones[customer_id].append(number)
+    return emails, phones
+
+
+# yields the document of every customer, vehicle, job and invoice which isn't deleted, as
+# (rowid, kind, url, label, terms)
+def documents(apps):
+    Customer = apps.get_model('nod', 'Customer')
+    emails, phones = customer_contacts(Customer)
+    for pk, uuid, forename, surname, company_name, dropin_id in Customer.objects.filter(
+            is_deleted=False).values_list('id', 'uuid', 'forename', 'surname',
+                                          'accountholder__businesscustomer__company_name', 'dropin__id').iterator():
+        name = forename + " " + surname
+        label = company_name + " (" + name + ")" if company_name else name
+        terms = [company_name or '', name] + emails[pk] + phones[pk]
+        yield document_id('customer', pk), 'customer', customer_url(uuid, dropin_id), label, " ".join(terms)
+
+    for pk, reg_number, make, model, uuid, dropin_id, forename, surname in apps.get_model('nod', 'Vehicle')\
+            .objects.filter(is_deleted=False).values_list(
+            'id', 'reg_number', 'make', 'model', 'customer__uuid', 'customer__dropin__id', 'customer__forename',
+            'customer__surname').iterator():
+        label = reg_number + " - " + make + " " + model
+        terms = [reg_number, "".join(reg_number.split()), make, model, forename, surname]
+        yield document_id('vehicle', pk), 'vehicle', customer_url(uuid, dropin_id), label, " ".join(terms)
+
+    for pk, uuid, job_number, reg_number in apps.get_model('nod', 'Job').objects.filter(is_deleted=False)\
+            .values_list('id', 'uuid', 'job_number', 'vehicle__reg_number').iterator():
+        label = "Job %d - %s" % (job_number, reg_number)
+        terms = [str(job_number), reg_number, "".join(reg_number.split())]
+        yield document_id('job', pk), 'job', reverse('edit-job', args=[uuid]), label, " ".join(terms)
+
+    for pk, uuid, invoice_number, job_number in apps.get_model('nod', 'Invoice').objects.filter(is_deleted=False)\
+            .values_list('id', 'uuid', 'invoice_number', 'job_done__job_number').iterator():
+        label = "Invoice %d" % invoice_number
+        terms = [str(invoice_number)] + ([str(job_number)] if job_number is not None else [])
+        yield document_id('invoice', pk), 'invoice', reverse('view-invoice', args=[uuid]), label, " ".join(terms)
+
+
+# fills the search index created empty by 0065 with every customer, vehicle, job and invoice, so that search
+# works as soon as the database is migrated rather than once rebuild_search_index is run
+def populate_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    batch = []
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM " + SEARCH_TABLE)
+        for document in documents(apps):
+            batch.append(document)
+            if len(batch) == INSERT_BATCH_SIZE:
+                cursor.executemany("INSERT INTO " + SEARCH_TABLE + " (rowid, kind, url, label, terms) "
+                                   "VALUES (%s, %s, %s, %s, %s)", batch)
+                batch = []
+        if batch:
+            cursor.executemany("INSERT INTO " + SEARCH_TABLE + " (rowid, kind, url, label, terms) "
+                               "VALUES (%s, %s, %s, %s, %s)", batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nod', '0071_vehicle_unique_reg_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 
+import json
 import uuid
+from collections import defaultdict
 
 from django.utils import timezone
 from datetime import timedelta
@@ -9,7 +11,7 @@ from django.core.validators import RegexValidator
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db.models import F, Prefetch, Q, Sum
 from django.core.exceptions import ValidationError, ObjectDoesNotExist, MultipleObjectsReturned
 from concurrency.fields import IntegerVersionField
 from dateutil.relativedelta import relativedelta
@@ -40,10 +42,24 @@ class TimestampedModel(models.Model):
         abstract = True
 
 
+class SoftDeleteManager(models.Manager):
+    """
+    Manager of the rows which haven't been soft deleted, so that queries only touch live data.
+    """
+
+    def get_queryset(self):
+        return super(SoftDeleteManager, self).get_queryset().filter(is_deleted=False)
+
+
 # gives each inheriting class object a soft delete boolean value
 class SoftDeleteModel(models.Model):
     is_deleted = models.BooleanField(default=False)
 
+    # the default manager leaves out the rows which were deleted; all_objects is for looking rows up by id or by
+    # a unique field, deleted or not, such as to restore them
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     class Meta:
         abstract = True
 
@@ -88,6 +104,49 @@ class PhoneModel(TimestampedModel, SoftDeleteModel):
         return self.phone_number
 
 
+# returns the given customers or suppliers with their emails and phone numbers which aren't deleted loaded
+# alongside them, in one query for each however many there are, for the tables listing their contacts
+def with_contacts(queryset):
+    return queryset.prefetch_related(
+        Prefetch('emails', queryset=EmailModel.objects.filter(is_deleted=False), to_attr='active_emails'),
+        Prefetch('phone_numbers', queryset=PhoneModel.objects.filter(is_deleted=False), to_attr='active_phones'))
+
+
+class ActiveContactsMixin(object):
+    """
+    Lists the emails and phone numbers of a customer or supplier which aren't deleted, from those
+    loaded by with_contacts where they were.
+    """
+
+    # returns the emails which aren't deleted
+    def active_email_list(self):
+        if hasattr(self, 'active_emails'):
+            return self.active_emails
+        return self.emails.filter(is_deleted=False)
+
+    # returns the phone numbers which aren't deleted
+    def active_phone_list(self):
+        if hasattr(self, 'active_phones'):
+            return self.active_phones
+        return self.phone_numbers.filter(is_deleted=False)
+
+
+# returns the emails and phone numbers which aren't deleted of the given customers, as two dicts of
+# {customer id: [addresses or numbers]}, with a query for each, for listing the contacts of many customers
+def contacts_by_customer(customer_ids):
+    emails = defaultdict(list)
+    for customer_id, address in Customer.emails.through.objects.filter(
+            customer_id__in=customer_ids, emailmodel__is_deleted=False)\
+            .values_list('customer_id', 'emailmodel__address'):
+        emails[customer_id].append(address)
+    phones = defaultdict(list)
+    for customer_id, number in Customer.phone_numbers.through.objects.filter(
+            customer_id__in=customer_ids, phonemodel__is_deleted=False)\
+            .values_list('customer_id', 'phonemodel__phone_number'):
+        phones[customer_id].append(number)
+    return emails, phones
+
+
 class PriceControl(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
     vat = models.DecimalField(max_digits=4, decimal_places=2)
     marked_up = models.DecimalField(max_digits=4, decimal_places=2)
@@ -102,10 +161,23 @@ class Part(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     code = models.CharField(max_length=20, unique=True)
     quantity = models.PositiveIntegerField()
     low_level_threshold = models.PositiveIntegerField()
+    # lowercased copies of the name and code, indexed so that parts can be searched by prefix
+    name_key = models.CharField(max_length=100, db_index=True, editable=False, default='')
+    code_key = models.CharField(max_length=20, db_index=True, editable=False, default='')
+
+    class Meta:
+        # the parts table is paged by seeking on its sort column
+        index_together = [['is_deleted', 'name']]
 
     def __str__(self):
         return self.name
 
+    # keeps the search keys in step with the name and code
+    def save(self, *args, **kwargs):
+        self.name_key = self.name.strip().lower()
+        self.code_key = self.code.strip().lower()
+        return super(Part, self).save(*args, **kwargs)
+
     # following three methods never used.
     def increase_quantity_by_one(self):
         q = self.quantity
@@ -123,34 +195,39 @@ class Part(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         self.quantity = quantity
         return quantity
 
-    # returns the part's price multiplied by the marked up rate, rounded to two decimal points.
-    def get_markedup_price(self):
+    # returns the price of the part in effect at the given moment, from its price history, or its current
+    # price where it has no history that far back
+    def price_on(self, moment):
+        price = self.partprice_set.filter(effective_from__lte=moment).order_by('-effective_from', '-id')\
+            .values_list('price', flat=True).first()
+        return self.price if price is None else price
+
+    # returns the part's price (or its price in effect at the given moment) multiplied by the marked up rate,
+    # rounded to two decimal points.
+    def get_markedup_price(self, moment=None):
         markup = float(PriceControl.objects.get().marked_up/100)
-        price = float(self.price) + (float(self.price) * markup)
+        price = self.price if moment is None else self.price_on(moment)
+        price = float(price) + (float(price) * markup)
         return round(price, 2)
 
-    # calculates and returns number of delivered parts between two given dates
+    # calculates and returns number of delivered parts between two given dates. Draft orders haven't been
+    # placed, so nothing on them was delivered.
     def delivered_parts(self, start_date, end_date):
-        quantity = 0
-        for p in self.partorder_set.filter(is_deleted=False, order__date__lte=end_date, order__date__gte=start_date):
-            quantity += p.quantity
-        return quantity
+        return self.orderpartrelationship_set.filter(
+            is_deleted=False, order__is_draft=False, order__date__lte=end_date, order__date__gte=start_date
+        ).aggregate(total=Sum('quantity'))['total'] or 0
 
     # calculates and returns number of sold parts to customers between two given dates
     def sold_parts(self, start_date, end_date):
-        quantity = 0
-        for part in self.sellpart_set.filter(is_deleted=False, order__date__lte=end_date, order__date__gte=start_date):
-            quantity += part.quantity
-            print(part.quantity)
-        return quantity
+        return self.sellpart_set.filter(
+            is_deleted=False, order__date__lte=end_date, order__date__gte=start_date
+        ).aggregate(total=Sum('quantity'))['total'] or 0
 
     # calculates and returns the number of used parts for jobs between two given dates
     def used_parts(self, start_date, end_date):
-        quantity = 0
-        for p in self.jobpart_set.filter(is_deleted=False, job__booking_date__lte=end_date,
-                                         job__booking_date__gte=start_date):
-            quantity += p.quantity
-        return quantity
+        return self.jobpart_set.filter(
+            is_deleted=False, job__booking_date__lte=end_date, job__booking_date__gte=start_date
+        ).aggregate(total=Sum('quantity'))['total'] or 0
 
     # calculates and returns the number of all parts used between two given dates, be it by
     # selling to a customer, or from using it for a job
@@ -160,7 +237,53 @@ class Part(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         return quantity
 
 
-class CustomerPartsOrder(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+# Vehicle a part fits, parsed from the free text vehicle type and years of the part so that the parts
+# fitting a vehicle can be found through an index. Rebuilt whenever the part is saved, so like StockMovement
+# it carries no version, uuid or deletion flag.
+class PartFitment(models.Model):
+    part = models.ForeignKey(Part)
+    # lowercased make and model; a blank model fits every model of the make
+    make = models.CharField(max_length=100)
+    model = models.CharField(max_length=100, blank=True)
+    # first and last years fitted, left empty where the range is open
+    year_from = models.PositiveSmallIntegerField(null=True)
+    year_to = models.PositiveSmallIntegerField(null=True)
+
+    class Meta:
+        index_together = [['make', 'model', 'year_from']]
+
+
+class PartPricesMixin(object):
+    """
+    Prices the parts of a job or parts order as they were on its date, with a few queries for all
+    of its parts, kept on the instance so that pricing each of its parts queries nothing more.
+    """
+    # relation holding the parts to price, and field holding the date they're priced on
+    parts_relation = None
+    priced_on_field = None
+
+    # returns the prices of the parts as they were on the date, as {part id: price}, marked up if asked to
+    def part_prices(self, markedup=False):
+        from nod.pricing import marked_up, prices_on
+        if not hasattr(self, '_part_prices'):
+            part_ids = list(getattr(self, self.parts_relation).values_list('part_id', flat=True))
+            self._part_prices = prices_on(getattr(self, self.priced_on_field), part_ids)
+        if not markedup:
+            return self._part_prices
+        if not hasattr(self, '_markedup_part_prices'):
+            self._markedup_part_prices = marked_up(self._part_prices)
+        return self._markedup_part_prices
+
+    # returns the marked up price of a part as it was on the date, from the prices of all the parts where
+    # it's one of them
+    def markedup_part_price(self, part_id):
+        price = self.part_prices(markedup=True).get(part_id)
+        if price is None:
+            return Part.all_objects.get(id=part_id).get_markedup_price(getattr(self, self.priced_on_field))
+        return price
+
+
+class CustomerPartsOrder(PartPricesMixin, TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     # generic relationship limited to the different types of customers
     limit = Q(app_label="nod", model="dropin") | \
         Q(app_label="nod", model="accountholder") | \
@@ -172,11 +295,16 @@ class CustomerPartsOrder(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     date = models.DateTimeField(default=timezone.datetime.now)
     parts = models.ManyToManyField(Part, through="SellPart")
 
-    # gets the prices for all the parts of this order
+    # parts sold are priced as they were on the day of the order
+    parts_relation = 'sellpart_set'
+    priced_on_field = 'date'
+
+    # gets the prices for all the parts of this order, as they were on the day it was placed
     def get_parts_price(self):
+        prices = self.part_prices(markedup=True)
         price = 0
         for part in self.sellpart_set.all():
-            unit_price = part.get_markedup_price()
+            unit_price = prices.get(part.part_id, 0)
             quantity = part.quantity
             price += unit_price*quantity
         return round(price, 2)
@@ -196,7 +324,7 @@ class CustomerPartsOrder(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         return round((self.get_price() + self.get_vat()), 2)
 
 
-class Customer(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
+class Customer(ActiveContactsMixin, SoftDeleteModel, TimestampedModel, RandomUUIDModel):
     # personal_id = models.CharField(max_length=15, unique=True) #check ID string length
     forename = models.CharField(max_length=50, blank=True)
     surname = models.CharField(max_length=100, blank=True)
@@ -204,6 +332,15 @@ class Customer(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
     phone_numbers = models.ManyToManyField(PhoneModel, related_name='%(app_label)s_%(class)s_phonenumber')
     date = models.DateField(default=timezone.datetime.now, null=True)
     part_orders = GenericRelation(CustomerPartsOrder)
+    # counts of the jobs done on the customer's vehicles by type, kept in step with their jobs by nod.counters
+    mot_jobs = models.PositiveIntegerField(default=0)
+    repair_jobs = models.PositiveIntegerField(default=0)
+    annual_jobs = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # customers left without a name were abandoned on the create page, and are purged by age. The
+        # customer tables are sorted by surname, and paged by seeking on it.
+        index_together = [['forename', 'surname', 'updated'], ['surname', 'forename']]
 
     # when object referenced, returns forename and surname of customer
     def __str__(self):
@@ -215,11 +352,11 @@ class Customer(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
 
     # returns list of all emails, separated by a semi-colon
     def list_emails(self):
-        return "; ".join([s.address for s in self.emails.filter(is_deleted=False)])
+        return "; ".join([s.address for s in self.active_email_list()])
 
     # returns list of all phones, separated by a comma
     def get_phones(self):
-        return ", ".join([s.phone_number for s in self.phone_numbers.filter(is_deleted=False)])
+        return ", ".join([s.phone_number for s in self.active_phone_list()])
 
     # returns list of invoices generated for jobs/orders done which weren't paid
     def get_unpaid_invoices(self):
@@ -237,30 +374,15 @@ class Customer(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
 class Dropin(Customer):
     # Gets number of MOT jobs per drop in
     def get_number_mot_jobs(self):
-        mot = 0
-        for v in self.vehicle_set.filter(is_deleted=False):
-            for job in v.job_set.filter(is_deleted=False):
-                if job.type is '1':
-                    mot += 1
-        return mot
+        return self.mot_jobs
 
     # Gets number of repair jobs per drop in
     def get_number_repair_jobs(self):
-        repair = 0
-        for v in self.vehicle_set.filter(is_deleted=False):
-            for job in v.job_set.filter(is_deleted=False):
-                if job.type is '2':
-                    repair += 1
-        return repair
+        return self.repair_jobs
 
     # Gets number of annual jobs per drop in
     def get_number_annual_jobs(self):
-        annual = 0
-        for v in self.vehicle_set.filter(is_deleted=False):
-            for job in v.job_set.filter(is_deleted=False):
-                if job.type is '3':
-                    annual += 1
-        return annual
+        return self.annual_jobs
 
 
 class AccountHolder(Customer):
@@ -301,7 +423,27 @@ class BusinessCustomer(AccountHolder):
         return self.forename + ' ' + self.surname + ", " + self.rep_role
 
 
-class Supplier(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
+# Normalised detail of a customer which other customers sharing it are compared against when looking for
+# duplicates. Rebuilt from the customers by nod.dedup, so like PartFitment it carries no version, uuid or
+# deletion flag.
+class CustomerBlockingKey(models.Model):
+    KINDS = (
+        ('1', 'Phone'),
+        ('2', 'Email'),
+        ('3', 'Name'),
+        ('4', 'Postcode'),
+    )
+
+    customer = models.ForeignKey(Customer)
+    kind = models.CharField(max_length=1, choices=KINDS)
+    token = models.CharField(max_length=120)
+
+    class Meta:
+        # customers sharing a key are found by joining the table on itself over the kind and token
+        index_together = [['kind', 'token', 'customer']]
+
+
+class Supplier(ActiveContactsMixin, SoftDeleteModel, TimestampedModel, RandomUUIDModel):
     company_name = models.CharField(max_length=100)
     emails = models.ManyToManyField(EmailModel, related_name='%(app_label)s_%(class)s_emailaddress')
     phone_numbers = models.ManyToManyField(PhoneModel, related_name='%(app_label)s_%(class)s_phonenumber')
@@ -318,11 +460,11 @@ class Supplier(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
 
     # returns list of all emails, separated by a semi-colon
     def get_emails(self):
-        return "; ".join([s.address for s in self.emails.filter(is_deleted=False)])
+        return "; ".join([s.address for s in self.active_email_list()])
 
     # returns list of all phones, separated by a comma
     def get_phones(self):
-        return ", ".join([s.phone_number for s in self.phone_numbers.filter(is_deleted=False)])
+        return ", ".join([s.phone_number for s in self.active_phone_list()])
 
 
 class DiscountPlan(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
@@ -377,8 +519,20 @@ class VariableDiscount(DiscountPlan):
         self.type = '3'
 
 
+# Workshop of the franchise, holding its own bays, staff and stock of the shared catalogue of parts
+class Site(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+    name = models.CharField(max_length=100, unique=True)
+    address = models.CharField(max_length=80, blank=True)
+    postcode = models.CharField(max_length=8, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
 class StaffMember(SoftDeleteModel, TimestampedModel, RandomUUIDModel):
     user = models.OneToOneField(User)
+    # site the staff member works at, whose stock they sell, deliver and adjust
+    site = models.ForeignKey(Site, null=True, blank=True)
     ROLES = [
         ("1", "Mechanic"),
         ("2", "Foreperson"),
@@ -418,6 +572,8 @@ class Bay(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     bay_type = models.CharField(choices=BAYS, max_length=1)
     total_spots = models.PositiveSmallIntegerField()
     free_spots = models.PositiveIntegerField()
+    # site the bay is at, whose stock the jobs booked into it draw from
+    site = models.ForeignKey(Site, null=True, blank=True)
 
     # returns the matching name to the assigned value in the dictionary
     def __str__(self):
@@ -425,8 +581,25 @@ class Bay(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         return bay_name
 
 
+# returns a registration number in the form it's stored and searched by: upper case, without spaces
+def normalize_reg(reg_number):
+    return ''.join(reg_number.split()).upper()
+
+
+# returns whether a registration number is taken by a saved vehicle other than the given one, however it's
+# spaced or cased
+def reg_number_in_use(reg_number, exclude=None):
+    vehicles = Vehicle.all_objects.filter(reg_key=normalize_reg(reg_number))
+    if exclude is not None:
+        vehicles = vehicles.exclude(id=exclude.id)
+    return vehicles.exists()
+
+
 class Vehicle(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     reg_number = models.CharField(max_length=100, unique=True)
+    # normalised registration number, indexed so that vehicles can be searched by prefix. It's unique, so that
+    # registrations differing only in spacing or case can't be told apart when a vehicle is looked up by one.
+    reg_key = models.CharField(max_length=100, unique=True, editable=False, default='')
     make = models.CharField(max_length=100)
     model = models.CharField(max_length=100)
     engine_serial = models.CharField(max_length=100)
@@ -444,6 +617,11 @@ class Vehicle(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     def __str__(self):
         return self.reg_number
 
+    # keeps the search key in step with the registration number
+    def save(self, *args, **kwargs):
+        self.reg_key = normalize_reg(self.reg_number)
+        return super(Vehicle, self).save(*args, **kwargs)
+
     # returns assigned customer, be it of type BusinessCustomer, AccountHolder, or Drop In.
     def get_customer(self):
         c_uuid = self.customer.uuid
@@ -470,7 +648,7 @@ class Task(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         return self.description
 
 
-class Job(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+class Job(PartPricesMixin, TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     tasks = models.ManyToManyField(Task, through="JobTask")
     parts = models.ManyToManyField(Part, through="JobPart")
     job_number = models.PositiveIntegerField(unique=True)
@@ -492,12 +670,16 @@ class Job(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     work_carried_out = models.CharField(max_length=1000, blank=True)
     mechanic = models.ForeignKey(Mechanic, null=True)
 
+    # parts used are priced as they were on the day the job was booked
+    parts_relation = 'jobpart_set'
+    priced_on_field = 'booking_date'
+
     # iterates through all the assigned tasks to the job, and adds the estimated
     # time per task to get the overall estimated time for the job.
     def calculate_estimated_time(self):
-        estimated_time = 0
-        for t in self.tasks.all():
-            estimated_time += t.estimated_time
+        estimated_time = timedelta()
+        for t in self.jobtask_set.filter(is_deleted=False).select_related('task'):
+            estimated_time += t.task.estimated_time
 
         return estimated_time
 
@@ -517,11 +699,13 @@ class Job(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
         rate = self.mechanic.hourly_pay
         return round((float(time)*float(rate)), 2)
 
-    # returns the sum price of all parts used for a job multiplied by their corresponding unit price
+    # returns the sum price of all parts used for a job multiplied by their corresponding unit price, as
+    # it was on the day the job was booked
     def get_parts_price(self):
+        prices = self.part_prices()
         price = 0
         for part in self.jobpart_set.all():
-            unit_price = part.part.price
+            unit_price = prices.get(part.part_id, 0)
             quantity = part.quantity
             price += unit_price*quantity
         return round(float(price), 2)
@@ -567,6 +751,11 @@ class Job(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
             else:
                 return True
 
+    class Meta:
+        # bookings are looked up per bay over a window of dates when working out bay occupancy. The tables of
+        # active and untaken jobs are paged by seeking on the job number.
+        index_together = [['bay', 'booking_date'], ['status', 'job_number'], ['mechanic', 'job_number']]
+
 
 # Association class between Job and Task
 class JobTask(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
@@ -588,9 +777,35 @@ class JobPart(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     quantity = models.PositiveIntegerField()
     sufficient_quantity = models.BooleanField(default=True)
 
-    # returns the product of the marked up price and quantity
+    # returns marked up price for part as it was when the job was booked, rounded to two decimal points
+    def get_markedup_price(self):
+        return self.job.markedup_part_price(self.part_id)
+
+    # returns the product of the marked up price, as it was when the job was booked, and quantity
     def get_cost(self):
-        return round((self.part.get_markedup_price() * self.quantity), 2)
+        return round((self.get_markedup_price() * self.quantity), 2)
+
+
+# Append-only history of a job. Events are never edited or soft deleted, so unlike the other models
+# this one carries no version, uuid or deletion flag.
+class JobEvent(models.Model):
+    job = models.ForeignKey(Job)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    staff = models.ForeignKey(StaffMember, null=True)
+    EVENT_KIND = [
+        ('1', 'Created'),
+        ('2', 'Edited'),
+        ('3', 'Assigned'),
+    ]
+    kind = models.CharField(max_length=1, choices=EVENT_KIND)
+    # status of the job once the event happened, so time spent in each status can be worked out from
+    # the events alone
+    status = models.CharField(max_length=1, choices=Job.JOB_STATUS)
+    # zlib compressed json of the fields which changed, as {field: [old value, new value]}
+    payload = models.BinaryField()
+
+    class Meta:
+        index_together = [['job', 'created']]
 
 
 # Association class between CustomerPartsOrder and Part
@@ -600,15 +815,13 @@ class SellPart(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     quantity = models.PositiveIntegerField()
     sufficient_quantity = models.BooleanField(default=True)
 
-    # returns marked up price for part, rounded to two decimal points
+    # returns marked up price for part as it was when the parts were sold, rounded to two decimal points
     def get_markedup_price(self):
-        markup = float(PriceControl.objects.get().marked_up/100)
-        price = float(self.part.price) + (float(self.part.price) * markup)
-        return round(price, 2)
+        return self.order.markedup_part_price(self.part_id)
 
     # returns the product of marked up price and quantity, rounded to two decimal points
     def get_cost(self):
-        return round((self.part.get_markedup_price() * self.quantity), 2)
+        return round((self.get_markedup_price() * self.quantity), 2)
 
 
 class Invoice(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
@@ -770,25 +983,39 @@ class Card(Payment):
         self.payment_type = '2'
 
 
+# Monthly statement of an account holder's invoices and payments, stored as it was rendered so that it can
+# be reprinted as sent
+class Statement(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
+    customer = models.ForeignKey(AccountHolder)
+    # first day of the month the statement covers
+    month = models.DateField()
+    # totals worked out when the statement is generated
+    invoiced = models.FloatField(default=0)
+    paid = models.FloatField(default=0)
+    balance = models.FloatField(default=0)
+    html = models.TextField()
+
+    class Meta:
+        # statements are looked up by customer and month to reprint, and replaced when a month is generated again
+        index_together = [['customer', 'month']]
+
+
 class SparePartsReport(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
     parts = models.ManyToManyField(Part, through="SparePart")
     start_date = models.DateField()
     end_date = models.DateField()
     date = models.DateTimeField(default=timezone.datetime.now)
+    # totals worked out when the report is generated
+    total_initial_cost = models.FloatField(default=0)
+    total_stock_cost = models.FloatField(default=0)
 
     # returns total initial cost
     def get_total_initial_cost(self):
-        cost = 0
-        for p in SparePart.objects.filter(report=self, is_deleted=False):
-            cost += p.get_initial_cost()
-        return round(cost, 2)
+        return self.total_initial_cost
 
     # returns current, total stock cost
     def get_total_stock_cost(self):
-        cost = 0
-        for p in SparePart.objects.filter(report=self, is_deleted=False):
-            cost += p.get_stock_cost()
-        return round(cost, 2)
+        return self.total_stock_cost
 
     # returns a string of the current reporting period (start_date-end_date)
     def reporting_period(self):
@@ -803,21 +1030,25 @@ class SparePart(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
     used = models.IntegerField(default=0)
     delivery = models.IntegerField(default=0)
     new_stock_level = models.IntegerField()
+    # unit prices of the part at the start and end of the reporting period, as they were when the report
+    # was generated
+    initial_price = models.FloatField(default=0)
+    unit_price = models.FloatField(default=0)
 
     # returns the new stock level of a given part by taking the initial stock level for that
     # given part, and subtracting the amount used, and adding the amount delivered
     def get_new_stock_level(self):
         return self.initial_stock_level - self.used + self.delivery
 
-    # returns the initial stock cost of the part by multiplying the unit price by the initial
-    # stock level, rounding to two decimal points
+    # returns the initial stock cost of the part by multiplying the unit price at the start of the
+    # reporting period by the initial stock level, rounding to two decimal points
     def get_initial_cost(self):
-        return round((self.part.price * self.initial_stock_level), 2)
+        return round((self.initial_price * self.initial_stock_level), 2)
 
     # returns current stock cost of the part by multiplying the new stock level by the
-    # unit price, rounding to two decimal points
+    # unit price at the end of the reporting period, rounding to two decimal points
     def get_stock_cost(self):
-        return round((self.part.price * self.get_new_stock_level()), 2)
+        return round((self.unit_price * self.get_new_stock_level()), 2)
 
 
 class PartOrder(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
@@ -825,13 +1056,26 @@ class PartOrder(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
     supplier = models.ForeignKey(Supplier)
     parts = models.ManyToManyField(Part, through="OrderPartRelationship")
     # arrived = models.BooleanField(default=False)
+    # drafts are proposed by the stock forecast, and don't affect stock until they're placed
+    is_draft = models.BooleanField(default=False)
+    # value of the order, stored whenever its parts are saved
+    total_price = models.FloatField(default=0)
+
+    # works out the value of the order in the database, as the sum of the quantity of each part ordered
+    # multiplied by its price, rounded to two decimal points
+    def order_value(self):
+        total = self.orderpartrelationship_set.filter(is_deleted=False).aggregate(
+            total=Sum(F('quantity') * F('part__price'), output_field=models.FloatField()))['total']
+        return round(total or 0, 2)
+
+    # stores the current value of the order
+    def update_total_price(self):
+        self.total_price = self.order_value()
+        PartOrder.objects.filter(id=self.id).update(total_price=self.total_price)
 
     # returns total price for all parts in the order, rounded to two decimal points
     def get_total_price(self):
-        cost = 0
-        for p in self.parts.all():
-            cost += p.price
-        return round(cost, 2)
+        return round(self.total_price, 2)
 
 
 # Association class between Part and PartOrder
@@ -841,6 +1085,76 @@ class OrderPartRelationship(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
     quantity = models.PositiveIntegerField()
 
 
+# Stock of a part held at a site. The quantity of the Part itself is the total across every site.
+class PartStock(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+    part = models.ForeignKey(Part)
+    site = models.ForeignKey(Site)
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [['part', 'site']]
+        # low stock at a site is looked up by site and quantity
+        index_together = [['site', 'quantity']]
+
+
+# Order moving parts from the stock of one site to another
+class StockTransfer(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+    date = models.DateTimeField(default=timezone.now)
+    from_site = models.ForeignKey(Site, related_name='transfers_out')
+    to_site = models.ForeignKey(Site, related_name='transfers_in')
+    staff = models.ForeignKey(StaffMember, null=True)
+    parts = models.ManyToManyField(Part, through="TransferPartRelationship")
+
+
+# Association class between Part and StockTransfer
+class TransferPartRelationship(TimestampedModel, SoftDeleteModel, RandomUUIDModel):
+    part = models.ForeignKey(Part)
+    transfer = models.ForeignKey(StockTransfer)
+    quantity = models.PositiveIntegerField()
+
+
+# Append-only ledger of every change to the stock of a part, each with the stock level it left behind.
+# Like JobEvent, movements are never edited or soft deleted.
+class StockMovement(models.Model):
+    part = models.ForeignKey(Part)
+    date = models.DateTimeField(default=timezone.now)
+    MOVEMENT_KIND = [
+        ('1', 'Delivery'),
+        ('2', 'Job'),
+        ('3', 'Sale'),
+        ('4', 'Adjustment'),
+        ('5', 'Opening Balance'),
+        ('6', 'Transfer'),
+    ]
+    kind = models.CharField(max_length=1, choices=MOVEMENT_KIND)
+    # signed change in stock; negative for parts taken out of stock
+    quantity = models.IntegerField()
+    # stock of the part right after this movement, across every site
+    balance = models.IntegerField()
+    # site whose stock moved
+    site = models.ForeignKey(Site, null=True)
+    staff = models.ForeignKey(StaffMember, null=True)
+    job = models.ForeignKey(Job, null=True)
+    part_order = models.ForeignKey(PartOrder, null=True)
+    customer_order = models.ForeignKey(CustomerPartsOrder, null=True)
+    transfer = models.ForeignKey(StockTransfer, null=True)
+
+    class Meta:
+        index_together = [['part', 'date']]
+
+
+# Append-only history of the price of every part, each price applying from its effective date until the
+# next one takes over. Like StockMovement, prices are never edited or soft deleted.
+class PartPrice(models.Model):
+    part = models.ForeignKey(Part)
+    price = models.FloatField()
+    effective_from = models.DateTimeField(default=timezone.now)
+    staff = models.ForeignKey(StaffMember, null=True)
+
+    class Meta:
+        index_together = [['part', 'effective_from']]
+
+
 class PriceReport(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
     date = models.DateTimeField(default=timezone.datetime.now)
 
@@ -1086,3 +1400,25 @@ class MOTReminder(TimestampedModel, RandomUUIDModel, SoftDeleteModel):
     # returns days remaining between the test date and the issue date of the reminder
     def days_remaining(self):
         return (self.renewal_test_date - self.issue_date).days
+
+
+# Row moved out of its table by nod.archive once it had been soft deleted for long enough, kept with its
+# fields as they were so that it can still be looked up for audits. Like StockMovement it's only ever
+# appended, so carries no version, uuid or deletion flag of its own.
+class ArchivedRow(models.Model):
+    # label of the model the row belonged to, e.g. "nod.vehicle"
+    model = models.CharField(max_length=100)
+    row_id = models.PositiveIntegerField()
+    row_uuid = models.CharField(max_length=32, blank=True, db_index=True)
+    # when the row was last changed, which for a soft deleted row is when it was deleted
+    deleted = models.DateTimeField()
+    archived = models.DateTimeField(default=timezone.now)
+    # fields of the row, as JSON
+    data = models.TextField()
+
+    class Meta:
+        index_together = [['model', 'row_id']]
+
+    # returns the fields of the row as they were when it was archived
+    def fields(self):
+        return json.loads(self.data)
@@ -0,0 +1,106 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django_tables2 import RequestConfig
+
+
+# rows shown on each page of a table
+PER_PAGE = 25
+
+# template of the tables paged by keyset, which link to the first and next pages rather than numbered pages
+KEYSET_TEMPLATE = 'nod/keyset_table.html'
+
+
+class KeysetPage(object):
+    """
+    A page of the rows of a table, found by seeking past the last row of the page before rather than by
+    counting rows off from the start, so a page deep into a table costs the same as the first one.
+    """
+
+    def __init__(self, object_list, cursor_field, next_cursor, has_previous):
+        self.object_list = object_list
+        self.cursor_field = cursor_field
+        self.next_cursor = next_cursor
+        self.has_next = next_cursor is not None
+        self.has_previous = has_previous
+
+
+# returns the field a queryset is ordered by and whether it's descending, falling back on the id where it isn't
+# ordered by a field of its rows. Only the first field of the ordering is kept; the id breaks ties.
+def sort_field(queryset):
+    ordering = list(queryset.query.order_by)
+    if not ordering:
+        return 'id', False
+    field = ordering[0]
+    descending = field.startswith('-')
+    field = field.lstrip('-')
+    if field in queryset.query.annotations:
+        return field, descending
+    try:
+        queryset.model._meta.get_field(field.split('__')[0])
+    except FieldDoesNotExist:
+        return 'id', False
+    return field, descending
+
+
+# encodes the position of the last row of a page, along with the ordering it's a position in
+def encode_cursor(ordering, value, pk):
+    return base64.urlsafe_b64encode(json.dumps([ordering, value, pk], cls=DjangoJSONEncoder).encode('utf-8'))\
+        .decode('ascii')
+
+
+# decodes the position of a row encoded by encode_cursor, as (value, pk), or None where it's missing, can't
+# be read or is a position in a different ordering
+def decode_cursor(cursor, ordering):
+    try:
+        cursor_ordering, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if cursor_ordering != ordering or not isinstance(pk, int):
+        return None
+    return value, pk
+
+
+# returns the rows of a queryset which come after the given position in the given ordering. Nulls come first
+# in ascending order and last in descending order, as they do in SQLite.
+def seek(queryset, field, descending, value, pk):
+    after = '__lt' if descending else '__gt'
+    if value is None:
+        rows = Q(**{field + '__isnull': True, 'id' + after: pk})
+        if not descending:
+            rows |= Q(**{field + '__isnull': False})
+    else:
+        rows = Q(**{field + after: value}) | Q(**{field: value, 'id' + after: pk})
+        if descending:
+            rows |= Q(**{field + '__isnull': True})
+    return queryset.filter(rows)
+
+
+# orders and pages a table by keyset from the request, in place of RequestConfig(request).configure(table).
+# The page is found with a query over the sort column and id, seeking past the row given by the cursor in
+# the request, and only its rows are then loaded. Tables of lists rather than querysets are paged as usual.
+def paginate_keyset(request, table, per_page=PER_PAGE):
+    RequestConfig(request, paginate=False).configure(table)
+    queryset = getattr(table.data, 'queryset', None)
+    if queryset is None:
+        RequestConfig(request, paginate={'per_page': per_page}).configure(table)
+        return
+
+    field, descending = sort_field(queryset)
+    ordering = ('-' if descending else '') + field
+    queryset = queryset.order_by(ordering, '-id' if descending else 'id')
+
+    cursor_field = table.prefix + 'after'
+    position = decode_cursor(request.GET.get(cursor_field, ''), ordering)
+    rows = queryset
+    if position is not None:
+        rows = seek(queryset, field, descending, *position)
+    keys = list(rows.values_list(field, 'id')[:per_page + 1])
+
+    next_cursor = encode_cursor(ordering, *keys[per_page - 1]) if len(keys) > per_page else None
+    table.data.queryset = queryset.filter(id__in=[pk for value, pk in keys[:per_page]])
+    table.page = KeysetPage(table.rows, cursor_field, next_cursor, position is not None)
+    table.template = KEYSET_TEMPLATE
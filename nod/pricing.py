@@ -0,0 +1,137 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Func, Sum, Value, When
+from django.utils import timezone
+
+from nod.models import JobPart, JobTask, Part, PartPrice, PriceControl
+from nod.utils import batches
+
+
+# kinds of price change, as chosen on the reprice form
+PERCENTAGE = '1'
+AMOUNT = '2'
+
+
+# records the current price of a part as its price from now on
+def record_price(part, staff=None):
+    return PartPrice.objects.create(part=part, price=part.price, effective_from=timezone.now(), staff=staff)
+
+
+# returns the parts of the catalogue made by the given manufacturer, for the given vehicle type and ever
+# delivered by the given supplier, leaving out any filter which isn't given
+def filter_parts(manufacturer=None, vehicle_type=None, supplier=None):
+    parts = Part.objects.filter(is_deleted=False)
+    if manufacturer:
+        parts = parts.filter(manufacturer__iexact=manufacturer)
+    if vehicle_type:
+        parts = parts.filter(vehicle_type__iexact=vehicle_type)
+    if supplier is not None:
+        parts = parts.filter(id__in=Part.objects.filter(orderpartrelationship__order__supplier=supplier,
+                                                        orderpartrelationship__is_deleted=False).values('id'))
+    return parts
+
+
+# changes the price of every given part by a percentage or a fixed amount, rounded to two decimal points,
+# with a single UPDATE, and records the new prices in the price history. A reduction by a fixed amount
+# leaves out the parts it would take below nothing. Returns the number of parts repriced.
+def reprice(parts, kind, change, staff=None):
+    if kind == PERCENTAGE:
+        price = F('price') * (1 + change / 100.0)
+    else:
+        price = F('price') + change
+        if change < 0:
+            parts = parts.filter(price__gte=-change)
+
+    with transaction.atomic():
+        part_ids = list(parts.values_list('id', flat=True))
+        if not part_ids:
+            return 0
+        now = timezone.now()
+        parts.update(price=Func(price, Value(2), function='ROUND', output_field=FloatField()), updated=now)
+
+        history = []
+        for batch in batches(part_ids):
+            history.extend(PartPrice(part_id=part_id, price=new_price, effective_from=now, staff=staff)
+                           for part_id, new_price in Part.objects.filter(id__in=batch).values_list('id', 'price'))
+        PartPrice.objects.bulk_create(history, batch_size=500)
+    return len(part_ids)
+
+
+# returns the price of every part in effect at the given moment, as {part id: price}, falling back on the
+# current price of parts with no history that far back
+def prices_on(moment, part_ids):
+    prices = {}
+    for batch in batches(part_ids):
+        prices.update(Part.all_objects.filter(id__in=batch).values_list('id', 'price'))
+    # the history of each part comes in the order its prices took effect, as Part.price_on orders it, so the
+    # last price of a part read is the one in effect
+    for batch in batches(part_ids):
+        prices.update(PartPrice.objects.filter(part_id__in=batch, effective_from__lte=moment)
+                      .order_by('part_id', 'effective_from', 'id').values_list('part_id', 'price'))
+    return prices
+
+
+# returns the given prices marked up by the rate of the price controls, rounded to two decimal points, as
+# Part.get_markedup_price marks up a single price, as {part id: price}
+def marked_up(prices):
+    markup = float(PriceControl.objects.get().marked_up/100)
+    return dict((part_id, round(float(price) + float(price) * markup, 2)) for part_id, price in prices.items())
+
+
+# returns the price histories of the given parts up to the given moment, as {part id: ([effective from],
+# [price])} in the order they took effect, for looking up the prices of parts at many moments without a query
+# for each
+def price_histories(part_ids, latest):
+    histories = defaultdict(lambda: ([], []))
+    for batch in batches(part_ids):
+        for part_id, effective_from, price in PartPrice.objects.filter(
+                part_id__in=batch, effective_from__lte=latest).order_by('effective_from', 'id')\
+                .values_list('part_id', 'effective_from', 'price'):
+            histories[part_id][0].append(effective_from)
+            histories[part_id][1].append(price)
+    return histories
+
+
+# returns the price of a part in effect at the given moment from the histories of price_histories, or its
+# current price where its history doesn't go back that far
+def price_from_history(histories, part_id, moment, current_price):
+    dates, prices = histories[part_id]
+    i = bisect_right(dates, moment)
+    return prices[i - 1] if i else current_price
+
+
+# returns the price of the parts used for each of the given jobs, as it was on the day each job was booked,
+# as {job id: price}, working it out as Job.get_parts_price does from a query over the parts of the jobs and
+# one over the price histories of those parts
+def parts_prices(booking_dates):
+    job_parts = []
+    for batch in batches(booking_dates):
+        job_parts.extend(JobPart.objects.filter(job_id__in=batch)
+                         .values_list('job_id', 'part_id', 'quantity', 'part__price'))
+    part_ids = set(part_id for job_id, part_id, quantity, price in job_parts)
+    histories = price_histories(part_ids, max(booking_dates.values())) if booking_dates else {}
+
+    totals = defaultdict(float)
+    for job_id, part_id, quantity, current_price in job_parts:
+        price = price_from_history(histories, part_id, booking_dates[job_id], current_price)
+        totals[job_id] += price * quantity
+    return dict((job_id, round(float(total), 2)) for job_id, total in totals.items())
+
+
+# returns the hours worked on each of the given jobs, as {job id: hours}, as Job.get_duration does
+def job_durations(job_ids):
+    hours = defaultdict(float)
+    for job_id, duration in JobTask.objects.filter(job_id__in=job_ids).values_list('job_id', 'duration'):
+        if duration is not None:
+            hours[job_id] += duration.seconds / 3600
+    return hours
+
+
+# annotates each of the given suppliers with the total value of the orders placed with them, as spend, in the
+# same query as the suppliers themselves. Draft orders haven't been placed, so don't count.
+def with_spend(suppliers):
+    return suppliers.annotate(spend=Sum(Case(
+        When(partorder__is_deleted=False, partorder__is_draft=False, then=F('partorder__total_price')),
+        default=Value(0), output_field=FloatField())))
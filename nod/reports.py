@@ -0,0 +1,62 @@
+import datetime
+import uuid
+
+from django.db import transaction
+from django.db.models import F, FloatField, Sum
+from django.utils import timezone
+
+from nod.models import JobPart, OrderPartRelationship, Part, SellPart, SparePart, SparePartsReport
+from nod.pricing import prices_on
+
+
+# returns the total quantity of each part in the given rows, as {part id: quantity}, from a single grouped query
+def quantities_by_part(queryset):
+    return dict(queryset.values('part_id').annotate(total=Sum('quantity')).values_list('part_id', 'total'))
+
+
+# works out the total initial and stock costs of a report in a single aggregate over its rows
+def report_totals(report):
+    totals = SparePart.objects.filter(report=report, is_deleted=False).aggregate(
+        initial=Sum(F('initial_stock_level') * F('initial_price'), output_field=FloatField()),
+        stock=Sum(F('new_stock_level') * F('unit_price'), output_field=FloatField()))
+    return round(totals['initial'] or 0, 2), round(totals['stock'] or 0, 2)
+
+
+# creates a spare parts report over the given dates from the current stock of every part, along with the
+# parts delivered, used for jobs and sold since the start date. The prices at the start and end of the period
+# and the total costs are stored with the report, so viewing it later needs no more than the report rows.
+def create_spare_parts_report(start_date, end_date, date):
+    start = timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(end_date, datetime.time.max))
+
+    delivered = quantities_by_part(OrderPartRelationship.objects.filter(
+        is_deleted=False, order__is_deleted=False, order__is_draft=False, order__date__gte=start,
+        order__date__lte=end))
+    used = quantities_by_part(JobPart.objects.filter(
+        is_deleted=False, job__booking_date__gte=start, job__booking_date__lte=end))
+    sold = quantities_by_part(SellPart.objects.filter(
+        is_deleted=False, order__date__gte=start, order__date__lte=end))
+
+    parts = list(Part.objects.filter(is_deleted=False).values_list('id', 'quantity'))
+    part_ids = [part_id for part_id, quantity in parts]
+    initial_prices = prices_on(start, part_ids)
+    prices = prices_on(end, part_ids)
+
+    with transaction.atomic():
+        report = SparePartsReport.objects.create(start_date=start_date, end_date=end_date, date=date)
+        spare_parts = []
+        for part_id, quantity in parts:
+            spare = SparePart(report=report, part_id=part_id, new_stock_level=quantity,
+                              delivery=delivered.get(part_id, 0),
+                              used=used.get(part_id, 0) + sold.get(part_id, 0),
+                              initial_price=initial_prices[part_id], unit_price=prices[part_id],
+                              uuid=uuid.uuid4().hex)
+            # the stock at the start is the stock now, plus whatever was used since, less whatever was delivered
+            spare.initial_stock_level = spare.new_stock_level + spare.used - spare.delivery
+            spare_parts.append(spare)
+        # bulk_create skips save(), so the uuids are generated above
+        SparePart.objects.bulk_create(spare_parts, batch_size=500)
+
+        report.total_initial_cost, report.total_stock_cost = report_totals(report)
+        report.save()
+    return report
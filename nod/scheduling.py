@@ -0,0 +1,225 @@
+import bisect
+import datetime
+from datetime import timedelta
+
+from django.utils import timezone
+
+from nod.models import Bay, Job, JobTask
+
+
+# opening hours of the garage; slots are only offered inside these hours
+OPENING_HOUR = 8
+CLOSING_HOUR = 18
+
+# bookings are assumed never to occupy a bay for longer than this, so only bookings starting
+# this long before a searched window need to be loaded to know what overlaps it
+MAX_BOOKING_LENGTH = timedelta(days=7)
+
+# a job without any tasks yet still takes a spot for this long
+DEFAULT_BOOKING_LENGTH = timedelta(hours=1)
+
+# how far ahead of the requested date free slots are searched for
+SEARCH_HORIZON = timedelta(days=60)
+
+# maps a job type (MOT, Repair, Annual) to the type of bay it's carried out in
+JOB_BAY_TYPES = {
+    '1': '1',
+    '2': '2',
+    '3': '2',
+}
+
+
+# returns the estimated duration of every job matching the given job filters, summing the
+# estimated time of their (not deleted) tasks in a single query
+def estimated_times(**job_filters):
+    lookups = dict(('job__' + key, value) for key, value in job_filters.items())
+    times = {}
+    for job_id, estimated_time in JobTask.objects.filter(is_deleted=False, **lookups)\
+            .values_list('job_id', 'task__estimated_time'):
+        times[job_id] = times.get(job_id, timedelta()) + estimated_time
+    return times
+
+
+# returns the estimated duration of a booking made of the given tasks
+def booking_length(tasks):
+    length = timedelta()
+    for task in tasks:
+        length += task.estimated_time
+    return length or DEFAULT_BOOKING_LENGTH
+
+
+# returns the opening time of the day the given moment falls on
+def opening_time(moment):
+    return timezone.localtime(moment).replace(hour=OPENING_HOUR, minute=0, second=0, microsecond=0)
+
+
+# moves a proposed start forward so that a booking of the given length fits inside opening hours.
+# bookings longer than a working day have to start at opening time.
+def within_opening_hours(moment, length):
+    opening = opening_time(moment)
+    closing = opening.replace(hour=CLOSING_HOUR)
+    if moment < opening:
+        return opening
+    if length > closing - opening:
+        if moment > opening:
+            return opening + timedelta(days=1)
+        return moment
+    if moment + length > closing:
+        return opening + timedelta(days=1)
+    return moment
+
+
+class BayTimeline(object):
+    """
+    Occupancy of a single bay over time. Bookings are turned into a sorted list of change points,
+    each holding the number of spots taken from that moment until the next point, so the occupancy
+    over any window is found by bisecting into the points rather than walking every booking.
+    """
+
+    def __init__(self, bay, bookings):
+        self.bay = bay
+        self.capacity = bay.total_spots
+
+        deltas = {}
+        for start, end in bookings:
+            deltas[start] = deltas.get(start, 0) + 1
+            deltas[end] = deltas.get(end, 0) - 1
+
+        self.points = sorted(deltas)
+        self.counts = []
+        taken = 0
+        for point in self.points:
+            taken += deltas[point]
+            self.counts.append(taken)
+
+    # returns the highest number of spots taken at any moment between start and end
+    def max_occupancy(self, start, end):
+        i = bisect.bisect_right(self.points, start) - 1
+        taken = self.counts[i] if i >= 0 else 0
+        i += 1
+        while i < len(self.points) and self.points[i] < end:
+            taken = max(taken, self.counts[i])
+            i += 1
+        return taken
+
+    # returns whether or not a spot stays free for the whole of the given window
+    def is_free(self, start, end):
+        return self.max_occupancy(start, end) < self.capacity
+
+    # returns the earliest start, no sooner than 'after' and before 'until', at which a booking of
+    # the given length fits in this bay. Only the moments where a spot may become available (the
+    # requested time, each opening time and each change point) need to be tried.
+    def first_free_slot(self, after, length, until):
+        candidates = [after]
+        day = opening_time(after)
+        while day < until:
+            if day > after:
+                candidates.append(day)
+            day += timedelta(days=1)
+        first = bisect.bisect_left(self.points, after)
+        last = bisect.bisect_left(self.points, until)
+        candidates.extend(self.points[first:last])
+
+        for candidate in sorted(candidates):
+            start = within_opening_hours(candidate, length)
+            if start >= until:
+                break
+            if self.is_free(start, start + length):
+                return start
+        return None
+
+
+class BaySchedule(object):
+    """
+    Occupancy of a set of bays over a window of time, built from the jobs booked into them and
+    the estimated time of those jobs. Only bookings which can overlap the window are loaded, so the
+    cost depends on the size of the window rather than on the whole booking history.
+    """
+
+    def __init__(self, bays, start, end, exclude_job=None):
+        self.start = start
+        self.end = end
+
+        job_filters = {
+            'bay__in': bays,
+            'is_deleted': False,
+            'booking_date__gte': start - MAX_BOOKING_LENGTH,
+            'booking_date__lt': end,
+        }
+        jobs = Job.objects.filter(**job_filters).exclude(status='1')
+        if exclude_job is not None:
+            jobs = jobs.exclude(id=exclude_job.id)
+        times = estimated_times(**job_filters)
+
+        bookings = dict((bay.id, []) for bay in bays)
+        for job_id, bay_id, booking_date in jobs.values_list('id', 'bay_id', 'booking_date'):
+            booking_end = booking_date + (times.get(job_id) or DEFAULT_BOOKING_LENGTH)
+            if booking_end > start:
+                bookings[bay_id].append((booking_date, booking_end))
+
+        self.timelines = [BayTimeline(bay, bookings[bay.id]) for bay in bays]
+
+    # returns the timeline of the given bay
+    def timeline(self, bay):
+        for timeline in self.timelines:
+            if timeline.bay.id == bay.id:
+                return timeline
+
+    # returns a list of (bay, start) pairs, one per bay, ordered by the earliest free start
+    # before 'until' (by default, the end of the window)
+    def free_slots(self, length, until=None):
+        until = until or self.end
+        slots = []
+        for timeline in self.timelines:
+            start = timeline.first_free_slot(self.start, length, until)
+            if start is not None:
+                slots.append((timeline.bay, start))
+        slots.sort(key=lambda slot: slot[1])
+        return slots
+
+
+# returns the first free (bay, start) of the given bay type, for a booking of the given length
+# made no sooner than 'after', or None when nothing is free within the search horizon
+def first_free_slot(bay_type, after, length, exclude_job=None):
+    slots = free_slots(bay_type, after, length, exclude_job=exclude_job)
+    if slots:
+        return slots[0]
+    return None
+
+
+# returns the earliest free (bay, start) for every bay of the given bay type. A job being rebooked
+# can be excluded so that it doesn't clash with its own current booking.
+def free_slots(bay_type, after, length, exclude_job=None):
+    bays = list(Bay.objects.filter(is_deleted=False, bay_type=bay_type))
+    if not bays:
+        return []
+    # the window runs one booking length past the horizon, so bookings which would clash with the
+    # end of a slot starting just before the horizon are loaded too
+    until = after + SEARCH_HORIZON
+    return BaySchedule(bays, after, until + length, exclude_job=exclude_job).free_slots(length, until)
+
+
+# returns whether or not the given bay has a free spot for a booking of the given length
+def bay_available(bay, start, length, exclude_job=None):
+    schedule = BaySchedule([bay], start, start + length, exclude_job=exclude_job)
+    return schedule.timeline(bay).is_free(start, start + length)
+
+
+# recalculates the number of free spots each bay has right now from the jobs booked into it
+def refresh_free_spots():
+    bays = list(Bay.objects.filter(is_deleted=False))
+    if not bays:
+        return
+    now = timezone.now()
+    schedule = BaySchedule(bays, now, now + timedelta(microseconds=1))
+    for timeline in schedule.timelines:
+        free = max(timeline.capacity - timeline.max_occupancy(now, now + timedelta(microseconds=1)), 0)
+        if timeline.bay.free_spots != free:
+            Bay.objects.filter(id=timeline.bay.id).update(free_spots=free)
+
+
+# combines a booking date and an (optional) time into the moment the booking starts
+def booking_start(date, time=None):
+    if time is None:
+        time = datetime.time(OPENING_HOUR)
+    return timezone.make_aware(datetime.datetime.combine(date, time), timezone.get_current_timezone())
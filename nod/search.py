@@ -0,0 +1,179 @@
+import re
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+
+from nod.models import AccountHolder, BusinessCustomer, Customer, Dropin, EmailModel, Invoice, Job, Vehicle, \
+    contacts_by_customer
+from nod.utils import batches, chunks
+
+
+# the FTS5 table holding a document for every customer, vehicle, job and invoice. Only the label and terms
+# are searched; the kind and link are stored alongside them for the results.
+SEARCH_TABLE = 'nod_search'
+
+# each kind of document takes every fourth rowid, so the document of a row is found by its id, without
+# a scan over the unindexed columns
+KINDS = ['customer', 'vehicle', 'job', 'invoice']
+
+# most results a search returns
+MAX_RESULTS = 20
+
+# words of a search, which are matched as prefixes of the words indexed
+WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+# returns whether the database is able to hold the search index, which relies on SQLite's FTS5
+def search_enabled():
+    return connection.vendor == 'sqlite'
+
+
+# returns the rowid of the document of the given kind for the row with the given id
+def document_id(kind, pk):
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+# returns the link to the page of a customer, drop ins having a page of their own
+def customer_url(uuid, dropin_id):
+    return reverse('view-dropin' if dropin_id else 'view-customer', args=[uuid])
+
+
+# builds the documents of the given customers which aren't deleted, naming them by company where they have
+# one, and searchable by their names, emails and phone numbers
+def customer_documents(ids):
+    emails, phones = contacts_by_customer(ids)
+    for pk, uuid, forename, surname, company_name, dropin_id in Customer.objects.filter(
+            id__in=ids, is_deleted=False).values_list('id', 'uuid', 'forename', 'surname',
+                                                     'accountholder__businesscustomer__company_name', 'dropin__id'):
+        name = forename + " " + surname
+        label = company_name + " (" + name + ")" if company_name else name
+        terms = [company_name or '', name] + emails[pk] + phones[pk]
+        yield document_id('customer', pk), 'customer', customer_url(uuid, dropin_id), label, " ".join(terms)
+
+
+# builds the documents of the given vehicles which aren't deleted, linking to their owners, and searchable by
+# their registration numbers, with or without spaces, make, model and owner
+def vehicle_documents(ids):
+    for pk, reg_number, make, model, uuid, dropin_id, forename, surname in Vehicle.objects.filter(
+            id__in=ids, is_deleted=False).values_list('id', 'reg_number', 'make', 'model', 'customer__uuid',
+                                                     'customer__dropin__id', 'customer__forename',
+                                                     'customer__surname'):
+        label = reg_number + " - " + make + " " + model
+        terms = [reg_number, "".join(reg_number.split()), make, model, forename, surname]
+        yield document_id('vehicle', pk), 'vehicle', customer_url(uuid, dropin_id), label, " ".join(terms)
+
+
+# builds the documents of the given jobs which aren't deleted, searchable by their numbers and the
+# registration numbers of their vehicles
+def job_documents(ids):
+    for pk, uuid, job_number, reg_number in Job.objects.filter(id__in=ids, is_deleted=False).values_list(
+            'id', 'uuid', 'job_number', 'vehicle__reg_number'):
+        label = "Job %d - %s" % (job_number, reg_number)
+        terms = [str(job_number), reg_number, "".join(reg_number.split())]
+        yield document_id('job', pk), 'job', reverse('edit-job', args=[uuid]), label, " ".join(terms)
+
+
+# builds the documents of the given invoices which aren't deleted, searchable by their numbers and those of
+# the jobs they're for
+def invoice_documents(ids):
+    for pk, uuid, invoice_number, job_number in Invoice.objects.filter(id__in=ids, is_deleted=False).values_list(
+            'id', 'uuid', 'invoice_number', 'job_done__job_number'):
+        label = "Invoice %d" % invoice_number
+        terms = [str(invoice_number)] + ([str(job_number)] if job_number is not None else [])
+        yield document_id('invoice', pk), 'invoice', reverse('view-invoice', args=[uuid]), label, " ".join(terms)
+
+
+DOCUMENTS = {
+    'customer': customer_documents,
+    'vehicle': vehicle_documents,
+    'job': job_documents,
+    'invoice': invoice_documents,
+}
+
+
+# replaces the documents of the given rows of a kind with ones built from the rows as they are now. Rows
+# which were deleted, or soft deleted, are left out of the index.
+def index_documents(kind, ids):
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        for batch in batches(ids):
+            cursor.executemany("DELETE FROM " + SEARCH_TABLE + " WHERE rowid = %s",
+                               [(document_id(kind, pk),) for pk in batch])
+            documents = list(DOCUMENTS[kind](batch))
+            if documents:
+                cursor.executemany("INSERT INTO " + SEARCH_TABLE + " (rowid, kind, url, label, terms) "
+                                   "VALUES (%s, %s, %s, %s, %s)", documents)
+
+
+# rebuilds the whole index from the database, a batch of rows at a time
+def rebuild_index():
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM " + SEARCH_TABLE)
+    for kind, model in [('customer', Customer), ('vehicle', Vehicle), ('job', Job), ('invoice', Invoice)]:
+        for ids in chunks(model.objects.filter(is_deleted=False).values_list('id', flat=True).iterator()):
+            index_documents(kind, ids)
+
+
+# returns the documents best matching every word of a search, as dicts of their kind, label and link, with
+# matches on their labels ranked above those on their other terms
+def search(query, limit=MAX_RESULTS):
+    words = WORDS.findall(query.lower())
+    if not words or not search_enabled():
+        return []
+    match = " ".join('"%s"*' % word for word in words)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT kind, label, url FROM " + SEARCH_TABLE + " WHERE " + SEARCH_TABLE + " MATCH %s "
+                       "ORDER BY bm25(" + SEARCH_TABLE + ", 0, 0, 10.0, 1.0) LIMIT %s", [match, limit])
+        return [{'kind': kind, 'label': label, 'url': url} for kind, label, url in cursor.fetchall()]
+
+
+# the kind of document of each model whose rows are indexed
+MODEL_KINDS = {
+    Customer: 'customer',
+    Dropin: 'customer',
+    AccountHolder: 'customer',
+    BusinessCustomer: 'customer',
+    Vehicle: 'vehicle',
+    Job: 'job',
+    Invoice: 'invoice',
+}
+
+
+# keeps the document of a row in step with it. Connected to the save and delete signals of the indexed models.
+# The vehicles of a customer carry their name, so are refreshed with them.
+def refresh_search(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind = MODEL_KINDS[sender]
+    index_documents(kind, [instance.id])
+    if kind == 'customer':
+        index_documents('vehicle', Vehicle.objects.filter(customer_id=instance.id).values_list('id', flat=True))
+
+
+# refreshes the document of a customer whose emails or phone numbers were changed. Connected to the
+# m2m_changed signals of the contacts of customers.
+def refresh_customer_contacts(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Customer):
+        index_documents('customer', [instance.id])
+
+
+# refreshes the documents of the customers holding any of the given emails or phone numbers, whose terms
+# include them
+def index_contact_owners(model, contact_ids):
+    if model is EmailModel:
+        through, column = Customer.emails.through, 'emailmodel_id'
+    else:
+        through, column = Customer.phone_numbers.through, 'phonemodel_id'
+    for batch in batches(contact_ids):
+        index_documents('customer', set(through.objects.filter(**{column + '__in': batch})
+                                        .values_list('customer_id', flat=True)))
+
+
+# refreshes the documents of the customers holding an email or phone number which was edited or soft deleted.
+# Connected to the save signals of the contacts.
+def refresh_contact_owners(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_contact_owners(sender, [instance.id])
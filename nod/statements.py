@@ -0,0 +1,252 @@
+import calendar
+import datetime
+import multiprocessing
+import uuid
+from collections import defaultdict
+
+import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Q, Sum
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from nod.models import AccountHolder, FixedDiscount, Invoice, Payment, PriceControl, SellPart, Statement, \
+    VariableDiscount
+from nod.pricing import job_durations, parts_prices, price_from_history, price_histories
+from nod.utils import batches
+
+
+STATEMENT_TEMPLATE = 'nod/statement.html'
+
+# kind of the invoices for parts sold, alongside the job types of those for jobs, which discounts are set by
+PARTS = 'parts'
+
+
+# returns the first and last days of the month of the given date
+def month_bounds(month):
+    start = month.replace(day=1)
+    return start, start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+
+# returns every account holder and business customer which isn't deleted, as {customer id: details printed
+# on their statement}
+def account_holders():
+    holders = {}
+    for pk, forename, surname, address, postcode, company_name in AccountHolder.objects.filter(
+            is_deleted=False).values_list('id', 'forename', 'surname', 'address', 'postcode',
+                                          'businesscustomer__company_name'):
+        holders[pk] = {'id': pk, 'forename': forename, 'surname': surname, 'address': address,
+                       'postcode': postcode, 'company_name': company_name or ''}
+    return holders
+
+
+# returns the percentages taken off each kind of invoice by the discount plan of every account holder which has
+# one, as {customer id: {job type or PARTS: percentage}}, as Invoice.get_price takes them off. Flexible
+# discounts take nothing off the invoices themselves.
+def discount_rates():
+    fixed = dict(FixedDiscount.objects.values_list('id', 'discount'))
+    variable = dict((pk, {'1': mot, '2': repair, '3': annual, PARTS: parts}) for pk, mot, repair, annual, parts
+                    in VariableDiscount.objects.values_list('id', 'mot_discount', 'repair_discount',
+                                                            'annual_discount', 'parts_discount'))
+    fixed_type = ContentType.objects.get_for_model(FixedDiscount).id
+    variable_type = ContentType.objects.get_for_model(VariableDiscount).id
+
+    rates = {}
+    for pk, content_type_id, object_id in AccountHolder.objects.filter(
+            is_deleted=False, content_type__isnull=False).values_list('id', 'content_type_id', 'object_id'):
+        if content_type_id == fixed_type and object_id in fixed:
+            rates[pk] = dict((kind, fixed[object_id]) for kind in ['1', '2', '3', PARTS])
+        elif content_type_id == variable_type and object_id in variable:
+            rates[pk] = variable[object_id]
+    return rates
+
+
+# returns the filter matching the invoices of account holders, whether for jobs on their vehicles or parts sold
+# to them, through the given relation to the invoices
+def account_invoices(prefix=''):
+    return Q(**{prefix + 'job_done__vehicle__customer__accountholder__isnull': False}) | \
+        Q(**{prefix + 'part_order__content_type__app_label': 'nod',
+             prefix + 'part_order__content_type__model__in': ['accountholder', 'businesscustomer']})
+
+
+# returns the invoices of account holders issued within the month, along with those issued before its end which
+# are still unpaid, as dicts of what's needed to price them
+def statement_invoices(start, end):
+    invoices = []
+    for (pk, invoice_number, issue_date, job_id, job_type, booking_date, rate, job_customer_id, order_id,
+         order_date, order_customer_id) in Invoice.objects.filter(is_deleted=False, issue_date__lte=end)\
+            .filter(Q(issue_date__gte=start) | Q(paid=False)).filter(account_invoices()).values_list(
+            'id', 'invoice_number', 'issue_date', 'job_done_id', 'job_done__type', 'job_done__booking_date',
+            'job_done__mechanic__hourly_pay', 'job_done__vehicle__customer_id', 'part_order_id',
+            'part_order__date', 'part_order__object_id'):
+        invoices.append({
+            'id': pk, 'invoice_number': invoice_number, 'issue_date': issue_date, 'job_id': job_id,
+            'kind': job_type if job_id else PARTS, 'booking_date': booking_date, 'rate': rate,
+            'order_id': order_id, 'order_date': order_date,
+            'customer_id': job_customer_id if job_id else order_customer_id,
+        })
+    return invoices
+
+
+# returns the price of the parts sold in each of the given part orders, as it was on the day each was placed,
+# marked up, as {order id: price}, as CustomerPartsOrder.get_parts_price works it out
+def order_parts_prices(order_dates, markup):
+    sold = []
+    for batch in batches(order_dates):
+        sold.extend(SellPart.objects.filter(order_id__in=batch).values_list('order_id', 'part_id', 'quantity',
+                                                                             'part__price'))
+    histories = price_histories(set(row[1] for row in sold), max(order_dates.values())) if order_dates else {}
+
+    totals = defaultdict(float)
+    for order_id, part_id, quantity, current_price in sold:
+        price = float(price_from_history(histories, part_id, order_dates[order_id], current_price))
+        totals[order_id] += round(price + price * markup, 2) * quantity
+    return dict((order_id, round(total, 2)) for order_id, total in totals.items())
+
+
+# works out the amount due on each of the given invoices, as Invoice.get_price does, from a few queries over
+# the parts and tasks of all their jobs and orders at once, and stores it on each invoice as its amount
+def price_invoices(invoices, rates, vat, markup):
+    booking_dates = dict((invoice['job_id'], invoice['booking_date']) for invoice in invoices if invoice['job_id'])
+    job_parts = {}
+    hours = {}
+    for batch in batches(booking_dates):
+        job_parts.update(parts_prices(dict((job_id, booking_dates[job_id]) for job_id in batch)))
+        hours.update(job_durations(batch))
+    order_parts = order_parts_prices(dict((invoice['order_id'], invoice['order_date']) for invoice in invoices
+                                          if not invoice['job_id']), markup)
+
+    for invoice in invoices:
+        if invoice['job_id']:
+            duration = round(hours.get(invoice['job_id'], 0), 2)
+            labour = round(duration * float(invoice['rate'] or 0), 2)
+            price = round(labour + job_parts.get(invoice['job_id'], 0), 2)
+        else:
+            price = order_parts.get(invoice['order_id'], 0)
+        total = round(price + round(price * vat, 2), 2)
+        discount = float(rates.get(invoice['customer_id'], {}).get(invoice['kind'], 0))
+        invoice['amount'] = round(total - total * discount / 100, 2)
+
+
+# returns the payments made within the month against invoices of account holders, as dicts of their details
+def statement_payments(start, end):
+    payments = []
+    for date, amount, payment_type, invoice_number, job_customer_id, order_customer_id in Payment.objects.filter(
+            is_deleted=False, invoice__is_deleted=False, date__gte=start, date__lte=end)\
+            .filter(account_invoices('invoice__'))\
+            .values_list('date', 'amount', 'payment_type', 'invoice__invoice_number',
+                         'invoice__job_done__vehicle__customer_id', 'invoice__part_order__object_id'):
+        payments.append({
+            'date': date, 'amount': round(amount, 2), 'invoice_number': invoice_number,
+            'payment_type': dict(Payment.PAYMENT_TYPES)[payment_type],
+            'customer_id': job_customer_id if job_customer_id is not None else order_customer_id,
+        })
+    return payments
+
+
+# returns how much was paid by the end of the month against each of the given invoices, as {invoice id: amount},
+# from a grouped query for each batch of invoices
+def paid_to_date(invoice_ids, end):
+    paid = {}
+    for batch in batches(invoice_ids):
+        paid.update(Payment.objects.filter(is_deleted=False, invoice_id__in=batch, date__lte=end)
+                    .values('invoice_id').annotate(total=Sum('amount')).values_list('invoice_id', 'total'))
+    return paid
+
+
+# builds the statement of every account holder for the month of the given date, as the plain data rendered
+# into each: the invoices issued and payments made within the month, and the invoices left unpaid at its
+# end with what's still due on them. The whole book is read with a few queries for every kind of row, rather
+# than customer by customer. Customers with nothing to show for the month and nothing owed get no statement.
+def statement_contexts(month):
+    start, end = month_bounds(month)
+    holders = account_holders()
+    price_control = PriceControl.objects.get()
+    vat = float(price_control.vat / 100)
+    markup = float(price_control.marked_up / 100)
+
+    invoices = [invoice for invoice in statement_invoices(start, end) if invoice['customer_id'] in holders]
+    price_invoices(invoices, discount_rates(), vat, markup)
+    paid = paid_to_date([invoice['id'] for invoice in invoices], end)
+
+    lines = defaultdict(list)
+    outstanding = defaultdict(list)
+    for invoice in invoices:
+        customer_id = invoice['customer_id']
+        if invoice['issue_date'] >= start:
+            lines[customer_id].append({
+                'date': invoice['issue_date'], 'description': "Invoice %d" % invoice['invoice_number'],
+                'charge': invoice['amount'], 'credit': None,
+            })
+        due = round(invoice['amount'] - (paid.get(invoice['id']) or 0), 2)
+        if due > 0:
+            outstanding[customer_id].append({
+                'invoice_number': invoice['invoice_number'], 'issue_date': invoice['issue_date'],
+                'amount': invoice['amount'], 'due': due,
+            })
+    for payment in statement_payments(start, end):
+        if payment['customer_id'] in holders:
+            lines[payment['customer_id']].append({
+                'date': payment['date'],
+                'description': "%s payment, invoice %d" % (payment['payment_type'], payment['invoice_number']),
+                'charge': None, 'credit': payment['amount'],
+            })
+
+    contexts = []
+    issued = datetime.date.today()
+    for customer_id in sorted(holders):
+        if not lines[customer_id] and not outstanding[customer_id]:
+            continue
+        customer_lines = sorted(lines[customer_id], key=lambda line: line['date'])
+        contexts.append({
+            'customer': holders[customer_id],
+            'month': start,
+            'issued': issued,
+            'lines': customer_lines,
+            'outstanding': outstanding[customer_id],
+            'invoiced': round(sum(line['charge'] or 0 for line in customer_lines), 2),
+            'paid': round(sum(line['credit'] or 0 for line in customer_lines), 2),
+            'balance': round(sum(invoice['due'] for invoice in outstanding[customer_id]), 2),
+        })
+    return contexts
+
+
+# renders a statement from its context. Run in the worker processes, so it's given and returns plain data only,
+# and reads nothing from the database.
+def render_statement(context):
+    return render_to_string(STATEMENT_TEMPLATE, context)
+
+
+# renders the given statements across a pool of worker processes, one for each processor unless a number is
+# given, returning the html of each in the same order. A single worker renders them in this process.
+def render_statements(contexts, workers=None):
+    if workers == 1 or len(contexts) < 2:
+        return [render_statement(context) for context in contexts]
+    # forked workers would share the database connections of this process, so they're closed beforehand and
+    # opened again as they're next needed
+    for connection in connections.all():
+        connection.close()
+    pool = multiprocessing.Pool(workers, initializer=django.setup)
+    try:
+        return pool.map(render_statement, contexts)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# generates and stores the statements of every account holder for the month of the given date, rendered by
+# the given number of worker processes, replacing any generated for the month before. Returns how many there were.
+def generate_statements(month, workers=None):
+    contexts = statement_contexts(month)
+    rendered = render_statements(contexts, workers)
+    start = month_bounds(month)[0]
+    with transaction.atomic():
+        Statement.objects.filter(month=start, is_deleted=False).update(is_deleted=True, updated=timezone.now())
+        # bulk_create skips save(), so the uuids are generated here
+        Statement.objects.bulk_create([
+            Statement(customer_id=context['customer']['id'], month=start, invoiced=context['invoiced'],
+                      paid=context['paid'], balance=context['balance'], html=html, uuid=uuid.uuid4().hex)
+            for context, html in zip(contexts, rendered)
+        ], batch_size=500)
+    return len(contexts)
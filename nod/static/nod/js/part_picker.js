@@ -0,0 +1,30 @@
+// part pickers: a text input searching the catalogue, filling in the hidden input holding the part's id.
+// Autocomplete is attached on first focus so that rows added to a formset later on get it as well.
+// Pickers inside an element with a data-vehicle attribute only offer the parts fitting that vehicle.
+$(document).on('focus', '.part-picker', function() {
+    var input = $(this);
+    if (input.data('autocomplete')) {
+        return;
+    }
+    var vehicle = input.closest('[data-vehicle]').data('vehicle');
+    input.autocomplete({
+        source: function(request, response) {
+            var params = {term: request.term};
+            if (vehicle) {
+                params.vehicle = vehicle;
+            }
+            $.getJSON(input.data('source'), params, response);
+        },
+        minLength: 1,
+        position: {my: "left top"},
+        select: function(event, ui) {
+            input.prev('input[type=hidden]').val(ui.item.id);
+        },
+        change: function(event, ui) {
+            // typing over a chosen part without picking another one clears it
+            if (!ui.item) {
+                input.prev('input[type=hidden]').val('');
+            }
+        }
+    });
+});
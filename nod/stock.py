@@ -0,0 +1,259 @@
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from nod.models import JobPart, Part, PartStock, Site, StockMovement
+from nod.utils import batches
+
+
+# movement kinds, as stored on StockMovement
+DELIVERY = '1'
+JOB = '2'
+SALE = '3'
+ADJUSTMENT = '4'
+OPENING_BALANCE = '5'
+TRANSFER = '6'
+
+
+# returns the site whose stock is used where no other is known: the first one set up
+def default_site():
+    return Site.objects.filter(is_deleted=False).order_by('id').first()
+
+
+# returns the site a staff member works at, or the default site for staff who aren't at any
+def staff_site(staff=None):
+    if staff is not None and staff.site_id:
+        return staff.site
+    return default_site()
+
+
+# returns the site whose stock a job draws from: that of its bay, or failing that the staff member's
+def job_site(job, staff=None):
+    if job.bay_id and job.bay.site_id:
+        return job.bay.site
+    return staff_site(staff)
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when more of a part is taken from a site than the site holds, rather than letting the
+    stock of the site go below nothing.
+    """
+
+    def __init__(self, part, site, requested, available):
+        self.part = part
+        self.site = site
+        self.requested = requested
+        self.available = available
+        super(InsufficientStock, self).__init__(shortfall_message(part, site, requested, available))
+
+
+# returns the message telling staff that a site holds less of a part than was asked of it
+def shortfall_message(part, site, requested, available):
+    where = " at " + site.name if site is not None else ""
+    return "Only %d of %s in stock%s, %d needed." % (available, part.name, where, requested)
+
+
+# returns the stock of a part held at a site
+def site_quantity(part, site):
+    return PartStock.all_objects.filter(part=part, site=site).values_list('quantity', flat=True).first() or 0
+
+
+# changes the stock of a part held at a site by the given (signed) quantity, in the database. Stock is only
+# taken where the site holds enough of it, checked in the same statement as it's taken, so concurrent movements
+# can't take the same stock twice; InsufficientStock is raised otherwise.
+def change_site_stock(part, site, quantity):
+    stocks = PartStock.all_objects.filter(part=part, site=site)
+    if quantity < 0:
+        if not stocks.filter(quantity__gte=-quantity).update(quantity=F('quantity') + quantity,
+                                                             updated=timezone.now()):
+            raise InsufficientStock(part, site, -quantity, site_quantity(part, site))
+    elif not stocks.update(quantity=F('quantity') + quantity, updated=timezone.now()):
+        PartStock.objects.create(part=part, site=site, quantity=quantity)
+
+
+# changes the stock of a part at a site (the staff member's, unless another is given) by the given (signed)
+# quantity, and records the movement in the ledger along with the total stock it leaves behind. The stock is
+# changed in the database rather than from the copy of the part in memory, so concurrent movements can't
+# overwrite each other, and InsufficientStock is raised rather than taking more than the site holds. Must run
+# inside a transaction. Movements are always dated when they're recorded, so the latest movement of a part is
+# also its last one.
+def move_stock(part, quantity, kind, staff=None, site=None, **references):
+    site = site or staff_site(staff)
+    if site is not None:
+        change_site_stock(part, site, quantity)
+        Part.all_objects.filter(id=part.id).update(quantity=F('quantity') + quantity)
+    # without any sites, the total stock of the part is all there is to take from, so it's checked as it's taken
+    elif not Part.all_objects.filter(id=part.id, quantity__gte=-quantity).update(quantity=F('quantity') + quantity):
+        raise InsufficientStock(part, None, -quantity,
+                                Part.all_objects.filter(id=part.id).values_list('quantity', flat=True).get())
+    part.quantity = Part.all_objects.filter(id=part.id).values_list('quantity', flat=True).get()
+    return StockMovement.objects.create(part=part, date=timezone.now(), kind=kind, quantity=quantity,
+                                        balance=part.quantity, staff=staff, site=site, **references)
+
+
+# records the stock a new part starts with as the opening balance of its ledger, held at the given site (or
+# the staff member's)
+def open_stock(part, staff=None, site=None):
+    site = site or staff_site(staff)
+    if site is not None:
+        PartStock.objects.create(part=part, site=site, quantity=part.quantity)
+    return StockMovement.objects.create(part=part, date=timezone.now(), kind=OPENING_BALANCE,
+                                        quantity=part.quantity, balance=part.quantity, staff=staff, site=site)
+
+
+# sets the stock of a part at a site (the staff member's, unless another is given) to the given quantity,
+# recording the difference as a manual adjustment
+def set_stock(part, quantity, staff=None, site=None):
+    site = site or staff_site(staff)
+    if site is not None:
+        current = site_quantity(part, site)
+    else:
+        current = Part.all_objects.filter(id=part.id).values_list('quantity', flat=True).get()
+    if quantity != current:
+        return move_stock(part, quantity - current, ADJUSTMENT, staff=staff, site=site)
+    part.quantity = Part.all_objects.filter(id=part.id).values_list('quantity', flat=True).get()
+    return None
+
+
+# returns the quantity of a job part which was taken from stock for it: none where the row was removed from the
+# job, which put its stock back, or where there wasn't enough stock to take
+def taken_for_job(job_part):
+    if job_part.is_deleted or not job_part.sufficient_quantity:
+        return 0
+    return job_part.quantity
+
+
+# sets the parts used for a job to the given {part: quantity}, moving only the difference from what was already
+# taken for it out of (or back into) the stock of the job's site, so that saving a job again leaves its stock
+# and ledger as they were. Parts dropped from the job are put back. A part there isn't enough stock of is marked
+# as short with none of it taken, and is taken the next time the job is saved with the stock there. Must run
+# inside a transaction.
+def sync_job_parts(job, parts, staff=None):
+    site = job_site(job, staff)
+    rows = {}
+    # the row of each part which is still on the job is the one kept, otherwise the latest removed
+    for job_part in JobPart.all_objects.filter(job=job).select_related('part').order_by('is_deleted', '-id'):
+        rows.setdefault(job_part.part_id, job_part)
+
+    used = set(part.id for part in parts)
+    for part_id, job_part in rows.items():
+        if part_id not in used and not job_part.is_deleted:
+            if taken_for_job(job_part):
+                move_stock(job_part.part, taken_for_job(job_part), JOB, staff=staff, site=site, job=job)
+            job_part.is_deleted = True
+            job_part.save()
+
+    for part, quantity in parts.items():
+        job_part = rows.get(part.id)
+        if job_part is None:
+            job_part, taken = JobPart(job=job, part=part), 0
+        else:
+            taken = taken_for_job(job_part)
+        job_part.quantity = quantity
+        job_part.is_deleted = False
+        if quantity != taken:
+            try:
+                move_stock(part, taken - quantity, JOB, staff=staff, site=site, job=job)
+                job_part.sufficient_quantity = True
+            except InsufficientStock:
+                # what was taken before goes back, so that a short part never holds any stock
+                if taken:
+                    move_stock(part, taken, JOB, staff=staff, site=site, job=job)
+                job_part.sufficient_quantity = False
+        job_part.save()
+
+
+# moves the given quantity of a part from the site a transfer is from to the site it's to, recording a
+# movement out of one and into the other. The total stock of the part is left as it was.
+def transfer_stock(transfer, part, quantity, staff=None):
+    change_site_stock(part, transfer.from_site, -quantity)
+    change_site_stock(part, transfer.to_site, quantity)
+    part.quantity = Part.all_objects.filter(id=part.id).values_list('quantity', flat=True).get()
+    now = timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(part=part, date=now, kind=TRANSFER, quantity=-quantity, balance=part.quantity, staff=staff,
+                      site=transfer.from_site, transfer=transfer),
+        StockMovement(part=part, date=now, kind=TRANSFER, quantity=quantity, balance=part.quantity, staff=staff,
+                      site=transfer.to_site, transfer=transfer),
+    ])
+
+
+# returns the stock of the parts at or below their low level threshold at a site, with their parts
+def low_stock_at(site):
+    return PartStock.objects.filter(site=site, is_deleted=False, part__is_deleted=False,
+                                    quantity__lte=F('part__low_level_threshold')).select_related('part')
+
+
+# returns the parts whose stock across every site is at or below their low level threshold
+def low_stock():
+    return Part.objects.filter(is_deleted=False, quantity__lte=F('low_level_threshold'))
+
+
+# returns the number of parts stocked, the units held and the number of parts low on stock at each site, as
+# one aggregate over the stock of every site
+def site_totals():
+    totals = dict((site_id, {'parts': parts, 'units': units or 0, 'low': 0}) for site_id, parts, units in
+                  PartStock.objects.filter(is_deleted=False, part__is_deleted=False, quantity__gt=0)
+                  .values('site_id').annotate(parts=Count('id'), units=Sum('quantity'))
+                  .values_list('site_id', 'parts', 'units'))
+    for site_id, low in PartStock.objects.filter(is_deleted=False, part__is_deleted=False,
+                                                 quantity__lte=F('part__low_level_threshold'))\
+            .values('site_id').annotate(low=Count('id')).values_list('site_id', 'low'):
+        totals.setdefault(site_id, {'parts': 0, 'units': 0, 'low': 0})['low'] = low
+    return totals
+
+
+# returns the balance of every part as left by its last movement before the given moment (or its last
+# movement of all), as {part id: stock}
+def balances_at(moment=None, part_ids=None):
+    movements = StockMovement.objects.all()
+    if moment is not None:
+        movements = movements.filter(date__lt=moment)
+    if part_ids is not None:
+        movements = movements.filter(part_id__in=part_ids)
+    last_ids = [row['last_id'] for row in movements.values('part_id').annotate(last_id=Max('id'))]
+    balances = {}
+    for batch in batches(last_ids):
+        balances.update(StockMovement.objects.filter(id__in=batch).values_list('part_id', 'balance'))
+    return balances
+
+
+# returns the opening stock, the movements of each kind and the closing stock of every part over the period
+# between two moments, as {part id: {'opening': .., 'delivered': .., 'used': .., 'sold': .., 'adjusted': ..,
+# 'closing': ..}}, using the ledger alone
+def stock_period(start, end, part_ids=None):
+    names = {
+        DELIVERY: 'delivered',
+        JOB: 'used',
+        SALE: 'sold',
+        ADJUSTMENT: 'adjusted',
+        OPENING_BALANCE: 'adjusted',
+        # a transfer moves stock between sites, so its movements cancel out over the total stock
+        TRANSFER: 'adjusted',
+    }
+    period = {}
+    for part_id, balance in balances_at(start, part_ids).items():
+        period[part_id] = {'opening': balance, 'delivered': 0, 'used': 0, 'sold': 0, 'adjusted': 0,
+                           'closing': balance}
+
+    movements = StockMovement.objects.filter(date__gte=start, date__lt=end)
+    if part_ids is not None:
+        movements = movements.filter(part_id__in=part_ids)
+    for row in movements.values('part_id', 'kind').annotate(total=Sum('quantity')):
+        part = period.setdefault(row['part_id'], {'opening': 0, 'delivered': 0, 'used': 0, 'sold': 0,
+                                                  'adjusted': 0, 'closing': 0})
+        part[names[row['kind']]] += row['total']
+        part['closing'] += row['total']
+    return period
+
+
+# returns every part whose stock no longer matches the balance left by its last movement, as a list of
+# (part, stock, ledger balance)
+def stock_drift():
+    balances = balances_at()
+    drift = []
+    for part in Part.objects.filter(is_deleted=False).only('id', 'name', 'code', 'quantity'):
+        balance = balances.get(part.id, 0)
+        if part.quantity != balance:
+            drift.append((part, part.quantity, balance))
+    return drift
@@ -1,5 +1,7 @@
 import django_tables2 as tables
 from django_tables2.utils import A
+from django.core.urlresolvers import reverse
+from django.utils.html import format_html
 from .models import *
 
 
@@ -33,6 +35,9 @@ class DropInTable(tables.Table):
     full_name = tables.LinkColumn('view-dropin', args=[A('uuid')], order_by="surname", verbose_name="Name")
     list_emails = tables.Column(verbose_name="Emails", orderable=False)
     get_phones = tables.Column(verbose_name="Phones", orderable=False)
+    mot_jobs = tables.Column(verbose_name="MOT Jobs")
+    repair_jobs = tables.Column(verbose_name="Repair Jobs")
+    annual_jobs = tables.Column(verbose_name="Annual Jobs")
 
     # def render_tr_class(self):
     #     for row in self.rows:
@@ -119,6 +124,19 @@ class UntakenJobsTable(tables.Table):
         attrs = {"class": "table table-striped table-hover "}
 
 
+class ProposedAssignmentsTable(tables.Table):
+    job_number = tables.LinkColumn('edit-job', args=[A('uuid')], verbose_name="Job No.")
+    type = tables.Column(verbose_name="Type")
+    booking_date = tables.Column(verbose_name="Booking Date")
+    mechanic = tables.Column(verbose_name="Mechanic")
+    hours = tables.Column(verbose_name="Estimated Hours")
+    load = tables.Column(verbose_name="Mechanic's Outstanding Hours")
+
+    class Meta:
+        attrs = {"class": "table table-striped table-hover "}
+        orderable = False
+
+
 class MyJobsTable(tables.Table):
     job_number = tables.LinkColumn('edit-job', args=[A('uuid')], order_by="job_number",
                                    verbose_name="Job No.")
@@ -178,9 +196,14 @@ class TimeReportTable(tables.Table):
 
 class SupplierTable(tables.Table):
     company_name = tables.LinkColumn('edit-supplier', args=[A('uuid')], verbose_name='Company Name', order_by='company_name')
-    list_emails = tables.Column(verbose_name="Emails", orderable=False)
+    get_emails = tables.Column(verbose_name="Emails", orderable=False)
     get_phones = tables.Column(verbose_name="Phones", orderable=False)
     full_address = tables.Column(verbose_name="Address", orderable=False)
+    spend = tables.Column(verbose_name="Total Spend (£)", order_by='spend')
+
+    # rounds the spend summed in the database to pence
+    def render_spend(self, value):
+        return round(value, 2)
 
     class Meta:
         attrs = {"class": "table table-striped table-hover "}
@@ -218,4 +241,43 @@ class LowStockTable(tables.Table):
     low_level_threshold = tables.Column(verbose_name="Low Level Threshold", order_by="low_level_threshold")
 
     class Meta:
-        attrs = {"class": "table table-striped table-hover "}
\ No newline at end of file
+        attrs = {"class": "table table-striped table-hover "}
+
+
+class PartStockTable(tables.Table):
+    name = tables.LinkColumn('edit-part', args=[A('part.uuid')], accessor='part.name', order_by="part.name",
+                             verbose_name="Name")
+    code = tables.Column(accessor='part.code', verbose_name="Code", order_by="part.code")
+    manufacturer = tables.Column(accessor='part.manufacturer', verbose_name="Manufacturer",
+                                 order_by="part.manufacturer")
+    site = tables.Column(verbose_name="Site", order_by="site.name")
+    quantity = tables.Column(verbose_name="Quantity", order_by="quantity")
+    low_level_threshold = tables.Column(accessor='part.low_level_threshold', verbose_name="Low Level Threshold",
+                                        order_by="part.low_level_threshold")
+
+    class Meta:
+        attrs = {"class": "table table-striped table-hover "}
+
+
+class SiteStockTable(tables.Table):
+    name = tables.Column(verbose_name="Site", order_by="name")
+    parts = tables.Column(verbose_name="Parts Stocked", order_by="parts")
+    units = tables.Column(verbose_name="Units Held", order_by="units")
+    low = tables.Column(verbose_name="Parts Low on Stock", order_by="low")
+
+    # links each site to the stock held there
+    def render_name(self, value, record):
+        return format_html('<a href="{}?site={}">{}</a>', reverse('site-stock'), record['uuid'], value)
+
+    class Meta:
+        attrs = {"class": "table table-striped table-hover "}
+
+
+class DraftOrdersTable(tables.Table):
+    date = tables.LinkColumn('edit-replenish-order', args=[A('uuid')], order_by="date", verbose_name="Drafted")
+    supplier = tables.Column(verbose_name="Supplier", order_by="supplier.company_name")
+    part_count = tables.Column(verbose_name="Parts", order_by="part_count")
+    total_price = tables.Column(verbose_name="Value (£)", order_by="total_price")
+
+    class Meta:
+        attrs = {"class": "table table-striped table-hover "}
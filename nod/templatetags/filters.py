@@ -66,10 +66,11 @@ def get_job_parts(invoice):
     return invoice.job_done.parts.filter(is_deleted=False)
 
 
-# returns the object of the association class JobParts assigned to the specified part and job
+# returns the object of the association class JobParts assigned to the specified part and job, through the
+# job so that the prices of its parts are only looked up once
 @register.filter(name="actual_job_part")
 def actual_job_parts(part, job):
-    return JobPart.objects.get(part=part, job=job, is_deleted=False)
+    return job.jobpart_set.get(part=part, is_deleted=False)
 
 
 # returns a list of parts sold to a customer for an invoice
@@ -78,13 +79,14 @@ def get_parts_sold(invoice):
     return invoice.part_order.parts.filter(is_deleted=False)
 
 
-# returns the objects of the association class SellPart assigned to the specified part and order
+# returns the objects of the association class SellPart assigned to the specified part and order, through the
+# order so that the prices of its parts are only looked up once
 @register.filter(name="actual_parts_sold")
 def actual_parts_sold(part, order):
-    return SellPart.objects.get(part=part, order=order, is_deleted=False)
+    return order.sellpart_set.get(part=part, is_deleted=False)
 
 
-# returns marked up price for a given part
+# returns marked up price for a given part used for a job or sold, as it was on the day
 @register.filter(name='unit_price')
 def get_unit_price(part):
     return part.get_markedup_price()
@@ -185,8 +187,8 @@ def get_stock_cost(part):
 
 # return the initial stock price for a given part by multiplying the initial stock quantity by the unit price
 @register.filter(name='initial_cost')
-def get_stock_cost(part):
-    return part.initial_stock_level * part.part.price
+def get_initial_cost(part):
+    return part.get_initial_cost()
 
 
 # return the total initial cost for a given report (given time period)
@@ -1,3 +1,1052 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connection, transaction
+from django.forms import formset_factory
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from nod import assignment, dedup, events, fitment, forecasting, pricing, scheduling, search, stock
+from nod.archive import archive_deleted, archived_rows
+from nod.choices import CachedModelChoiceField, version_key
+from nod.contacts import sync_contacts, upsert_contacts, validate_phone_numbers
+from nod.counters import recount_jobs
+from nod.drafts import draft_vehicles, reg_number_taken, save_draft, stage_vehicle
+from nod.exports import export_lines
+from nod.forms import BaseEmailFormSet, BasePhoneFormSet, EmailForm, JobPartForm, PhoneForm
+from nod.imports import import_parts
+from nod.maintenance import purge_abandoned_customers
+from nod.models import AccountHolder, Bay, Customer, CustomerPartsOrder, Dropin, EmailModel, FixedDiscount, Invoice, \
+    Job, JobEvent, JobPart, JobTask, Mechanic, OrderPartRelationship, Part, PartOrder, PartPrice, PartStock, \
+    Payment, PhoneModel, PriceControl, SellPart, Site, StaffMember, Statement, StockMovement, StockTransfer, \
+    Supplier, Task, Vehicle, normalize_reg, reg_number_in_use, with_contacts
+from nod.pagination import paginate_keyset
+from nod.reports import create_spare_parts_report
+from nod.statements import generate_statements, statement_contexts
+from nod.tables import PartTable
+
+
+# creates a drop in customer, along with whatever details are given
+def make_customer(**kwargs):
+    kwargs.setdefault('forename', 'Jane')
+    kwargs.setdefault('surname', 'Smith')
+    return Dropin.objects.create(**kwargs)
+
+
+# creates a vehicle of the given customer under the given registration number
+def make_vehicle(customer, reg_number='AB12 CDE', **kwargs):
+    kwargs.setdefault('make', 'Ford')
+    kwargs.setdefault('model', 'Focus')
+    kwargs.setdefault('engine_serial', 'E1')
+    kwargs.setdefault('chassis_number', 'C1')
+    kwargs.setdefault('color', 'Blue')
+    kwargs.setdefault('type', '2')
+    return Vehicle.objects.create(customer=customer, reg_number=reg_number, **kwargs)
+
+
+# creates a part of the catalogue, with the given stock
+def make_part(code='P1', quantity=0, **kwargs):
+    kwargs.setdefault('name', 'Brake Pad ' + code)
+    kwargs.setdefault('manufacturer', 'Acme')
+    kwargs.setdefault('vehicle_type', 'Ford Focus')
+    kwargs.setdefault('years', '2010-2015')
+    kwargs.setdefault('price', 10.0)
+    kwargs.setdefault('low_level_threshold', 2)
+    return Part.objects.create(code=code, quantity=quantity, **kwargs)
+
+
+# returns bound, validated email and phone formsets holding the given (address, type) and (number, type) rows
+def contact_formsets(emails=(), phones=()):
+    formsets = []
+    for form, base, prefix, rows, fields in [
+            (EmailForm, BaseEmailFormSet, 'fs1', emails, ('email_address', 'email_type')),
+            (PhoneForm, BasePhoneFormSet, 'fs2', phones, ('phone_number', 'phone_type'))]:
+        data = {prefix + '-TOTAL_FORMS': str(len(rows)), prefix + '-INITIAL_FORMS': '0'}
+        for i, row in enumerate(rows):
+            for field, value in zip(fields, row):
+                data['%s-%d-%s' % (prefix, i, field)] = value
+        formset = formset_factory(form, formset=base)(data, prefix=prefix)
+        assert formset.is_valid(), formset.errors
+        formsets.append(formset)
+    return formsets
+
+
+# creates a job on the given vehicle, booked into a new bay at the given moment
+def make_job(vehicle, job_number=1, booking_date=None, **kwargs):
+    kwargs.setdefault('type', '2')
+    if 'bay' not in kwargs:
+        kwargs['bay'] = Bay.objects.create(bay_type='2', total_spots=2, free_spots=2)
+    return Job.objects.create(vehicle=vehicle, job_number=job_number,
+                              booking_date=booking_date or timezone.now(), **kwargs)
+
+
+class VehicleRegKeyTest(TestCase):
+
+    def setUp(self):
+        self.customer = make_customer()
+        self.vehicle = make_vehicle(self.customer, 'AB12 CDE')
+
+    def test_reg_key_is_normalised(self):
+        self.assertEqual(self.vehicle.reg_key, 'AB12CDE')
+        self.assertEqual(normalize_reg(' ab12  cde '), 'AB12CDE')
+
+    def test_reg_number_in_use_ignores_spacing_and_case(self):
+        self.assertTrue(reg_number_in_use('ab12cde'))
+        self.assertFalse(reg_number_in_use('ab12cde', exclude=self.vehicle))
+        self.assertFalse(reg_number_in_use('XY34 ZZZ'))
+
+    def test_registrations_differing_in_spacing_cannot_both_be_saved(self):
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                make_vehicle(self.customer, 'ab12cde')
+
+    def test_deleted_vehicles_keep_their_registration(self):
+        self.vehicle.is_deleted = True
+        self.vehicle.save()
+        self.assertTrue(reg_number_in_use('AB 12 CDE'))
+
+
+class SiteStockTest(TestCase):
+
+    def setUp(self):
+        self.main = Site.objects.create(name='Main')
+        self.branch = Site.objects.create(name='Branch')
+        self.part = make_part(quantity=5)
+        with transaction.atomic():
+            stock.open_stock(self.part, site=self.main)
+
+    def test_move_stock_changes_site_and_total_stock(self):
+        with transaction.atomic():
+            movement = stock.move_stock(self.part, -3, stock.SALE, site=self.main)
+        self.assertEqual(stock.site_quantity(self.part, self.main), 2)
+        self.assertEqual(Part.objects.get(id=self.part.id).quantity, 2)
+        self.assertEqual(movement.balance, 2)
+
+    def test_taking_more_than_the_site_holds_raises_and_changes_nothing(self):
+        with self.assertRaises(stock.InsufficientStock) as raised:
+            with transaction.atomic():
+                stock.move_stock(self.part, -6, stock.SALE, site=self.main)
+        self.assertEqual(raised.exception.available, 5)
+        self.assertIn('Main', str(raised.exception))
+        self.assertEqual(stock.site_quantity(self.part, self.main), 5)
+        self.assertEqual(Part.objects.get(id=self.part.id).quantity, 5)
+        self.assertFalse(StockMovement.objects.filter(kind=stock.SALE).exists())
+
+    def test_a_site_without_stock_of_the_part_cannot_supply_it(self):
+        with self.assertRaises(stock.InsufficientStock):
+            with transaction.atomic():
+                stock.move_stock(self.part, -1, stock.JOB, site=self.branch)
+        self.assertFalse(PartStock.objects.filter(part=self.part, site=self.branch).exists())
+
+    def test_transfer_moves_stock_between_sites_leaving_the_total(self):
+        transfer = StockTransfer.objects.create(from_site=self.main, to_site=self.branch)
+        with transaction.atomic():
+            stock.transfer_stock(transfer, self.part, 4)
+        self.assertEqual(stock.site_quantity(self.part, self.main), 1)
+        self.assertEqual(stock.site_quantity(self.part, self.branch), 4)
+        self.assertEqual(Part.objects.get(id=self.part.id).quantity, 5)
+        with self.assertRaises(stock.InsufficientStock):
+            with transaction.atomic():
+                stock.transfer_stock(transfer, self.part, 2)
+
+    def test_set_stock_records_the_difference_as_an_adjustment(self):
+        with transaction.atomic():
+            movement = stock.set_stock(self.part, 8, site=self.main)
+        self.assertEqual(movement.kind, stock.ADJUSTMENT)
+        self.assertEqual(movement.quantity, 3)
+        self.assertEqual(stock.site_quantity(self.part, self.main), 8)
+
+
+class PartPricingTest(TestCase):
+
+    def setUp(self):
+        PriceControl.objects.create(vat=20, marked_up=10)
+        self.booked = timezone.now() - datetime.timedelta(days=10)
+        self.job = make_job(make_vehicle(make_customer()), booking_date=self.booked)
+        self.filter = make_part('F1', price=12.0)
+        self.pad = make_part('P1', price=20.0)
+        # the filter cost 8 when the job was booked, and was repriced since
+        PartPrice.objects.create(part=self.filter, price=8.0, effective_from=self.booked - datetime.timedelta(days=1))
+        PartPrice.objects.create(part=self.filter, price=12.0, effective_from=self.booked + datetime.timedelta(days=1))
+        JobPart.objects.create(job=self.job, part=self.filter, quantity=2)
+        JobPart.objects.create(job=self.job, part=self.pad, quantity=1)
+
+    def test_prices_on_falls_back_on_the_current_price(self):
+        prices = pricing.prices_on(self.booked, [self.filter.id, self.pad.id])
+        self.assertEqual(prices, {self.filter.id: 8.0, self.pad.id: 20.0})
+
+    def test_a_back_dated_price_is_used_only_from_when_it_took_effect(self):
+        # two prices taking effect at once, the later one entered counting, then a correction back-dated
+        # before both, entered last
+        late = PartPrice.objects.create(part=self.filter, price=10.0,
+                                        effective_from=self.booked - datetime.timedelta(hours=1))
+        PartPrice.objects.create(part=self.filter, price=11.0, effective_from=late.effective_from)
+        PartPrice.objects.create(part=self.filter, price=9.0, effective_from=self.booked - datetime.timedelta(days=5))
+        part = Part.objects.get(id=self.filter.id)
+        self.assertEqual(pricing.prices_on(self.booked, [part.id]), {part.id: 11.0})
+        self.assertEqual(part.price_on(self.booked), 11.0)
+        self.assertEqual(pricing.marked_up(pricing.prices_on(self.booked, [part.id]))[part.id],
+                         part.get_markedup_price(self.booked))
+        histories = pricing.price_histories([part.id], self.booked)
+        self.assertEqual(pricing.price_from_history(histories, part.id, self.booked, part.price), 11.0)
+
+    def test_job_parts_are_priced_as_they_were_when_it_was_booked(self):
+        job = Job.objects.get(id=self.job.id)
+        self.assertEqual(job.get_parts_price(), 36.0)
+        costs = dict((job_part.part_id, job_part.get_cost()) for job_part in job.jobpart_set.all())
+        self.assertEqual(costs, {self.filter.id: 17.6, self.pad.id: 22.0})
+
+    # returns the number of queries run to price every part of the job, loaded afresh
+    def pricing_queries(self):
+        job = Job.objects.get(id=self.job.id)
+        with CaptureQueriesContext(connection) as queries:
+            job.get_parts_price()
+            for job_part in job.jobpart_set.all():
+                job_part.get_cost()
+        return len(queries)
+
+    def test_pricing_a_job_runs_the_same_queries_however_many_parts_it_has(self):
+        before = self.pricing_queries()
+        for code in ['A1', 'A2', 'A3']:
+            JobPart.objects.create(job=self.job, part=make_part(code), quantity=1)
+        self.assertEqual(self.pricing_queries(), before)
+
+    def test_reprice_records_the_new_prices_in_the_history(self):
+        PartPrice.objects.create(part=self.pad, price=20.0, effective_from=self.booked - datetime.timedelta(days=30))
+        repriced = pricing.reprice(Part.objects.filter(id=self.pad.id), pricing.PERCENTAGE, 10)
+        self.assertEqual(repriced, 1)
+        self.assertEqual(Part.objects.get(id=self.pad.id).price, 22.0)
+        latest = PartPrice.objects.filter(part=self.pad).latest('id')
+        self.assertEqual(latest.price, 22.0)
+        self.assertEqual(pricing.prices_on(self.booked, [self.pad.id]), {self.pad.id: 20.0})
+
+
+class ForecastTest(TestCase):
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(company_name='Parts Ltd')
+        self.part = make_part('F1', quantity=1)
+        self.never_delivered = make_part('F2', quantity=0)
+        delivery = PartOrder.objects.create(supplier=self.supplier, date=timezone.now() - datetime.timedelta(days=3))
+        OrderPartRelationship.objects.create(order=delivery, part=self.part, quantity=4)
+
+    def test_parts_at_their_reorder_point_are_ordered_up_to_their_target(self):
+        usage = np.array([[2.0] * 10, [0.0] * 10])
+        result = forecasting.Forecast([1, 2], np.array([5.0, 0.0]), np.array([0.0, 0.0]), usage)
+        # two a day, without variation: reorder at a week's use, order up to three weeks' use
+        self.assertEqual(result.reorder_points(), {1: 14})
+        self.assertEqual(result.orders(), {1: 37})
+
+    def test_stock_on_order_counts_towards_the_reorder_point(self):
+        usage = np.array([[2.0] * 10])
+        result = forecasting.Forecast([1], np.array([5.0]), np.array([20.0]), usage)
+        self.assertEqual(result.orders(), {})
+
+    def test_draft_orders_go_to_the_last_supplier_of_each_part(self):
+        orders, unorderable = forecasting.create_draft_orders({self.part.id: 6, self.never_delivered.id: 3})
+        self.assertEqual(unorderable, [self.never_delivered.id])
+        self.assertEqual(len(orders), 1)
+        self.assertTrue(orders[0].is_draft)
+        self.assertEqual(orders[0].supplier_id, self.supplier.id)
+        self.assertEqual(forecasting.draft_quantities(), {self.part.id: 6})
+
+    def test_draft_orders_are_not_counted_as_delivered(self):
+        start = timezone.now() - datetime.timedelta(days=7)
+        forecasting.create_draft_orders({self.part.id: 6})
+        self.assertEqual(self.part.delivered_parts(start, timezone.now()), 4)
+
+
+class ActiveContactsTest(TestCase):
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(company_name='Parts Ltd')
+        self.customer = make_customer()
+        for number, owner in [('0111111111', self.supplier), ('0222222222', self.customer)]:
+            owner.emails.add(EmailModel.objects.create(address='live@example.com'),
+                             EmailModel.objects.create(address='gone@example.com', is_deleted=True))
+            owner.phone_numbers.add(PhoneModel.objects.create(phone_number=number))
+
+    def test_deleted_contacts_are_left_out(self):
+        for owner in [self.supplier, self.customer]:
+            self.assertEqual([email.address for email in owner.active_email_list()], ['live@example.com'])
+            self.assertEqual(len(owner.active_phone_list()), 1)
+
+    def test_contacts_loaded_by_with_contacts_are_listed_without_a_query(self):
+        suppliers = list(with_contacts(Supplier.objects.all()))
+        customers = list(with_contacts(Customer.objects.all()))
+        with self.assertNumQueries(0):
+            self.assertEqual(suppliers[0].get_emails(), 'live@example.com')
+            self.assertEqual(customers[0].list_emails(), 'live@example.com')
+            self.assertEqual(len(customers[0].active_phone_list()), 1)
+
+
+class PurgeAbandonedCustomersTest(TestCase):
+
+    def setUp(self):
+        self.empty = make_customer(forename='', surname='')
+        self.with_job = make_customer(forename='', surname='')
+        self.job = make_job(make_vehicle(self.with_job))
+        self.named = make_customer()
+        self.later = timezone.now() + datetime.timedelta(hours=1)
+
+    def test_customers_with_nothing_attached_are_deleted(self):
+        self.assertEqual(purge_abandoned_customers(before=self.later), 2)
+        self.assertFalse(Customer.all_objects.filter(id=self.empty.id).exists())
+        self.assertTrue(Customer.objects.filter(id=self.named.id).exists())
+
+    def test_customers_with_vehicles_are_soft_deleted_keeping_their_jobs(self):
+        purge_abandoned_customers(before=self.later)
+        self.assertTrue(Customer.all_objects.get(id=self.with_job.id).is_deleted)
+        self.assertTrue(Vehicle.all_objects.get(id=self.job.vehicle_id).is_deleted)
+        self.assertTrue(Job.all_objects.filter(id=self.job.id).exists())
+
+    def test_recent_customers_and_dry_runs_are_left_alone(self):
+        self.assertEqual(purge_abandoned_customers(before=self.later, dry_run=True), 2)
+        self.assertEqual(purge_abandoned_customers(), 0)
+        self.assertEqual(Customer.objects.count(), 3)
+
+
+class SearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.customer = make_customer(forename='Ada', surname='Lovelace')
+        self.vehicle = make_vehicle(self.customer, 'LV51 ADA')
+        self.email = EmailModel.objects.create(address='ada@engine.org')
+        self.customer.emails.add(self.email)
+
+    # returns the labels of the documents found by a search
+    def labels(self, query):
+        return [result['label'] for result in search.search(query)]
+
+    def test_saved_rows_are_searchable_by_prefix(self):
+        self.assertEqual(self.labels('lovel'), ['Ada Lovelace', 'LV51 ADA - Ford Focus'])
+        self.assertEqual(self.labels('lv51ada'), ['LV51 ADA - Ford Focus'])
+
+    def test_soft_deleted_rows_leave_the_index(self):
+        self.vehicle.is_deleted = True
+        self.vehicle.save()
+        self.assertEqual(self.labels('lv51'), [])
+
+    def test_soft_deleting_a_contact_refreshes_its_customers(self):
+        self.assertEqual(self.labels('engine'), ['Ada Lovelace'])
+        self.email.is_deleted = True
+        self.email.save()
+        self.assertEqual(self.labels('engine'), [])
+
+    def test_restoring_a_contact_refreshes_its_customers(self):
+        EmailModel.all_objects.filter(id=self.email.id).update(is_deleted=True)
+        search.index_documents('customer', [self.customer.id])
+        self.assertEqual(self.labels('engine'), [])
+        upsert_contacts(EmailModel, 'address', {'ada@engine.org': '1'})
+        self.assertEqual(self.labels('engine'), ['Ada Lovelace'])
+
+    def test_rebuild_indexes_rows_saved_without_signals(self):
+        Vehicle.objects.filter(id=self.vehicle.id).update(make='Bentley')
+        self.assertEqual(self.labels('bentley'), [])
+        search.rebuild_index()
+        self.assertEqual(self.labels('bentley'), ['LV51 ADA - Bentley Focus'])
+
+
+class JobCountsTest(TestCase):
+
+    def setUp(self):
+        self.first = make_customer()
+        self.second = make_customer(forename='John')
+        self.vehicle = make_vehicle(self.first, 'AB12 CDE')
+        self.other_vehicle = make_vehicle(self.second, 'XY34 ZZZ')
+        self.job = make_job(self.vehicle, type='1')
+
+    # returns the stored counts of MoT and repair jobs of a customer
+    def counts(self, customer):
+        customer = Customer.objects.get(id=customer.id)
+        return customer.mot_jobs, customer.repair_jobs
+
+    def test_counts_follow_jobs_as_they_are_saved_and_deleted(self):
+        make_job(self.vehicle, job_number=2, type='2', bay=self.job.bay)
+        self.assertEqual(self.counts(self.first), (1, 1))
+        self.job.is_deleted = True
+        self.job.save()
+        self.assertEqual(self.counts(self.first), (0, 1))
+
+    def test_moving_a_vehicle_refreshes_both_customers(self):
+        self.vehicle.customer = self.second
+        self.vehicle.save()
+        self.assertEqual(self.counts(self.first), (0, 0))
+        self.assertEqual(self.counts(self.second), (1, 0))
+
+    def test_moving_a_job_refreshes_both_customers(self):
+        self.job.vehicle = self.other_vehicle
+        self.job.save()
+        self.assertEqual(self.counts(self.first), (0, 0))
+        self.assertEqual(self.counts(self.second), (1, 0))
+
+    def test_recount_catches_up_with_queryset_updates(self):
+        Job.objects.filter(id=self.job.id).update(vehicle=self.other_vehicle)
+        self.assertEqual(self.counts(self.second), (0, 0))
+        recount_jobs()
+        self.assertEqual(self.counts(self.first), (0, 0))
+        self.assertEqual(self.counts(self.second), (1, 0))
+
+
+class BaySchedulingTest(TestCase):
+
+    def setUp(self):
+        tomorrow = timezone.localtime(timezone.now()).date() + datetime.timedelta(days=1)
+        self.nine = scheduling.booking_start(tomorrow, datetime.time(9))
+        self.bay = Bay.objects.create(bay_type='2', total_spots=1, free_spots=1)
+        self.job = make_job(make_vehicle(make_customer()), booking_date=self.nine, bay=self.bay)
+        task = Task.objects.create(task_number=1, description='Service', estimated_time=datetime.timedelta(hours=2))
+        JobTask.objects.create(job=self.job, task=task)
+
+    def test_timeline_counts_overlapping_bookings(self):
+        hour = datetime.timedelta(hours=1)
+        timeline = scheduling.BayTimeline(self.bay, [(self.nine, self.nine + 2 * hour),
+                                                     (self.nine + hour, self.nine + 3 * hour)])
+        self.assertEqual(timeline.max_occupancy(self.nine, self.nine + hour), 1)
+        self.assertEqual(timeline.max_occupancy(self.nine, self.nine + 3 * hour), 2)
+        self.assertEqual(timeline.max_occupancy(self.nine + 3 * hour, self.nine + 4 * hour), 0)
+
+    def test_a_full_bay_is_unavailable_for_the_length_of_its_bookings(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertFalse(scheduling.bay_available(self.bay, self.nine + hour, hour))
+        self.assertTrue(scheduling.bay_available(self.bay, self.nine + 2 * hour, hour))
+        self.assertTrue(scheduling.bay_available(self.bay, self.nine + hour, hour, exclude_job=self.job))
+
+    def test_the_first_free_slot_follows_the_bookings_already_made(self):
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(scheduling.first_free_slot('2', self.nine, hour), (self.bay, self.nine + 2 * hour))
+        self.assertIsNone(scheduling.first_free_slot('1', self.nine, hour))
+
+    def test_slots_are_kept_within_opening_hours(self):
+        late = self.nine.replace(hour=17, minute=30)
+        self.assertEqual(scheduling.within_opening_hours(late, datetime.timedelta(hours=1)),
+                         self.nine.replace(hour=8) + datetime.timedelta(days=1))
+
+
+class AssignmentTest(TestCase):
+
+    def setUp(self):
+        self.busy = Mechanic.objects.create(user=User.objects.create(username='busy', first_name='Bob'),
+                                            role='1', hourly_pay=10)
+        self.idle = Mechanic.objects.create(user=User.objects.create(username='idle', first_name='Ian'),
+                                            role='1', hourly_pay=10)
+        vehicle = make_vehicle(make_customer())
+        self.taken = self.job_of(vehicle, 1, 2, mechanic=self.busy)
+        self.long = self.job_of(vehicle, 2, 3)
+        self.short = self.job_of(vehicle, 3, 1)
+
+    # creates a job of the given vehicle with a single task estimated at the given hours
+    def job_of(self, vehicle, job_number, hours, **kwargs):
+        job = make_job(vehicle, job_number=job_number, **kwargs)
+        task = Task.objects.create(task_number=job_number, description='Task %d' % job_number,
+                                   estimated_time=datetime.timedelta(hours=hours))
+        JobTask.objects.create(job=job, task=task)
+        return job
+
+    def test_jobs_are_proposed_so_the_loads_stay_even(self):
+        proposed = dict((a.job.id, a.mechanic) for a in assignment.propose_assignments())
+        self.assertEqual(proposed, {self.long.id: self.idle, self.short.id: self.busy})
+
+    def test_applying_leaves_jobs_taken_since_alone_and_logs_the_rest(self):
+        proposed = assignment.propose_assignments()
+        Job.objects.filter(id=self.long.id).update(mechanic=self.busy)
+        self.assertEqual(assignment.apply_assignments(proposed), 1)
+        self.assertEqual(Job.objects.get(id=self.long.id).mechanic, self.busy)
+        self.assertEqual(Job.objects.get(id=self.short.id).mechanic, self.busy)
+        logged = JobEvent.objects.get(job=self.short)
+        self.assertEqual(logged.kind, '3')
+        self.assertEqual(events.decode_changes(logged.payload), {'mechanic': [None, self.busy.id]})
+
+
+class JobEventTest(TestCase):
+
+    def setUp(self):
+        self.job = make_job(make_vehicle(make_customer()))
+
+    def test_only_changed_fields_are_recorded(self):
+        created = events.record_job_event(self.job)
+        self.assertEqual(created.kind, '1')
+        before = events.job_snapshot(self.job)
+        self.assertIsNone(events.record_job_event(self.job, before))
+        self.job.status = '2'
+        self.job.save()
+        edited = events.record_job_event(self.job, before)
+        self.assertEqual(edited.kind, '2')
+        self.assertEqual(events.decode_changes(edited.payload), {'status': ['3', '2']})
+
+    def test_time_in_status_is_worked_out_from_the_events(self):
+        start = timezone.now() - datetime.timedelta(hours=10)
+        JobEvent.objects.create(job=self.job, created=start, kind='1', status='3', payload=b'')
+        JobEvent.objects.create(job=self.job, created=start + datetime.timedelta(hours=2), kind='3', status='2',
+                                payload=b'')
+        JobEvent.objects.create(job=self.job, created=start + datetime.timedelta(hours=5), kind='2', status='1',
+                                payload=b'')
+        times = events.time_in_status(start, start + datetime.timedelta(hours=8))
+        self.assertEqual(times[self.job.id], {'3': datetime.timedelta(hours=2), '2': datetime.timedelta(hours=3),
+                                              '1': datetime.timedelta(hours=3)})
+        self.assertEqual(events.waiting_times(start, start + datetime.timedelta(hours=1)),
+                         {self.job.id: datetime.timedelta(hours=2)})
+
+
+class CachedChoicesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.bay = Bay.objects.create(bay_type='1', total_spots=1, free_spots=1)
+
+    def test_choices_are_loaded_once_and_reloaded_after_a_write(self):
+        field = CachedModelChoiceField(Bay.objects.all(), name='bays')
+        self.assertEqual(list(field.choices), [('', field.empty_label), (self.bay.pk, 'MOT Bay')])
+        with CaptureQueriesContext(connection) as queries:
+            list(CachedModelChoiceField(Bay.objects.all(), name='bays').choices)
+        self.assertEqual(len(queries), 0)
+        other = Bay.objects.create(bay_type='2', total_spots=1, free_spots=1)
+        self.assertIn((other.pk, 'Repair Bay'), list(field.choices))
+
+    def test_writes_handled_by_another_worker_reach_the_choices(self):
+        field = CachedModelChoiceField(Bay.objects.all(), name='bays')
+        list(field.choices)
+        # another worker renames the bay, moving the shared version on but not this worker's own cache
+        Bay.objects.filter(id=self.bay.id).update(bay_type='2')
+        caches['shared'].incr(version_key(Bay))
+        self.assertIn((self.bay.pk, 'MOT Bay'), list(field.choices))
+        # until this worker checks the shared version again
+        cache.delete(version_key(Bay))
+        self.assertIn((self.bay.pk, 'Repair Bay'), list(field.choices))
+
+    def test_submitted_values_are_checked_against_the_database(self):
+        field = CachedModelChoiceField(Bay.objects.all(), name='bays')
+        list(field.choices)
+        # a queryset update skips the signals, so the cached choices still offer the bay
+        Bay.objects.filter(id=self.bay.id).update(is_deleted=True)
+        self.assertIn((self.bay.pk, 'MOT Bay'), list(field.choices))
+        with self.assertRaises(ValidationError):
+            field.clean(self.bay.pk)
+
+
+class PartPickerTest(TestCase):
+
+    def setUp(self):
+        self.pads = make_part('BP1', name='Brake Pad')
+        self.disc = make_part('BD1', name='Brake Disc')
+        self.filter = make_part('OF1', name='Oil Filter')
+
+    # returns the ids of the parts the picker offers for the given term
+    def search(self, term):
+        response = self.client.get(reverse('get-parts-autocomplete'), {'term': term},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        return [part['id'] for part in json.loads(response.content.decode('utf-8'))]
+
+    def test_parts_are_matched_by_code_or_name_prefix(self):
+        self.assertEqual(self.search('b'), [self.disc.id, self.pads.id])
+        self.assertEqual(self.search('OIL f'), [self.filter.id])
+        self.assertEqual(self.search('filter'), [])
+        self.filter.is_deleted = True
+        self.filter.save()
+        self.assertEqual(self.search('of'), [])
+
+    def test_the_form_submits_the_part_by_key(self):
+        form = JobPartForm({'part': self.pads.pk, 'quantity': 2})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['part'], self.pads)
+        self.assertIn('value="Brake Pad"', str(form['part']))
+        Part.objects.filter(id=self.pads.id).update(is_deleted=True)
+        self.assertFalse(JobPartForm({'part': self.pads.pk, 'quantity': 2}).is_valid())
+
+
+class StockLedgerTest(TestCase):
+
+    def setUp(self):
+        self.part = make_part(quantity=5)
+        self.start = timezone.now() - datetime.timedelta(days=10)
+        with transaction.atomic():
+            self.moved(stock.open_stock(self.part), days=0)
+            self.moved(stock.move_stock(self.part, 4, stock.DELIVERY), days=2)
+            self.moved(stock.move_stock(self.part, -3, stock.SALE), days=4)
+            self.moved(stock.move_stock(self.part, -1, stock.JOB), days=6)
+
+    # dates a recorded movement the given number of days after the start
+    def moved(self, movement, days):
+        StockMovement.objects.filter(id=movement.id).update(date=self.start + datetime.timedelta(days=days))
+
+    def test_balances_are_read_from_the_last_movement_before_a_moment(self):
+        self.assertEqual(stock.balances_at(self.start + datetime.timedelta(days=3)), {self.part.id: 9})
+        self.assertEqual(stock.balances_at(), {self.part.id: 5})
+        self.assertEqual(stock.balances_at(self.start), {})
+
+    def test_a_period_sums_the_movements_of_each_kind(self):
+        period = stock.stock_period(self.start + datetime.timedelta(days=1), self.start + datetime.timedelta(days=5))
+        self.assertEqual(period[self.part.id], {'opening': 5, 'delivered': 4, 'used': 0, 'sold': -3,
+                                                'adjusted': 0, 'closing': 6})
+
+    def test_stock_changed_outside_the_ledger_shows_as_drift(self):
+        self.assertEqual(stock.stock_drift(), [])
+        Part.objects.filter(id=self.part.id).update(quantity=7)
+        self.assertEqual([(part.id, quantity, balance) for part, quantity, balance in stock.stock_drift()],
+                         [(self.part.id, 7, 5)])
+
+
+class PartImportTest(TestCase):
+
+    CATALOGUE = [
+        'Code,Name,Manufacturer,Vehicle Type,Years,Price,Quantity',
+        'P1,Brake Pad,Acme,Ford Focus,2010-2015,12.5,40',
+        'N1,Wiper Blade,Acme,Ford Focus,2010-2015,4,6',
+        'N2,,Acme,Ford Focus,2010-2015,4,6',
+        'N3,Bulb,Acme,Ford Focus,2010-2015,cheap,6',
+    ]
+
+    def setUp(self):
+        self.part = make_part('P1', quantity=3)
+
+    def test_parts_are_upserted_on_code(self):
+        result = import_parts(self.CATALOGUE)
+        self.assertEqual((result.created, result.updated, result.unchanged, result.rejected), (1, 1, 0, 2))
+        self.assertEqual(sorted(line for line, message in result.rejects), [4, 5])
+
+        part = Part.objects.get(id=self.part.id)
+        self.assertEqual(part.price, 12.5)
+        # the stock of existing parts is left to the ledger
+        self.assertEqual(part.quantity, 3)
+        self.assertTrue(PartPrice.objects.filter(part=part, price=12.5).exists())
+
+        new = Part.objects.get(code='N1')
+        self.assertEqual((new.name_key, new.quantity, new.low_level_threshold), ('wiper blade', 6, 10))
+        self.assertEqual(stock.site_quantity(new, stock.default_site()), 6)
+        self.assertEqual(StockMovement.objects.get(part=new).kind, stock.OPENING_BALANCE)
+
+        again = import_parts(self.CATALOGUE)
+        self.assertEqual((again.created, again.updated, again.unchanged), (0, 0, 2))
+
+    def test_a_dry_run_saves_nothing(self):
+        result = import_parts(self.CATALOGUE, dry_run=True)
+        self.assertEqual(result.created, 1)
+        self.assertFalse(Part.objects.filter(code='N1').exists())
+        self.assertEqual(Part.objects.get(id=self.part.id).price, 10.0)
+
+
+class SparePartsReportTest(TestCase):
+
+    def setUp(self):
+        self.part = make_part('P1', quantity=5, price=10.0)
+        self.untouched = make_part('P2', quantity=2, price=3.0)
+        recently = timezone.now() - datetime.timedelta(days=2)
+        supplier = Supplier.objects.create(company_name='Parts Ltd')
+        OrderPartRelationship.objects.create(order=PartOrder.objects.create(supplier=supplier, date=recently),
+                                             part=self.part, quantity=4)
+        OrderPartRelationship.objects.create(order=PartOrder.objects.create(supplier=supplier, date=recently,
+                                                                            is_draft=True),
+                                             part=self.part, quantity=6)
+        job = make_job(make_vehicle(make_customer()), booking_date=recently)
+        JobPart.objects.create(job=job, part=self.part, quantity=1)
+        SellPart.objects.create(order=CustomerPartsOrder.objects.create(date=recently), part=self.part, quantity=2)
+
+    def test_the_report_rows_work_back_to_the_stock_at_the_start(self):
+        today = timezone.now().date()
+        report = create_spare_parts_report(today - datetime.timedelta(days=7), today, timezone.now())
+        rows = dict((row.part_id, row) for row in report.sparepart_set.all())
+        row = rows[self.part.id]
+        self.assertEqual((row.initial_stock_level, row.delivery, row.used, row.new_stock_level), (4, 4, 3, 5))
+        self.assertEqual((row.initial_price, row.unit_price), (10.0, 10.0))
+        self.assertEqual(rows[self.untouched.id].initial_stock_level, 2)
+        self.assertEqual((report.total_initial_cost, report.total_stock_cost), (46.0, 56.0))
+
+
+class PartOrderTotalTest(TestCase):
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(company_name='Parts Ltd')
+        self.order = PartOrder.objects.create(supplier=self.supplier)
+        OrderPartRelationship.objects.create(order=self.order, part=make_part('P1', price=2.5), quantity=4)
+        OrderPartRelationship.objects.create(order=self.order, part=make_part('P2', price=1.25), quantity=3)
+
+    def test_the_value_of_an_order_counts_every_unit_ordered(self):
+        self.order.update_total_price()
+        self.assertEqual(PartOrder.objects.get(id=self.order.id).get_total_price(), 13.75)
+
+    def test_suppliers_are_annotated_with_the_value_of_their_placed_orders(self):
+        self.order.update_total_price()
+        draft = PartOrder.objects.create(supplier=self.supplier, is_draft=True)
+        OrderPartRelationship.objects.create(order=draft, part=make_part('P3', price=100.0), quantity=1)
+        draft.update_total_price()
+        self.assertEqual(pricing.with_spend(Supplier.objects.filter(id=self.supplier.id)).get().spend, 13.75)
+
+
+class PartFitmentTest(TestCase):
+
+    def test_vehicle_types_and_years_are_parsed_into_fitment(self):
+        self.assertEqual(fitment.parse_fitment('Ford Focus/Fiesta, Vauxhall Astra', '05-11'),
+                         [('ford', 'focus', 2005, 2011), ('ford', 'fiesta', 2005, 2011),
+                          ('vauxhall', 'astra', 2005, 2011)])
+        self.assertEqual(fitment.parse_years('2012-'), (2012, None))
+        self.assertEqual(fitment.parse_years('any'), (None, None))
+        self.assertEqual(fitment.registration_year('AB62 CDE'), 2012)
+        self.assertIsNone(fitment.registration_year('A123 BCD'))
+
+    def test_parts_are_matched_to_vehicles_by_make_model_and_year(self):
+        focus = make_part('P1', vehicle_type='Ford Focus', years='2010-2015')
+        any_ford = make_part('P2', vehicle_type='Ford', years='')
+        old_focus = make_part('P3', vehicle_type='Ford Focus', years='2001-2005')
+        make_part('P4', vehicle_type='Vauxhall Astra', years='2010-2015')
+        vehicle = make_vehicle(make_customer(), reg_number='AB12 CDE', model='Focus ST')
+        self.assertEqual(set(fitment.compatible_parts(vehicle)), {focus, any_ford})
+        # the fitment follows the part as it's edited
+        old_focus.years = '2010-'
+        old_focus.save()
+        self.assertIn(old_focus, fitment.compatible_parts(vehicle))
+
+
+class CustomerDraftTest(TestCase):
+
+    def setUp(self):
+        self.session = {}
+        make_vehicle(make_customer(), reg_number='AB12 CDE')
+
+    # stages a vehicle under the given registration number against the given draft
+    def stage(self, key, reg_number):
+        return stage_vehicle(self.session, key, {'reg_number': reg_number, 'make': 'Ford', 'model': 'Fiesta',
+                                                 'engine_serial': 'E2', 'chassis_number': 'C2', 'color': 'Red',
+                                                 'mot_base_date': datetime.date(2015, 3, 1), 'type': '2'})
+
+    def test_registrations_are_taken_by_saved_and_staged_vehicles(self):
+        self.assertTrue(reg_number_taken(self.session, 'draft', 'ab12cde'))
+        self.assertFalse(reg_number_taken(self.session, 'draft', 'XY34 ZZZ'))
+        self.stage('draft', 'XY34 ZZZ')
+        self.assertTrue(reg_number_taken(self.session, 'draft', 'xy34zzz'))
+        self.assertFalse(reg_number_taken(self.session, 'other', 'xy34zzz'))
+
+    def test_the_oldest_drafts_are_dropped_from_the_session(self):
+        for i in range(12):
+            self.stage('draft%d' % i, 'XY%02d ZZZ' % i)
+        self.assertEqual(draft_vehicles(self.session, 'draft0'), [])
+        self.assertEqual(len(draft_vehicles(self.session, 'draft11')), 1)
+        self.assertEqual(len(self.session['customer_drafts']), 10)
+
+    def test_nothing_is_written_until_the_customer_is_saved(self):
+        customers = Customer.all_objects.count()
+        staged = self.stage('draft', 'XY34 ZZZ')
+        self.assertEqual(Customer.all_objects.count(), customers)
+
+        emails, phones = contact_formsets([('Jo@Example.com', '1')], [('01234 567890', '2')])
+        with transaction.atomic():
+            customer = save_draft(self.session, 'draft', Dropin(forename='Jo', surname='Bloggs'), emails, phones)
+        vehicle = Vehicle.objects.get(customer=customer)
+        self.assertEqual((vehicle.uuid, vehicle.reg_key, vehicle.mot_base_date),
+                         (staged['uuid'], 'XY34ZZZ', datetime.date(2015, 3, 1)))
+        self.assertEqual(list(customer.emails.values_list('address', flat=True)), ['jo@example.com'])
+        self.assertEqual(list(customer.phone_numbers.values_list('phone_number', flat=True)), ['01234567890'])
+        self.assertNotIn('draft', self.session['customer_drafts'])
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.parts = [make_part('P%d' % i, price=price) for i, price in enumerate([5, 3, 5, 8, 1, 3, 5])]
+
+    # returns the table of every part, paged by keyset for the given query string
+    def page(self, **params):
+        table = PartTable(Part.objects.filter(is_deleted=False))
+        paginate_keyset(RequestFactory().get('/garits/parts/', params), table, per_page=3)
+        return table
+
+    def test_following_the_cursors_visits_every_row_once_in_order(self):
+        seen = []
+        params = {'sort': '-price'}
+        while True:
+            table = self.page(**params)
+            seen.extend(row.record.id for row in table.page.object_list)
+            if not table.page.has_next:
+                break
+            params[table.page.cursor_field] = table.page.next_cursor
+        expected = [part.id for part in sorted(self.parts, key=lambda part: (-part.price, -part.id))]
+        self.assertEqual(seen, expected)
+
+    def test_a_cursor_of_another_ordering_starts_from_the_first_page(self):
+        cursor = self.page(sort='-price').page.next_cursor
+        table = self.page(sort='code', after=cursor)
+        self.assertFalse(table.page.has_previous)
+        self.assertEqual([row.record.code for row in table.page.object_list], ['P0', 'P1', 'P2'])
+
+
+class ExportTest(TestCase):
+
+    def setUp(self):
+        self.customer = make_customer()
+        self.customer.emails.add(EmailModel.objects.create(address='jane@example.com'))
+        self.customer.phone_numbers.add(PhoneModel.objects.create(phone_number='01234567890'))
+        booked = timezone.now() - datetime.timedelta(days=10)
+        mechanic = Mechanic.objects.create(user=User.objects.create(username='mech'), role='1', hourly_pay=20)
+        self.job = make_job(make_vehicle(self.customer), booking_date=booked, mechanic=mechanic)
+        task = Task.objects.create(task_number=1, description='Service', estimated_time=datetime.timedelta(hours=1))
+        JobTask.objects.create(job=self.job, task=task, duration=datetime.timedelta(hours=1, minutes=30))
+        part = make_part('F1', price=12.0)
+        PartPrice.objects.create(part=part, price=8.0, effective_from=booked - datetime.timedelta(days=1))
+        JobPart.objects.create(job=self.job, part=part, quantity=2)
+        make_part('F2', is_deleted=True)
+
+    def test_csv_exports_start_with_a_header(self):
+        rows = list(csv.reader(export_lines('customers')))
+        self.assertEqual(rows[0][:4], ['uuid', 'kind', 'forename', 'surname'])
+        self.assertEqual(len(rows), 2)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual((row['uuid'], row['kind'], row['emails'], row['phones']),
+                         (self.customer.uuid, 'Drop In', 'jane@example.com', '01234567890'))
+        self.assertEqual([row[1] for row in csv.reader(export_lines('parts'))], ['code', 'F1'])
+
+    def test_jobs_are_priced_as_they_were_when_booked(self):
+        row, = [json.loads(line) for line in export_lines('jobs', 'jsonl')]
+        self.assertEqual(row['uuid'], self.job.uuid)
+        self.assertEqual((row['hours'], row['labour_price'], row['parts_price'], row['price']), (1.5, 30.0, 16.0, 46.0))
+
+
+class DeduplicationTest(TestCase):
+
+    def setUp(self):
+        self.dropin = make_customer(forename='Jon', surname='Smith')
+        phone = PhoneModel.objects.create(phone_number='01234567890')
+        self.dropin.phone_numbers.add(phone)
+        self.dropin.emails.add(EmailModel.objects.create(address='jon@example.com'))
+        self.vehicle = make_vehicle(self.dropin)
+        make_job(self.vehicle, type='1')
+        self.account = AccountHolder.objects.create(forename='JOHN', surname='smith', postcode='AB1 2CD')
+        self.account.phone_numbers.add(phone)
+        self.namesake = AccountHolder.objects.create(forename='Jane', surname='Smith', postcode='ZZ9 9ZZ')
+        dedup.rebuild_blocking_keys()
+
+    def test_customers_sharing_enough_keys_are_paired(self):
+        duplicates = dedup.find_duplicates()
+        self.assertEqual(duplicates, [(0.8, self.dropin.id, self.account.id, [dedup.PHONE, dedup.NAME])])
+        self.assertEqual(dedup.survivor(self.dropin.id, self.account.id), (self.account.id, self.dropin.id))
+
+    def test_merging_moves_everything_onto_the_customer_kept(self):
+        self.assertEqual(dedup.merge_customers(self.account.id, self.dropin.id), 1)
+        self.assertEqual(Vehicle.objects.get(id=self.vehicle.id).customer_id, self.account.id)
+        self.assertEqual(list(self.account.emails.values_list('address', flat=True)), ['jon@example.com'])
+        self.assertEqual(Customer.objects.get(id=self.account.id).mot_jobs, 1)
+        self.assertFalse(Customer.objects.filter(id=self.dropin.id).exists())
+        self.assertEqual(dedup.find_duplicates(), [])
+
+
+class ContactUpsertTest(TestCase):
+
+    def test_contacts_are_reused_restored_and_retyped(self):
+        kept = EmailModel.objects.create(address='jane@example.com', type='1')
+        deleted = EmailModel.objects.create(address='old@example.com', type='1')
+        EmailModel.objects.filter(id=deleted.id).update(is_deleted=True)
+        contacts = upsert_contacts(EmailModel, 'address', {'jane@example.com': '2', 'old@example.com': '1',
+                                                           'new@example.com': '3'})
+        self.assertEqual([contact.address for contact in contacts],
+                         ['jane@example.com', 'old@example.com', 'new@example.com'])
+        self.assertEqual(contacts[0].id, kept.id)
+        self.assertEqual(contacts[1].id, deleted.id)
+        self.assertEqual(EmailModel.objects.get(id=kept.id).type, '2')
+        self.assertEqual(EmailModel.objects.count(), 3)
+
+    # returns the number of queries run to upsert the given number of new email addresses
+    def upsert_queries(self, count):
+        with CaptureQueriesContext(connection) as queries:
+            upsert_contacts(EmailModel, 'address', dict(('%d.%d@example.com' % (count, i), '1')
+                                                        for i in range(count)))
+        return len(queries)
+
+    def test_upserting_runs_the_same_queries_however_many_contacts_there_are(self):
+        self.assertEqual(self.upsert_queries(2), self.upsert_queries(20))
+
+    def test_syncing_replaces_the_contacts_of_a_customer(self):
+        customer = make_customer()
+        customer.emails.add(EmailModel.objects.create(address='gone@example.com'))
+        sync_contacts(customer, *contact_formsets([(' Jane@Example.com', '1')], [('(01234) 567-890', '1')]))
+        self.assertEqual(list(customer.emails.values_list('address', flat=True)), ['jane@example.com'])
+        self.assertEqual(list(customer.phone_numbers.values_list('phone_number', flat=True)), ['01234567890'])
+        with self.assertRaises(ValidationError) as raised:
+            validate_phone_numbers(['01234567890', '12345'])
+        self.assertIn('Invalid: 12345', raised.exception.messages[0])
+
+
+class StatementTest(TestCase):
+
+    def setUp(self):
+        PriceControl.objects.create(vat=20, marked_up=10)
+        self.month = timezone.now().date().replace(day=1)
+        discount = FixedDiscount.objects.create(discount=10)
+        self.holder = AccountHolder.objects.create(forename='Ada', surname='Lovelace', content_object=discount)
+        self.invoice = self.invoiced_job(self.holder, 1)
+        Payment.objects.create(invoice=self.invoice, amount=10, payment_type='1', date=self.month)
+        # drop ins pay as they go, so they get no statement
+        self.invoiced_job(make_customer(), 2)
+
+    # creates an invoice issued this month for an hour of work and a part on a vehicle of the given customer
+    def invoiced_job(self, customer, number):
+        mechanic = Mechanic.objects.create(user=User.objects.create(username='mech%d' % number), role='1',
+                                           hourly_pay=20)
+        job = make_job(make_vehicle(customer, reg_number='AB%d CDE' % number), job_number=number,
+                       booking_date=timezone.now(), mechanic=mechanic)
+        task = Task.objects.create(task_number=number, description='Service',
+                                   estimated_time=datetime.timedelta(hours=1))
+        JobTask.objects.create(job=job, task=task, duration=datetime.timedelta(hours=1))
+        JobPart.objects.create(job=job, part=make_part('P%d' % number, price=10.0), quantity=1)
+        return Invoice.objects.create(invoice_number=number, job_done=job, issue_date=self.month)
+
+    def test_statements_price_invoices_as_the_invoices_do(self):
+        context, = statement_contexts(self.month)
+        self.assertEqual(context['customer']['id'], self.holder.id)
+        self.assertEqual(context['invoiced'], Invoice.objects.get(id=self.invoice.id).get_price())
+        self.assertEqual((context['invoiced'], context['paid'], context['balance']), (32.4, 10.0, 22.4))
+        self.assertEqual([line['description'] for line in context['lines']], ['Invoice 1', 'Cash payment, invoice 1'])
+
+    def test_generating_a_month_again_replaces_its_statements(self):
+        self.assertEqual(generate_statements(self.month, workers=1), 1)
+        self.assertEqual(generate_statements(self.month, workers=1), 1)
+        statement = Statement.objects.get(customer=self.holder)
+        self.assertEqual((statement.month, statement.balance), (self.month, 22.4))
+        self.assertIn('Lovelace', statement.html)
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        customer = make_customer()
+        self.old = make_vehicle(customer, reg_number='OLD1')
+        self.in_use = make_vehicle(customer, reg_number='USED1')
+        make_job(self.in_use)
+        self.recent = make_vehicle(customer, reg_number='NEW1')
+        long_ago = timezone.now() - datetime.timedelta(days=400)
+        Vehicle.all_objects.filter(id__in=[self.old.id, self.in_use.id]).update(is_deleted=True, updated=long_ago)
+        Vehicle.all_objects.filter(id=self.recent.id).update(is_deleted=True)
+
+    def test_the_default_manager_leaves_deleted_rows_out(self):
+        self.assertFalse(Vehicle.objects.filter(id=self.old.id).exists())
+        self.assertTrue(Vehicle.all_objects.filter(id=self.old.id).exists())
+
+    def test_rows_deleted_long_enough_and_referred_to_by_nothing_are_archived(self):
+        self.assertEqual(archive_deleted(dry_run=True)['nod.vehicle'], 1)
+        self.assertTrue(Vehicle.all_objects.filter(id=self.old.id).exists())
+
+        self.assertEqual(archive_deleted()['nod.vehicle'], 1)
+        self.assertEqual(set(Vehicle.all_objects.values_list('id', flat=True)), {self.in_use.id, self.recent.id})
+        archived, = archived_rows(Vehicle)
+        self.assertEqual((archived.row_id, archived.row_uuid), (self.old.id, self.old.uuid))
+        self.assertEqual(json.loads(archived.data)['reg_number'], 'OLD1')
+
+    def test_live_rows_are_looked_up_through_partial_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("the partial indexes are checked through the sqlite schema")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'nod_vehicle_live_customer'")
+            sql, = cursor.fetchone()
+        self.assertIn('WHERE is_deleted = 0', sql)
+
+
+class EditJobStockTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('reception', password='secret')
+        StaffMember.objects.create(user=user, role='4')
+        self.client.force_login(user)
+        self.site = stock.default_site()
+        self.part = make_part('P1', quantity=10)
+        with transaction.atomic():
+            stock.open_stock(self.part, site=self.site)
+        self.task = Task.objects.create(task_number=1, description='Service',
+                                        estimated_time=datetime.timedelta(hours=1))
+        self.job = make_job(make_vehicle(make_customer()), booking_date=timezone.now() + datetime.timedelta(days=1))
+        JobTask.objects.create(job=self.job, task=self.task)
+
+    # submits the job sheet of the job unchanged but for the given quantity of the part, none removing it
+    def save_job(self, quantity):
+        booked = timezone.localtime(self.job.booking_date)
+        response = self.client.post(reverse('edit-job', args=[self.job.uuid]), {
+            'job_number': self.job.job_number, 'vehicle': self.job.vehicle.reg_number,
+            'booking_date': booked.strftime('%Y-%m-%d'), 'booking_time': booked.strftime('%H:%M'),
+            'type': self.job.type, 'bay': self.job.bay_id,
+            'fs1-TOTAL_FORMS': '1', 'fs1-INITIAL_FORMS': '0', 'fs1-0-task_name': self.task.id, 'fs1-0-status': '3',
+            'fs1-0-duration': '01:00:00',
+            'fs2-TOTAL_FORMS': '1', 'fs2-INITIAL_FORMS': '0',
+            'fs2-0-part': self.part.id if quantity else '', 'fs2-0-quantity': quantity or '',
+        })
+        self.assertEqual(response.status_code, 302)
+
+    # returns the quantities of the part moved for the job, in the order they were moved
+    def job_movements(self):
+        return list(StockMovement.objects.filter(job=self.job).order_by('id').values_list('quantity', flat=True))
+
+    def test_saving_an_unchanged_job_again_takes_no_more_stock(self):
+        self.save_job(3)
+        self.save_job(3)
+        self.assertEqual(self.job_movements(), [-3])
+        self.assertEqual(stock.site_quantity(self.part, self.site), 7)
+        self.assertEqual(JobPart.objects.get(job=self.job).quantity, 3)
+
+    def test_only_the_difference_is_moved_and_removed_parts_go_back(self):
+        self.save_job(3)
+        self.save_job(1)
+        self.assertEqual(stock.site_quantity(self.part, self.site), 9)
+        self.save_job(None)
+        self.assertEqual(self.job_movements(), [-3, 2, 1])
+        self.assertEqual(stock.site_quantity(self.part, self.site), 10)
+        self.assertEqual(Part.objects.get(id=self.part.id).quantity, 10)
+        self.assertFalse(JobPart.objects.filter(job=self.job).exists())
+
+    def test_a_short_part_holds_no_stock_until_there_is_enough(self):
+        self.save_job(3)
+        self.save_job(12)
+        self.assertFalse(JobPart.objects.get(job=self.job).sufficient_quantity)
+        self.assertEqual(stock.site_quantity(self.part, self.site), 10)
+        with transaction.atomic():
+            stock.move_stock(self.part, 5, stock.DELIVERY, site=self.site)
+        self.save_job(12)
+        self.assertTrue(JobPart.objects.get(job=self.job).sufficient_quantity)
+        self.assertEqual(stock.site_quantity(self.part, self.site), 3)
+
+
+class EditReplenishOrderTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('reception', password='secret')
+        StaffMember.objects.create(user=user, role='4')
+        self.client.force_login(user)
+        self.site = stock.default_site()
+        self.supplier = Supplier.objects.create(company_name='Parts Ltd')
+        self.order = PartOrder.objects.create(supplier=self.supplier)
+        self.pads = make_part('P1')
+        self.discs = make_part('P2')
+        with transaction.atomic():
+            for part, quantity in [(self.pads, 5), (self.discs, 4)]:
+                stock.open_stock(part, site=self.site)
+                OrderPartRelationship.objects.create(order=self.order, part=part, quantity=quantity)
+                stock.move_stock(part, quantity, stock.DELIVERY, site=self.site, part_order=self.order)
+
+    # submits the order with the given (part, quantity) lines
+    def save_order(self, *lines):
+        data = {'company_name': 'Parts Ltd', 'date': timezone.now().strftime('%Y-%m-%d'),
+                'fs2-TOTAL_FORMS': str(len(lines)), 'fs2-INITIAL_FORMS': '0'}
+        for i, (part, quantity) in enumerate(lines):
+            data['fs2-%d-part' % i] = part.id
+            data['fs2-%d-quantity' % i] = quantity
+        return self.client.post(reverse('edit-replenish-order', args=[self.order.uuid]), data)
+
+    def test_lines_taken_off_the_order_take_their_delivery_back_out_of_stock(self):
+        self.assertEqual(self.save_order((self.pads, 5)).status_code, 302)
+        self.assertEqual(list(self.order.orderpartrelationship_set.values_list('part_id', flat=True)),
+                         [self.pads.id])
+        self.assertEqual(stock.site_quantity(self.discs, self.site), 0)
+        self.assertEqual(StockMovement.objects.filter(part=self.discs, kind=stock.DELIVERY).latest('id').quantity, -4)
+        self.assertEqual(stock.site_quantity(self.pads, self.site), 5)
+
+    def test_lowering_a_line_below_the_stock_left_is_refused(self):
+        with transaction.atomic():
+            stock.move_stock(self.pads, -4, stock.SALE, site=self.site)
+        response = self.save_order((self.pads, 2))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Only 1 of', [str(message) for message in response.context['messages']][0])
+        # nothing of the edit is kept
+        self.assertEqual(self.order.orderpartrelationship_set.get(part=self.pads).quantity, 5)
+        self.assertTrue(self.order.orderpartrelationship_set.filter(part=self.discs).exists())
+        self.assertEqual(stock.site_quantity(self.discs, self.site), 4)
@@ -6,6 +6,7 @@ urlpatterns = [
     url(r'^$', views.index, name='index'),
     url(r'^profile/edit/$', views.edit_profile, name='edit-profile'),
     url(r'^jobs/pending/$', views.untaken_jobs_table, name='untaken-jobs'),
+    url(r'^jobs/pending/assign/$', views.assign_jobs, name='assign-jobs'),
     url(r'^jobs/active/$', views.active_jobs_table, name='active-jobs'),
     url(r'^jobs/paused/$', views.paused_jobs_table, name='paused-jobs'),
     url(r'^jobs/create/$', views.create_job, name='create-job'),
@@ -15,6 +16,11 @@ urlpatterns = [
     url(r'^jobs/(?P<job_uuid>\w+)/payment/$', views.create_payment, name='create-payment'),
     url(r'^parts/$', views.part_table, name='parts'),
     url(r'^parts/create/$', views.create_part, name='create-part'),
+    url(r'^parts/import/$', views.import_parts_upload, name='import-parts'),
+    url(r'^parts/reprice/$', views.reprice_parts, name='reprice-parts'),
+    url(r'^parts/sites/$', views.site_stock, name='site-stock'),
+    url(r'^parts/sites/create/$', views.create_site, name='create-site'),
+    url(r'^parts/transfer/$', views.transfer_stock, name='transfer-stock'),
     url(r'^parts/(?P<uuid>\w+)/edit/$', views.edit_part, name='edit-part'),
     url(r'^customers/dropin/$', views.dropin_table, name='dropins'),
     url(r'^customers/dropin/create/$', views.create_dropin, name='create-dropin'),
@@ -37,6 +43,7 @@ urlpatterns = [
     url(r'^invoices/(?P<uuid>\w+)/reminder3/$', views.view_invoice_reminder3, name='view-invoice-reminder3'),
     url(r'^api/get_vehicles/(?P<customer_uuid>\w+)/$', views.get_vehicles, name='get-vehicles'),
     url(r'^api/get_vehicles/', views.get_vehicles_autocomplete, name='get-vehicles-autocomplete'),
+    url(r'^api/get_booking_slots/', views.get_booking_slots, name='get-booking-slots'),
     url(r'^delete/job/(?P<uuid>\w+)/$', views.delete_job, name='delete-job'),
     url(r'^delete/vehicle/(?P<uuid>\w+)/$', views.delete_vehicle, name='delete-vehicle'),
     url(r'^delete/customers/(?P<uuid>\w+)/$', views.delete_customer, name='delete-customer'),
@@ -44,8 +51,12 @@ urlpatterns = [
     url(r'^delete/users/(?P<uuid>\w+)/$', views.delete_user, name='delete-user'),
     url(r'^delete/suppliers/(?P<uuid>\w+)/$', views.delete_supplier, name='delete-supplier'),
     url(r'^replenishment_order/place_order/$', views.replenish_stock, name='replenish-order'),
+    url(r'^replenishment_order/drafts/$', views.draft_orders_table, name='draft-orders'),
     url(r'^replenishment_order/(?P<uuid>\w+)/edit/$', views.edit_replenish_stock, name='edit-replenish-order'),
     url(r'^api/get_suppliers/', views.get_suppliers_autocomplete, name='get-suppliers-autocomplete'),
+    url(r'^api/get_parts/', views.get_parts_autocomplete, name='get-parts-autocomplete'),
+    url(r'^api/search/', views.search, name='search'),
+    url(r'^export/(?P<kind>\w+)/$', views.export_data, name='export-data'),
     url(r'^suppliers/$', views.supplier_table, name='suppliers'),
     url(r'^suppliers/create/$', views.create_supplier, name='create-supplier'),
     url(r'^suppliers/(?P<uuid>\w+)/edit/$', views.edit_supplier, name='edit-supplier'),
@@ -56,6 +67,7 @@ urlpatterns = [
     url(r'^spare_parts_reports/$', views.spare_parts_report_table, name='spare-parts-report'),
     url(r'^spare_parts_reports/create/new/$', views.generate_spare_parts_report, name='generate-spare-parts-report'),
     url(r'^spare_parts_reports/(?P<uuid>\w+)/$', views.view_spare_parts_report, name='view-spare-parts-report'),
+    url(r'^statements/(?P<uuid>\w+)/$', views.view_statement, name='view-statement'),
     url(r'^time_reports/$', views.time_report_table, name='time-report'),
     url(r'^time_reports/create/new/$', views.generate_time_report, name='generate-time-report'),
     url(r'^time_reports/(?P<uuid>\w+)/$', views.view_time_report, name='view-time-report'),
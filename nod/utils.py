@@ -0,0 +1,32 @@
+from itertools import islice
+
+
+# how many ids are looked up per query, keeping under the limit of query parameters of sqlite
+ID_BATCH_SIZE = 500
+
+
+# splits a list of ids into batches small enough to be looked up with a single IN query
+def batches(ids, size=ID_BATCH_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+# splits any iterable into lists of at most the given size, reading only one list ahead at a time
+def chunks(iterable, size=ID_BATCH_SIZE):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+# reads the rows of a queryset of values_list, whose first value is the id, in lists of at most the given size
+# ordered by id, seeking past the last id of each list for the next one. SQLite reads whole result sets into
+# memory even through iterator(), so this is what keeps only one list in memory at a time.
+def seek_chunks(rows, size=ID_BATCH_SIZE):
+    rows = rows.order_by('id')
+    chunk = list(rows[:size])
+    while chunk:
+        yield chunk
+        chunk = list(rows.filter(id__gt=chunk[-1][0])[:size])
@@ -1,16 +1,20 @@
 
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.forms import formset_factory
 from django.shortcuts import get_object_or_404, render, render_to_response, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseRedirect
 from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.core.cache import cache
 from django.contrib import messages
 from django_tables2 import RequestConfig
 from django.forms.formsets import formset_factory
 from django.contrib.auth import update_session_auth_hash
 import calendar
 from django.core.exceptions import ValidationError, ObjectDoesNotExist, MultipleObjectsReturned
+import codecs
+from collections import OrderedDict
 import json
 from django.template import RequestContext, loader
 from django.contrib.auth import logout
@@ -24,6 +28,22 @@ from dateutil.relativedelta import relativedelta
 from .forms import *
 from nod.models import *
 from .tables import *
+from .assignment import apply_assignments, propose_assignments
+from .contacts import sync_contacts
+from .drafts import draft_vehicles, new_draft, reg_number_taken, save_draft, stage_vehicle
+from .events import job_snapshot, record_job_event
+from .exports import EXPORTS, FORMATS, export_lines
+from .fitment import vehicle_fitment
+from .imports import import_parts
+from .pagination import paginate_keyset
+from . import pricing
+from .pricing import record_price
+from .reports import create_spare_parts_report
+from . import search as site_search
+from . import stock
+from .stock import InsufficientStock, move_stock, open_stock, set_stock, shortfall_message, site_quantity, \
+    staff_site, sync_job_parts
+from .scheduling import JOB_BAY_TYPES, bay_available, booking_length, booking_start, free_slots, refresh_free_spots
 
 
 # Home page view, specified for different user roles
@@ -58,13 +78,11 @@ def index(request):
                                                                                issue_date__lte=today))
             RequestConfig(request).configure(mot_reminders_table)
 
-            # generates 'Low Stock' table
-            parts = []
-            for p in Part.objects.filter(is_deleted=False):
-                if p.quantity <= p.low_level_threshold:
-                    parts.append(p)
-
-            low_parts = LowStockTable(parts)
+            # generates 'Low Stock' table, for the staff member's site where they're at one
+            if request.user.staffmember.site_id:
+                low_parts = PartStockTable(stock.low_stock_at(request.user.staffmember.site))
+            else:
+                low_parts = LowStockTable(stock.low_stock())
             RequestConfig(request).configure(low_parts)
 
             context = {
@@ -91,13 +109,8 @@ def index(request):
                                                                                issue_date__lte=today))
             RequestConfig(request).configure(mot_reminders_table)
 
-            # generates 'Low Stock' table
-            parts = []
-            for p in Part.objects.filter(is_deleted=False):
-                if p.quantity <= p.low_level_threshold:
-                    parts.append(p)
-
-            low_parts = LowStockTable(parts)
+            # generates 'Low Stock' table, over the stock of every site together
+            low_parts = LowStockTable(stock.low_stock())
             RequestConfig(request).configure(low_parts)
 
             context = {
@@ -123,13 +136,11 @@ def index(request):
                                                                                issue_date__lte=today))
             RequestConfig(request).configure(mot_reminders_table)
 
-            # generates 'Low Stock' table
-            parts = []
-            for p in Part.objects.filter(is_deleted=False):
-                if p.quantity <= p.low_level_threshold:
-                    parts.append(p)
-
-            low_parts = LowStockTable(parts)
+            # generates 'Low Stock' table, for the staff member's site where they're at one
+            if request.user.staffmember.site_id:
+                low_parts = PartStockTable(stock.low_stock_at(request.user.staffmember.site))
+            else:
+                low_parts = LowStockTable(stock.low_stock())
             RequestConfig(request).configure(low_parts)
 
             context = {
@@ -176,30 +187,9 @@ def automated_invoice_checks():
     if datetime.date.today().day == calendar.monthrange(year, month)[1]:
         first_date = datetime.date(year, month, 1)
 
-        # generating a Spare Parts Report
-        report = SparePartsReport.objects.get_or_create(start_date=first_date, end_date=today, date=today)
-
-        # iterates through existing parts (which aren't deleted) in the database and counts all parts
-        # used and delivered for the report
-        for part in Part.objects.filter(is_deleted=False):
-            spare = SparePart.objects.get_or_create(report=report, part=part, new_stock_level=part.quantity)
-            spare = spare[0]
-            delivered = 0
-            for p in OrderPartRelationship.objects.filter(part=part, order__date__gte=report.start_date):
-                delivered += p.quantity
-            spare.delivery = delivered
-
-            used = 0
-            for p in JobPart.objects.filter(part=part, job__booking_date__gte=report.start_date):
-                used += p.quantity
-            for p in SellPart.objects.filter(part=part, order__date__gte=report.start_date):
-                used +=p.quantity
-            spare.used = used
-
-            spare.initial_stock_level = spare.new_stock_level + spare.used - spare.delivery
-            spare.save()
-            report.sparepart_set.add(spare)
-        report.save()
+        # generating a Spare Parts Report, unless this month's was already generated today
+        if not SparePartsReport.objects.filter(start_date=first_date, end_date=today, is_deleted=False).exists():
+            create_spare_parts_report(first_date, today, today)
 
         # generating a Time Report
         TimeReport.objects.create(start_date=first_date, end_date=today, date=today)
@@ -227,7 +217,7 @@ def logout_view(request):
 def user_table(request):
     if request.user.staffmember.role == '5':
         user_table = UserTable(StaffMember.objects.filter(is_deleted=False))
-        RequestConfig(request).configure(user_table)
+        paginate_keyset(request, user_table)
         return render(request, "nod/users.html", {'user_table': user_table})
     else:
         messages.error(request, "You must be Admin in order to view this page.")
@@ -240,20 +230,70 @@ def part_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' \
             or request.user.staffmember.role == '2':
         part_table = PartTable(Part.objects.filter(is_deleted=False))
-        RequestConfig(request).configure(part_table)
+        paginate_keyset(request, part_table)
         return render(request, "nod/parts.html", {'part_table': part_table})
     else:
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
         return redirect('/garits/')
 
 
+# generates table of the stock held at each site, worked out for every site at once, and of the stock of
+# every part at the site chosen
+@login_required
+def site_stock(request):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' \
+            or request.user.staffmember.role == '2':
+        totals = stock.site_totals()
+        sites = []
+        for site in Site.objects.filter(is_deleted=False):
+            row = {'uuid': site.uuid, 'name': site.name, 'parts': 0, 'units': 0, 'low': 0}
+            row.update(totals.get(site.id, {}))
+            sites.append(row)
+        site_table = SiteStockTable(sites)
+        RequestConfig(request).configure(site_table)
+
+        site = None
+        part_stock_table = None
+        if request.GET.get('site'):
+            site = get_object_or_404(Site, uuid=request.GET.get('site'))
+            part_stock_table = PartStockTable(PartStock.objects.filter(site=site, is_deleted=False,
+                                                                       part__is_deleted=False)
+                                              .select_related('part', 'site'))
+            paginate_keyset(request, part_stock_table)
+
+        context = {
+            'site_table': site_table,
+            'site': site,
+            'part_stock_table': part_stock_table,
+        }
+        return render(request, "nod/site_stock.html", context)
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
+# generates table of draft replenishment orders proposed by the stock forecast
+@login_required
+def draft_orders_table(request):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' \
+            or request.user.staffmember.role == '2':
+        draft_orders_table = DraftOrdersTable(PartOrder.objects.filter(is_deleted=False, is_draft=True)
+                                              .select_related('supplier')
+                                              .annotate(part_count=Count('orderpartrelationship')))
+        paginate_keyset(request, draft_orders_table)
+        return render(request, "nod/draft_orders.html", {'draft_orders_table': draft_orders_table})
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
 # generates table of active jobs (jobs which at least one task has started)
 @login_required
 def active_jobs_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
         job_table = ActiveJobsTable(Job.objects.filter(is_deleted=False, status='2'))
-        RequestConfig(request).configure(job_table)
+        paginate_keyset(request, job_table)
         return render(request, "nod/jobs.html", {'job_table': job_table})
     else:
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
@@ -266,13 +306,11 @@ def paused_jobs_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
 
-        jobs = []
-        for job in Job.objects.filter(is_deleted=False):
-            if not job.sufficient_quantity():
-                jobs.append(job)
+        jobs = Job.objects.filter(is_deleted=False, jobpart__is_deleted=False,
+                                  jobpart__sufficient_quantity=False).distinct()
 
         job_table = ActiveJobsTable(jobs)
-        RequestConfig(request).configure(job_table)
+        paginate_keyset(request, job_table)
         return render(request, "nod/paused_jobs.html", {'job_table': job_table})
     else:
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
@@ -285,20 +323,40 @@ def untaken_jobs_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '1' or\
                     request.user.staffmember.role == '2' or request.user.staffmember.role == '4':
         untaken_job_table = UntakenJobsTable(Job.objects.filter(is_deleted=False, mechanic=None))
-        RequestConfig(request).configure(untaken_job_table)
+        paginate_keyset(request, untaken_job_table)
         return render(request, "nod/untaken_jobs.html", {'untaken_job_table': untaken_job_table})
     else:
         messages.error(request, "You must be a franchisee/mechanic/foreperson/receptionist in order to view this page.")
         return redirect('/garits/')
 
 
+# previews a balanced assignment of every untaken job to the mechanics, and assigns them all on submit
+@login_required
+def assign_jobs(request):
+    if request.user.staffmember.role == '2' or request.user.staffmember.role == '3':
+        if request.method == 'POST':
+            try:
+                assigned = apply_assignments(propose_assignments(), request.user.staffmember)
+                messages.success(request, str(assigned) + " jobs were assigned to mechanics.")
+                return HttpResponseRedirect('/garits/jobs/active/')
+            except IntegrityError:
+                messages.error(request, "There was an error saving")
+
+        assignments_table = ProposedAssignmentsTable([a.as_row() for a in propose_assignments()])
+        RequestConfig(request, paginate=False).configure(assignments_table)
+        return render(request, "nod/assign_jobs.html", {'assignments_table': assignments_table})
+    else:
+        messages.error(request, "You must be a franchisee/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
 # generates table of suppliers
 @login_required
 def supplier_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
-        supplier_table = SupplierTable(Supplier.objects.filter(is_deleted=False))
-        RequestConfig(request).configure(supplier_table)
+        supplier_table = SupplierTable(with_contacts(pricing.with_spend(Supplier.objects.filter(is_deleted=False))))
+        paginate_keyset(request, supplier_table)
         return render(request, "nod/suppliers.html", {'supplier_table': supplier_table})
     else:
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
@@ -310,18 +368,9 @@ def supplier_table(request):
 def account_holder_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
-        account_holders_table = AccountHolderTable(AccountHolder.objects.filter(is_deleted=False,
-                                                                                businesscustomer=None).exclude(forename="",
-                                                                                                          surname=""))
-        RequestConfig(request).configure(account_holders_table)
-
-        # deletes account holders which were created (automatically when accessing the 'create' page)
-        # but then weren't submitted (left empty) for over 30 mintutes.
-        for a in Customer.objects.filter(forename="", surname=""):
-            if a.updated < timezone.now() - timedelta(minutes=30):
-                for v in a.vehicle_set.all():
-                    v.delete()
-                a.delete()
+        account_holders_table = AccountHolderTable(with_contacts(
+            AccountHolder.objects.filter(is_deleted=False, businesscustomer=None).exclude(forename="", surname="")))
+        paginate_keyset(request, account_holders_table)
 
         context = {
             'account_holders_table': account_holders_table,
@@ -337,17 +386,9 @@ def account_holder_table(request):
 def dropin_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
-        dropin_table = DropInTable(Dropin.objects.filter(is_deleted=False).exclude(forename="",
-                                                                                                          surname=""))
-        RequestConfig(request).configure(dropin_table)
-
-        # deletes customers which were created (automatically when accessing the 'create' page)
-        # but then weren't submitted (left empty) for over 30 mintutes.
-        for a in Customer.objects.filter(forename="", surname=""):
-            if a.updated < timezone.now() - timedelta(minutes=30):
-                for v in a.vehicle_set.all():
-                    v.delete()
-                a.delete()
+        dropin_table = DropInTable(with_contacts(Dropin.objects.filter(is_deleted=False).exclude(forename="",
+                                                                                                surname="")))
+        paginate_keyset(request, dropin_table)
 
         context = {
             'dropin_table': dropin_table,
@@ -363,16 +404,9 @@ def dropin_table(request):
 def business_customers_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4'\
             or request.user.staffmember.role == '2':
-        business_customers_table = BusinessCustomerTable(BusinessCustomer.objects.filter(is_deleted=False).exclude(company_name=""))
-        RequestConfig(request).configure(business_customers_table)
-
-        # deletes business customers which were created (automatically when accessing the 'create' page)
-        # but then weren't submitted (left empty) for over 30 mintutes.
-        for b in BusinessCustomer.objects.filter(company_name=""):
-            if b.updated < timezone.now() - timedelta(minutes=30):
-                for v in b.vehicle_set.all():
-                    v.delete()
-                b.delete()
+        business_customers_table = BusinessCustomerTable(with_contacts(
+            BusinessCustomer.objects.filter(is_deleted=False).exclude(company_name="")))
+        paginate_keyset(request, business_customers_table)
 
         context = {
             'business_customers_table': business_customers_table,
@@ -409,25 +443,30 @@ def create_job(request):
                 job_number = form.cleaned_data['job_number']
                 vehicle = form.cleaned_data['vehicle']
                 type = form.cleaned_data['type']
-                booking_date = form.cleaned_data['booking_date']
+                booking_date = booking_start(form.cleaned_data['booking_date'], form.cleaned_data['booking_time'])
                 bay = form.cleaned_data['bay']
 
+                vehicle = get_object_or_404(Vehicle, reg_key=normalize_reg(vehicle))
+                tasks = [task_form.cleaned_data['task_name'] for task_form in task_formset
+                         if task_form.cleaned_data.get('task_name')]
 
-                vehicle = get_object_or_404(Vehicle, reg_number=vehicle)
-                try:
-                    with transaction.atomic():
-                        job = Job.objects.create(job_number=job_number, vehicle=vehicle, status='3', booking_date=booking_date,
-                                                 bay=bay, type=type)
-
-                        for task_form in task_formset:
-                            task_name = task_form.cleaned_data['task_name']
+                # the bay must have a spot free for the whole estimated length of the job
+                if not bay_available(bay, booking_date, booking_length(tasks)):
+                    messages.error(request, "The " + str(bay) + " is fully booked at that time, please pick "
+                                                                "another slot.")
+                else:
+                    try:
+                        with transaction.atomic():
+                            job = Job.objects.create(job_number=job_number, vehicle=vehicle, status='3',
+                                                     booking_date=booking_date, bay=bay, type=type)
 
-                            if task_name:
-                                task = get_object_or_404(Task, description=task_name)
+                            for task in tasks:
                                 jobtask = JobTask.objects.create(task=task, job=job, status='3')
                                 jobtask.duration = task.estimated_time
                                 jobtask.save()
 
+                            record_job_event(job, staff=request.user.staffmember)
+
 
                         # for part_form in part_formset:
                         #     part_name = part_form.cleaned_data['part_name']
@@ -449,17 +488,18 @@ def create_job(request):
                         #                 code='insufficient_parts'
                         #             )
 
+                        refresh_free_spots()
                         messages.success(request, "Job No." + str(job.job_number) + " was successfully created.")
                         return HttpResponseRedirect('/garits/jobs/pending/')
 
-                except IntegrityError:
-                    messages.error(request, "There was an error saving")
+                    except IntegrityError:
+                        messages.error(request, "There was an error saving")
 
         else:
             data = {}
             # set job number based on previous job number
-            if Invoice.objects.last() is not None:
-                last_id = Invoice.objects.last().id
+            if Invoice.all_objects.last() is not None:
+                last_id = Invoice.all_objects.last().id
                 new_id = last_id + 1
             else:
                 new_id = 1
@@ -497,132 +537,119 @@ def edit_job(request, uuid):
 
         PartFormSet = formset_factory(JobPartForm, formset=BaseJobPartForm, min_num=1, extra=0)
         # current parts assigned to job
-        part_set = job.jobpart_set.filter(is_deleted=False)
-        parts_data = [{'part_name': p.part, 'quantity': p.quantity}
+        part_set = job.jobpart_set.filter(is_deleted=False).select_related('part')
+        parts_data = [{'part': p.part, 'quantity': p.quantity}
                       for p in part_set]
 
         task_helper = TaskFormSetHelper()
         part_helper = PartFormSetHelper()
 
         if request.method == 'POST':
+            before = job_snapshot(job)
             form = JobEditForm(request.POST)
             task_formset = TaskFormSet(request.POST, prefix='fs1')
             part_formset = PartFormSet(request.POST, prefix='fs2')
 
             if form.is_valid() and task_formset.is_valid() and part_formset.is_valid():
                 vehicle = form.cleaned_data['vehicle']
-                booking_date = form.cleaned_data['booking_date']
+                booking_time = form.cleaned_data['booking_time'] or timezone.localtime(job.booking_date).time()
+                booking_date = booking_start(form.cleaned_data['booking_date'], booking_time)
                 type = form.cleaned_data['type']
                 bay = form.cleaned_data['bay']
 
-                vehicle = get_object_or_404(Vehicle, reg_number=vehicle)
+                vehicle = get_object_or_404(Vehicle, reg_key=normalize_reg(vehicle))
+                tasks = [task_form.cleaned_data['task_name'] for task_form in task_formset
+                         if task_form.cleaned_data.get('task_name')]
 
-                try:
-                    with transaction.atomic():
-                        job.booking_date = booking_date
-                        job.bay = bay
-                        job.type = type
-
-                        # sets all tasks assign to this job to soft deleted
-                        old_jobtasks = job.jobtask_set.all()
-                        for jt in old_jobtasks:
-                            jt.is_deleted = True
-                            jt.save()
-
-                        for task_form in task_formset:
-                            task_name = task_form.cleaned_data.get('task_name')
-                            status = task_form.cleaned_data.get('status')
-                            duration = task_form.cleaned_data.get('duration')
-
-                            if task_name:
-                                task = get_object_or_404(Task, description=task_name)
-                                jobtask = JobTask.objects.get_or_create(task=task, job=job)
-
-                                # get_or_create method returns tuple {object returned, whether it was
-                                # created or just retrieved}
-                                jobtask = jobtask[0]
-
-                                if jobtask.is_deleted is True:
-                                    jobtask.is_deleted = False
-                                    jobtask.save()
-                                job.jobtask_set.add(jobtask)
+                # only a booking moved to another bay or time has to fit around the bay's other bookings
+                moved = bay != job.bay or booking_date != job.booking_date
+                if moved and not bay_available(bay, booking_date, booking_length(tasks), exclude_job=job):
+                    messages.error(request, "The " + str(bay) + " is fully booked at that time, please pick "
+                                                                "another slot.")
+                else:
+                    try:
+                        with transaction.atomic():
+                            job.booking_date = booking_date
+                            job.bay = bay
+                            job.type = type
 
-                                if status:
-                                    jobtask.status = status
-                                else:
-                                    jobtask.status = '3'
-                                if duration:
-                                    jobtask.duration = duration
-                                else:
-                                    jobtask.duration = task.estimated_time
-                                jobtask.save()
+                            # sets all tasks assign to this job to soft deleted
+                            old_jobtasks = job.jobtask_set.all()
+                            for jt in old_jobtasks:
+                                jt.is_deleted = True
+                                jt.save()
 
-                        # sets all parts assign to this job to soft deleted
-                        old_jobparts = job.jobpart_set.all()
-                        for jp in old_jobparts:
-                            jp.is_deleted = True
-                            jp.save()
+                            for task_form in task_formset:
+                                task_name = task_form.cleaned_data.get('task_name')
+                                status = task_form.cleaned_data.get('status')
+                                duration = task_form.cleaned_data.get('duration')
 
-                        for part_form in part_formset:
-                            part_name = part_form.cleaned_data.get('part_name')
-                            quantity = part_form.cleaned_data.get('quantity')
+                                if task_name:
+                                    task = get_object_or_404(Task, description=task_name)
+                                    jobtask = JobTask.all_objects.get_or_create(task=task, job=job)
 
-                            if part_name and quantity:
-                                part = get_object_or_404(Part, name=part_name)
-                                jobpart = job.jobpart_set.get_or_create(part=part, quantity=quantity)
-
-                                if jobpart[0].is_deleted is True:
-                                    jobpart[0].is_deleted = False
-                                    jobpart[0].save()
-                                if jobpart[1] is True:
-                                    job.jobpart_set.add(jobpart[0])
-
-                                # checks that the quantity required is not more than the total quantity in stock.
-                                # if it is, it removes the quantity used for a job from the total quantity and assigns,
-                                # the quantity to the job part object, otherwise, it throws an error.
-                                if part.quantity >= quantity:
-                                    part.quantity -= quantity
-                                    jobpart[0].sufficient_quantity = True
-                                    part.save()
-                                else:
-                                    jobpart[0].sufficient_quantity = False
-                                    # raise forms.ValidationError(
-                                    #     'Not enough parts in stock.',
-                                    #     code='insufficient_parts'
-                                    # )
-                                jobpart[0].save()
-
-                        complete = False
-                        for t in job.jobtask_set.filter(is_deleted=False):
-                            if t.status == '1':
-                                complete = True
-                                job.status = '1'
-                            else:
-                                complete = False
-                                break
+                                    # get_or_create method returns tuple {object returned, whether it was
+                                    # created or just retrieved}
+                                    jobtask = jobtask[0]
 
-                        if complete is False:
+                                    if jobtask.is_deleted is True:
+                                        jobtask.is_deleted = False
+                                        jobtask.save()
+                                    job.jobtask_set.add(jobtask)
+
+                                    if status:
+                                        jobtask.status = status
+                                    else:
+                                        jobtask.status = '3'
+                                    if duration:
+                                        jobtask.duration = duration
+                                    else:
+                                        jobtask.duration = task.estimated_time
+                                    jobtask.save()
+
+                            # parts are taken from the stock at the job's site only as far as they weren't
+                            # taken for it already, and those no longer used go back
+                            parts = OrderedDict()
+                            for part_form in part_formset:
+                                part = part_form.cleaned_data.get('part')
+                                quantity = part_form.cleaned_data.get('quantity')
+                                if part and quantity:
+                                    parts[part] = quantity
+                            sync_job_parts(job, parts, request.user.staffmember)
+
+                            complete = False
                             for t in job.jobtask_set.filter(is_deleted=False):
-                                if t.status == '2':
-                                    job.status = '2'
-                                    break
+                                if t.status == '1':
+                                    complete = True
+                                    job.status = '1'
                                 else:
-                                    job.status = '3'
+                                    complete = False
+                                    break
 
-                        job.save()
-                        if complete is True:
-                            if Invoice.objects.last() is not None:
-                                last_id = Invoice.objects.last().id
-                                new_id = last_id + 1
-                            else:
-                                new_id = 1
-                            invoice = Invoice.objects.create(job_done=job, invoice_number=new_id, issue_date=datetime.date.today())
+                            if complete is False:
+                                for t in job.jobtask_set.filter(is_deleted=False):
+                                    if t.status == '2':
+                                        job.status = '2'
+                                        break
+                                    else:
+                                        job.status = '3'
 
-                        messages.success(request, "Your changes to Job No." + str(job.job_number) + " were saved.")
-                        return HttpResponseRedirect('/garits/jobs/pending/')
+                            job.save()
+                            if complete is True:
+                                if Invoice.all_objects.last() is not None:
+                                    last_id = Invoice.all_objects.last().id
+                                    new_id = last_id + 1
+                                else:
+                                    new_id = 1
+                                invoice = Invoice.objects.create(job_done=job, invoice_number=new_id, issue_date=datetime.date.today())
 
-                except IntegrityError:
-                    messages.error(request, "There was an error saving")
+                            record_job_event(job, before, request.user.staffmember)
+                            refresh_free_spots()
+                            messages.success(request, "Your changes to Job No." + str(job.job_number) + " were saved.")
+                            return HttpResponseRedirect('/garits/jobs/pending/')
+
+                    except IntegrityError:
+                        messages.error(request, "There was an error saving")
 
         # handles GET request
         else:
@@ -633,6 +660,7 @@ def edit_job(request, uuid):
             data['bay'] = job.bay
             data['status'] = job.status
             data['booking_date'] = job.booking_date
+            data['booking_time'] = timezone.localtime(job.booking_date).time()
             data['work_carried_out'] = job.work_carried_out
 
             form = JobEditForm(initial=data)
@@ -661,14 +689,15 @@ def edit_job(request, uuid):
 
             PartFormSet = formset_factory(JobPartForm, formset=BaseJobPartForm, min_num=1, extra=0)
             # current parts assigned to job
-            part_set = job.jobpart_set.filter(is_deleted=False)
-            parts_data = [{'part_name': p.part, 'quantity': p.quantity}
+            part_set = job.jobpart_set.filter(is_deleted=False).select_related('part')
+            parts_data = [{'part': p.part, 'quantity': p.quantity}
                           for p in part_set]
 
             task_helper = TaskFormSetHelper()
             part_helper = PartFormSetHelper()
 
             if request.method == 'POST':
+                before = job_snapshot(job)
                 form = JobEditForm(request.POST)
                 mechanic_form = MechanicJobForm(request.POST)
                 task_formset = TaskFormSet(request.POST, prefix='fs1')
@@ -676,121 +705,107 @@ def edit_job(request, uuid):
 
                 if form.is_valid() and task_formset.is_valid() and part_formset.is_valid() and mechanic_form.is_valid():
                     vehicle = form.cleaned_data['vehicle']
-                    booking_date = form.cleaned_data['booking_date']
+                    booking_time = form.cleaned_data['booking_time'] or timezone.localtime(job.booking_date).time()
+                    booking_date = booking_start(form.cleaned_data['booking_date'], booking_time)
                     bay = form.cleaned_data['bay']
                     type = form.cleaned_data['type']
                     mechanic = mechanic_form.cleaned_data['mechanic']
 
-                    vehicle = get_object_or_404(Vehicle, reg_number=vehicle)
+                    vehicle = get_object_or_404(Vehicle, reg_key=normalize_reg(vehicle))
+                    tasks = [task_form.cleaned_data['task_name'] for task_form in task_formset
+                             if task_form.cleaned_data.get('task_name')]
 
-                    try:
-                        with transaction.atomic():
-                            job.booking_date = booking_date
-                            job.bay = bay
-                            job.mechanic = mechanic
-                            job.type = type
-
-                            # sets all tasks assign to this job to soft deleted
-                            old_jobtasks = job.jobtask_set.all()
-                            for jt in old_jobtasks:
-                                jt.is_deleted = True
-                                jt.save()
-
-                            for task_form in task_formset:
-                                task_name = task_form.cleaned_data.get('task_name')
-                                status = task_form.cleaned_data.get('status')
-                                duration = task_form.cleaned_data.get('duration')
-
-                                if task_name:
-                                    task = get_object_or_404(Task, description=task_name)
-                                    jobtask = JobTask.objects.get_or_create(task=task, job=job)
-
-                                    # get_or_create method returns tuple {object returned, whether it was
-                                    # created or just retrieved}
-                                    jobtask = jobtask[0]
-
-                                    if jobtask.is_deleted is True:
-                                        jobtask.is_deleted = False
+                    # only a booking moved to another bay or time has to fit around the bay's other bookings
+                    moved = bay != job.bay or booking_date != job.booking_date
+                    if moved and not bay_available(bay, booking_date, booking_length(tasks), exclude_job=job):
+                        messages.error(request, "The " + str(bay) + " is fully booked at that time, please pick "
+                                                                    "another slot.")
+                    else:
+                        try:
+                            with transaction.atomic():
+                                job.booking_date = booking_date
+                                job.bay = bay
+                                job.mechanic = mechanic
+                                job.type = type
+
+                                # sets all tasks assign to this job to soft deleted
+                                old_jobtasks = job.jobtask_set.all()
+                                for jt in old_jobtasks:
+                                    jt.is_deleted = True
+                                    jt.save()
+
+                                for task_form in task_formset:
+                                    task_name = task_form.cleaned_data.get('task_name')
+                                    status = task_form.cleaned_data.get('status')
+                                    duration = task_form.cleaned_data.get('duration')
+
+                                    if task_name:
+                                        task = get_object_or_404(Task, description=task_name)
+                                        jobtask = JobTask.all_objects.get_or_create(task=task, job=job)
+
+                                        # get_or_create method returns tuple {object returned, whether it was
+                                        # created or just retrieved}
+                                        jobtask = jobtask[0]
+
+                                        if jobtask.is_deleted is True:
+                                            jobtask.is_deleted = False
+                                            jobtask.save()
+                                        job.jobtask_set.add(jobtask)
+
+                                        if status:
+                                            jobtask.status = status
+                                        else:
+                                            jobtask.status = '3'
+                                        if duration:
+                                            jobtask.duration = duration
+                                        else:
+                                            jobtask.duration = task.estimated_time
                                         jobtask.save()
-                                    job.jobtask_set.add(jobtask)
 
-                                    if status:
-                                        jobtask.status = status
-                                    else:
-                                        jobtask.status = '3'
-                                    if duration:
-                                        jobtask.duration = duration
-                                    else:
-                                        jobtask.duration = task.estimated_time
-                                    jobtask.save()
-
-                            # sets all parts assign to this job to soft deleted
-                            old_jobparts = job.jobpart_set.all()
-                            for jp in old_jobparts:
-                                jp.is_deleted = True
-                                jp.save()
-
-                            for part_form in part_formset:
-                                part_name = part_form.cleaned_data.get('part_name')
-                                quantity = part_form.cleaned_data.get('quantity')
-
-                                if part_name and quantity:
-                                    part = get_object_or_404(Part, name=part_name)
-                                    jobpart = job.jobpart_set.get_or_create(part=part, quantity=quantity)
-
-                                    if jobpart[0].is_deleted is True:
-                                        jobpart[0].is_deleted = False
-                                        jobpart[0].save()
-                                    if jobpart[1] is True:
-                                        job.jobpart_set.add(jobpart[0])
-
-                                    # checks that the quantity required is not more than the total quantity in stock.
-                                    # if it is, it removes the quantity used for a job from the total quantity and assigns,
-                                    # the quantity to the job part object, otherwise, it throws an error.
-                                    if part.quantity >= quantity:
-                                        part.quantity -= quantity
-                                        jobpart[0].sufficient_quantity = True
-                                        part.save()
-                                    else:
-                                        jobpart[0].sufficient_quantity = False
-                                        # raise forms.ValidationError(
-                                        #     'Not enough parts in stock.',
-                                        #     code='insufficient_parts'
-                                        # )
-                                    jobpart[0].save()
-
-                            for t in job.jobtask_set.filter(is_deleted=False):
-                                if t.status == '1':
-                                    complete = True
-                                    job.status = '1'
-                                else:
-                                    complete = False
-                                    break
+                                # parts are taken from the stock at the job's site only as far as they weren't
+                                # taken for it already, and those no longer used go back
+                                parts = OrderedDict()
+                                for part_form in part_formset:
+                                    part = part_form.cleaned_data.get('part')
+                                    quantity = part_form.cleaned_data.get('quantity')
+                                    if part and quantity:
+                                        parts[part] = quantity
+                                sync_job_parts(job, parts, request.user.staffmember)
 
-                            if complete is False:
                                 for t in job.jobtask_set.filter(is_deleted=False):
-                                    if t.status == '2':
-                                        job.status = '2'
-                                        break
+                                    if t.status == '1':
+                                        complete = True
+                                        job.status = '1'
                                     else:
-                                        job.status = '3'
+                                        complete = False
+                                        break
 
-                            job.save()
-                            if complete is True:
-                                # defines invoice number to be the previous one + 1. If there are 0, it sets it to 1.
-                                if Invoice.objects.last() is not None:
-                                    last_id = Invoice.objects.last().id
-                                    new_id = last_id + 1
-                                else:
-                                    new_id = 1
-                                # creates Invoice object for the job object
-                                invoice = Invoice.objects.create(job_done=job, invoice_number=new_id, issue_date=datetime.date.today())
+                                if complete is False:
+                                    for t in job.jobtask_set.filter(is_deleted=False):
+                                        if t.status == '2':
+                                            job.status = '2'
+                                            break
+                                        else:
+                                            job.status = '3'
+
+                                job.save()
+                                if complete is True:
+                                    # defines invoice number to be the previous one + 1. If there are 0, it sets it to 1.
+                                    if Invoice.all_objects.last() is not None:
+                                        last_id = Invoice.all_objects.last().id
+                                        new_id = last_id + 1
+                                    else:
+                                        new_id = 1
+                                    # creates Invoice object for the job object
+                                    invoice = Invoice.objects.create(job_done=job, invoice_number=new_id, issue_date=datetime.date.today())
 
-                            messages.success(request, "Your changes to Job No." + str(job.job_number) + " were saved.")
-                            return HttpResponseRedirect('/garits/jobs/active/')
+                                record_job_event(job, before, request.user.staffmember)
+                                refresh_free_spots()
+                                messages.success(request, "Your changes to Job No." + str(job.job_number) + " were saved.")
+                                return HttpResponseRedirect('/garits/jobs/active/')
 
-                    except IntegrityError:
-                        messages.error(request, "There was an error saving")
+                        except IntegrityError:
+                            messages.error(request, "There was an error saving")
 
             # handles GET request
             else:
@@ -802,6 +817,7 @@ def edit_job(request, uuid):
                 data['bay'] = job.bay
                 data['status'] = job.status
                 data['booking_date'] = job.booking_date
+                data['booking_time'] = timezone.localtime(job.booking_date).time()
                 data['work_carried_out'] = job.work_carried_out
                 data2['mechanic'] = job.mechanic
 
@@ -835,6 +851,7 @@ def delete_job(request, uuid):
 
         job.is_deleted = True
         job.save()
+        refresh_free_spots()
 
         messages.error(request, "Job No." + job.job_number + " deleted.")
         return HttpResponseRedirect('/garits/jobs/active/')
@@ -895,55 +912,15 @@ def create_dropin(request):
             email_formset = EmailFormSet(request.POST, prefix='fs1')
             phone_formset = PhoneFormSet(request.POST, prefix='fs2')
 
-            customer_uuid = form.data['customer_uuid']
-            print(customer_uuid)
-            try:
-                dropin = Dropin.objects.get(uuid=customer_uuid, is_deleted=False)
-            except MultipleObjectsReturned:
-                pass
-            except ObjectDoesNotExist:
-                pass
+            draft = form.data['customer_uuid']
 
             if form.is_valid() and email_formset.is_valid() and phone_formset.is_valid():
-                forename = form.cleaned_data['forename']
-                surname = form.cleaned_data['surname']
-                date = form.cleaned_data['date']
+                dropin = Dropin(forename=form.cleaned_data['forename'], surname=form.cleaned_data['surname'],
+                                date=form.cleaned_data['date'])
 
                 try:
                     with transaction.atomic():
-                        dropin.forename = forename
-                        dropin.surname = surname
-                        dropin.date = date
-
-                        dropin.save()
-
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                dropin.emails.add(email)
-                                dropin.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                dropin.phone_numbers.add(phone)
-                                dropin.save()
-
-                        dropin.save()
+                        save_draft(request.session, draft, dropin, email_formset, phone_formset)
 
                         return HttpResponseRedirect('/garits/customers/dropin/')
 
@@ -951,11 +928,11 @@ def create_dropin(request):
                     messages.error(request, "There was an error saving")
 
         else:
-            # creates drop in object every time the create drop in page is accessed in order to
-            # have a customer to assign to the vehicles. Customers left empty are then deleted every 30 minutes.
-            dropin = Dropin.objects.create()
+            # the customer isn't saved until the form is submitted; vehicles added in the meantime are held
+            # against a draft in the session
+            draft = new_draft()
             data = {}
-            data['customer_uuid'] = dropin.uuid
+            data['customer_uuid'] = draft
             form = DropinForm(initial=data)
             email_formset = EmailFormSet(initial=email_data, prefix='fs1')
             phone_formset = PhoneFormSet(initial=phone_data, prefix='fs2')
@@ -966,7 +943,7 @@ def create_dropin(request):
             'phone_formset': phone_formset,
             'email_helper': email_helper,
             'phone_helper': phone_helper,
-            'dropin': dropin,
+            'draft': draft,
         }
 
         return render(request, 'nod/create_dropin.html', context)
@@ -1015,45 +992,8 @@ def edit_dropin(request, uuid):
 
                         dropin.save()
 
-                        # sets all assigned emails to soft deleted
-                        old_emails = dropin.emails.all()
-                        for e in old_emails:
-                            e.is_deleted = True
-                            e.save()
-
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            # either changes an existing email back to is_deleted=True, or creates a new assigned email
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                dropin.emails.add(email)
-                                dropin.save()
-
-                        # sets all assigned phones to soft deleted
-                        old_phones = dropin.phone_numbers.all()
-                        for p in old_phones:
-                            p.is_deleted = True
-                            p.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            # either changes an existing phone back to is_deleted=True, or creates a new assigned phone
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                dropin.phone_numbers.add(phone)
-                                dropin.save()
+                        # replaces their emails and phone numbers with those submitted
+                        sync_contacts(dropin, email_formset, phone_formset)
 
                         dropin.save()
 
@@ -1105,73 +1045,34 @@ def create_account_holder(request):
             email_formset = EmailFormSet(request.POST, prefix='fs1')
             phone_formset = PhoneFormSet(request.POST, prefix='fs2')
 
-            customer_uuid = form.data['customer_uuid']
-            print(customer_uuid)
-
-            try:
-                account_holder = AccountHolder.objects.get(uuid=customer_uuid, is_deleted=False)
-            except MultipleObjectsReturned:
-                pass
-            except ObjectDoesNotExist:
-                pass
+            draft = form.data['customer_uuid']
 
             if form.is_valid() and email_formset.is_valid() and phone_formset.is_valid() and discount_form.is_valid():
-                forename = form.cleaned_data['forename']
-                surname = form.cleaned_data['surname']
-                date = form.cleaned_data['date']
-                address = form.cleaned_data['address']
-                postcode = form.cleaned_data['postcode']
+                account_holder = AccountHolder(forename=form.cleaned_data['forename'],
+                                               surname=form.cleaned_data['surname'],
+                                               date=form.cleaned_data['date'],
+                                               address=form.cleaned_data['address'],
+                                               postcode=form.cleaned_data['postcode'])
                 discount_plan = discount_form.cleaned_data['discount_plan']
 
-                try:
-                    with transaction.atomic():
-                        account_holder.forename = forename
-                        account_holder.surname = surname
-                        account_holder.date = date
-                        account_holder.address = address
-                        account_holder.postcode = postcode
-
-                        if discount_plan is not '':
-                            # if fixed
-                            if discount_plan == '1':
-                                discount = FixedDiscount.objects.get()
+                if discount_plan is not '':
+                    # if fixed
+                    if discount_plan == '1':
+                        discount = FixedDiscount.objects.get()
 
-                            # flexible
-                            if discount_plan == '2':
-                                discount = FlexibleDiscount.objects.first()
+                    # flexible
+                    if discount_plan == '2':
+                        discount = FlexibleDiscount.objects.first()
 
-                            # variable
-                            if discount_plan == '3':
-                                discount = VariableDiscount.objects.get()
+                    # variable
+                    if discount_plan == '3':
+                        discount = VariableDiscount.objects.get()
 
-                            account_holder.content_object = discount
+                    account_holder.content_object = discount
 
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                account_holder.emails.add(email)
-                                account_holder.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                account_holder.phone_numbers.add(phone)
-                                account_holder.save()
-                        account_holder.save()
+                try:
+                    with transaction.atomic():
+                        save_draft(request.session, draft, account_holder, email_formset, phone_formset)
 
                         return HttpResponseRedirect('/garits/customers/account_holders/')
 
@@ -1179,11 +1080,11 @@ def create_account_holder(request):
                     messages.error(request, "There was an error saving")
 
         else:
-            # creates account holder object every time the create drop in page is accessed in order to
-            # have a customer to assign to the vehicles. Customers left empty are then deleted every 30 minutes.
-            account_holder = AccountHolder.objects.create()
+            # the customer isn't saved until the form is submitted; vehicles added in the meantime are held
+            # against a draft in the session
+            draft = new_draft()
             data = {}
-            data['customer_uuid'] = account_holder.uuid
+            data['customer_uuid'] = draft
             form = AccountHolderForm(initial=data)
             discount_form = DiscountPlanForm()
             email_formset = EmailFormSet(initial=email_data, prefix='fs1')
@@ -1196,7 +1097,7 @@ def create_account_holder(request):
             'phone_formset': phone_formset,
             'email_helper': email_helper,
             'phone_helper': phone_helper,
-            'account_holder': account_holder,
+            'draft': draft,
         }
 
         return render(request, 'nod/create_account_holder.html', context)
@@ -1215,58 +1116,18 @@ def create_account_holder(request):
                 email_formset = EmailFormSet(request.POST, prefix='fs1')
                 phone_formset = PhoneFormSet(request.POST, prefix='fs2')
 
-                customer_uuid = form.data['customer_uuid']
-                print(customer_uuid)
-
-                try:
-                    account_holder = AccountHolder.objects.get(uuid=customer_uuid, is_deleted=False)
-                except MultipleObjectsReturned:
-                    pass
-                except ObjectDoesNotExist:
-                    pass
+                draft = form.data['customer_uuid']
 
                 if form.is_valid() and email_formset.is_valid() and phone_formset.is_valid():
-                    forename = form.cleaned_data['forename']
-                    surname = form.cleaned_data['surname']
-                    date = form.cleaned_data['date']
-                    address = form.cleaned_data['address']
-                    postcode = form.cleaned_data['postcode']
+                    account_holder = AccountHolder(forename=form.cleaned_data['forename'],
+                                                   surname=form.cleaned_data['surname'],
+                                                   date=form.cleaned_data['date'],
+                                                   address=form.cleaned_data['address'],
+                                                   postcode=form.cleaned_data['postcode'])
 
                     try:
                         with transaction.atomic():
-                            account_holder.forename = forename
-                            account_holder.surname = surname
-                            account_holder.date = date
-                            account_holder.address = address
-                            account_holder.postcode = postcode
-
-                            for email_form in email_formset:
-                                email_address = email_form.cleaned_data.get('email_address')
-                                email_type = email_form.cleaned_data.get('email_type')
-
-                                if email_address and email_type:
-                                    email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                    email = email[0]
-                                    if email.is_deleted is True:
-                                        email.is_deleted = False
-                                        email.save()
-                                    account_holder.emails.add(email)
-                                    account_holder.save()
-
-                            for phone_form in phone_formset:
-                                phone_number = phone_form.cleaned_data.get('phone_number')
-                                phone_type = phone_form.cleaned_data.get('phone_type')
-
-                                if phone_number and phone_type:
-                                    phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                    phone = phone[0]
-                                    if phone.is_deleted is True:
-                                        phone.is_deleted = False
-                                        phone.save()
-                                    account_holder.phone_numbers.add(phone)
-                                    account_holder.save()
-                            print(request.POST)
-                            account_holder.save()
+                            save_draft(request.session, draft, account_holder, email_formset, phone_formset)
 
                             return HttpResponseRedirect('/garits/customers/account_holders/')
 
@@ -1274,11 +1135,11 @@ def create_account_holder(request):
                         messages.error(request, "There was an error saving")
 
             else:
-                # creates account holder object every time the create drop in page is accessed in order to
-                # have a customer to assign to the vehicles. Customers left empty are then deleted every 30 minutes.
-                account_holder = AccountHolder.objects.create()
+                # the customer isn't saved until the form is submitted; vehicles added in the meantime are held
+                # against a draft in the session
+                draft = new_draft()
                 data = {}
-                data['customer_uuid'] = account_holder.uuid
+                data['customer_uuid'] = draft
                 form = AccountHolderForm(initial=data)
                 email_formset = EmailFormSet(initial=email_data, prefix='fs1')
                 phone_formset = PhoneFormSet(initial=phone_data, prefix='fs2')
@@ -1289,7 +1150,7 @@ def create_account_holder(request):
                 'phone_formset': phone_formset,
                 'email_helper': email_helper,
                 'phone_helper': phone_helper,
-                'account_holder': account_holder,
+                'draft': draft,
             }
 
             return render(request, 'nod/create_account_holder.html', context)
@@ -1356,45 +1217,8 @@ def edit_account_holder(request, uuid):
 
                             account_holder.content_object = discount
 
-                        # sets all assigned emails to soft deleted
-                        old_emails = account_holder.emails.all()
-                        for e in old_emails:
-                            e.is_deleted = True
-                            e.save()
-
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            # either changes an existing email back to is_deleted=True, or creates a new assigned email
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                account_holder.emails.add(email)
-                                account_holder.save()
-
-                        # sets all assigned phones to soft deleted
-                        old_phones = account_holder.phone_numbers.all()
-                        for p in old_phones:
-                            p.is_deleted = True
-                            p.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            # either changes an existing phone back to is_deleted=True, or creates a new assigned phone
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                account_holder.phone_numbers.add(phone)
-                                account_holder.save()
+                        # replaces their emails and phone numbers with those submitted
+                        sync_contacts(account_holder, email_formset, phone_formset)
 
                         account_holder.save()
 
@@ -1484,47 +1308,8 @@ def edit_account_holder(request, uuid):
                             account_holder.address = address
                             account_holder.postcode = postcode
 
-                            # sets all assigned emails to soft deleted
-                            old_emails = account_holder.emails.all()
-                            for e in old_emails:
-                                e.is_deleted = True
-                                e.save()
-
-                            for email_form in email_formset:
-                                email_address = email_form.cleaned_data.get('email_address')
-                                email_type = email_form.cleaned_data.get('email_type')
-
-                                # either changes an existing email back to is_deleted=True, or creates a new assigned
-                                # email
-                                if email_address and email_type:
-                                    email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                    email = email[0]
-                                    if email.is_deleted is True:
-                                        email.is_deleted = False
-                                        email.save()
-                                    account_holder.emails.add(email)
-                                    account_holder.save()
-
-                            # sets all assigned phones to soft deleted
-                            old_phones = account_holder.phone_numbers.all()
-                            for p in old_phones:
-                                p.is_deleted = True
-                                p.save()
-
-                            for phone_form in phone_formset:
-                                phone_number = phone_form.cleaned_data.get('phone_number')
-                                phone_type = phone_form.cleaned_data.get('phone_type')
-
-                                # either changes an existing phone back to is_deleted=True, or creates a new
-                                # assigned phone
-                                if phone_number and phone_type:
-                                    phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                    phone = phone[0]
-                                    if phone.is_deleted is True:
-                                        phone.is_deleted = False
-                                        phone.save()
-                                    account_holder.phone_numbers.add(phone)
-                                    account_holder.save()
+                            # replaces their emails and phone numbers with those submitted
+                            sync_contacts(account_holder, email_formset, phone_formset)
 
                             account_holder.save()
 
@@ -1583,79 +1368,36 @@ def create_business_customer(request):
             email_formset = EmailFormSet(request.POST, prefix='fs1')
             phone_formset = PhoneFormSet(request.POST, prefix='fs2')
 
-            customer_uuid = form.data['customer_uuid']
-
-            try:
-                business_customer = BusinessCustomer.objects.get(uuid=customer_uuid, is_deleted=False)
-            except MultipleObjectsReturned:
-                pass
-            except ObjectDoesNotExist:
-                pass
+            draft = form.data['customer_uuid']
 
             if form.is_valid() and email_formset.is_valid() and phone_formset.is_valid() and discount_form.is_valid():
-                company_name = form.cleaned_data['company_name']
-                forename = form.cleaned_data['forename']
-                surname = form.cleaned_data['surname']
-                rep_role = form.cleaned_data['rep_role']
-                date = form.cleaned_data['date']
-                address = form.cleaned_data['address']
-                postcode = form.cleaned_data['postcode']
+                business_customer = BusinessCustomer(company_name=form.cleaned_data['company_name'],
+                                                     forename=form.cleaned_data['forename'],
+                                                     surname=form.cleaned_data['surname'],
+                                                     rep_role=form.cleaned_data['rep_role'],
+                                                     date=form.cleaned_data['date'],
+                                                     address=form.cleaned_data['address'],
+                                                     postcode=form.cleaned_data['postcode'])
                 discount_plan = discount_form.cleaned_data['discount_plan']
 
-                try:
-                    with transaction.atomic():
-                        business_customer.company_name = company_name
-                        business_customer.forename = forename
-                        business_customer.surname = surname
-                        business_customer.rep_role = rep_role
-                        business_customer.date = date
-                        business_customer.address = address
-                        business_customer.postcode = postcode
-
-                        if discount_plan is not '':
-                            # if fixed
-                            if discount_plan == '1':
-                                discount = FixedDiscount.objects.get()
-
-                            # flexible
-                            if discount_plan == '2':
-                                discount = FlexibleDiscount.objects.first()
+                if discount_plan is not '':
+                    # if fixed
+                    if discount_plan == '1':
+                        discount = FixedDiscount.objects.get()
 
-                            # variable
-                            if discount_plan == '3':
-                                discount = VariableDiscount.objects.get()
+                    # flexible
+                    if discount_plan == '2':
+                        discount = FlexibleDiscount.objects.first()
 
-                            business_customer.content_object = discount
+                    # variable
+                    if discount_plan == '3':
+                        discount = VariableDiscount.objects.get()
 
-                        business_customer.save()
+                    business_customer.content_object = discount
 
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                business_customer.emails.add(email)
-                                business_customer.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                business_customer.phone_numbers.add(phone)
-                                business_customer.save()
-
-                        business_customer.save()
+                try:
+                    with transaction.atomic():
+                        save_draft(request.session, draft, business_customer, email_formset, phone_formset)
 
                         return HttpResponseRedirect('/garits/customers/business_customers/')
 
@@ -1663,11 +1405,11 @@ def create_business_customer(request):
                     messages.error(request, "There was an error saving")
 
         else:
-            # creates business customers object every time the create drop in page is accessed in order to
-            # have a customer to assign to the vehicles. Customers left empty are then deleted every 30 minutes.
-            business_customer = BusinessCustomer.objects.create()
+            # the customer isn't saved until the form is submitted; vehicles added in the meantime are held
+            # against a draft in the session
+            draft = new_draft()
             data = {}
-            data['customer_uuid'] = business_customer.uuid
+            data['customer_uuid'] = draft
             form = BusinessCustomerForm(initial=data)
             discount_form = DiscountPlanForm()
             email_formset = EmailFormSet(initial=email_data, prefix='fs1')
@@ -1680,7 +1422,7 @@ def create_business_customer(request):
             'phone_formset': phone_formset,
             'email_helper': email_helper,
             'phone_helper': phone_helper,
-            'business_customer': business_customer
+            'draft': draft,
         }
 
         return render(request, 'nod/create_business_customer.html', context)
@@ -1699,63 +1441,20 @@ def create_business_customer(request):
                 email_formset = EmailFormSet(request.POST, prefix='fs1')
                 phone_formset = PhoneFormSet(request.POST, prefix='fs2')
 
-                customer_uuid = form.data['customer_uuid']
-
-                try:
-                    business_customer = BusinessCustomer.objects.get(uuid=customer_uuid, is_deleted=False)
-                except MultipleObjectsReturned:
-                    pass
-                except ObjectDoesNotExist:
-                    pass
+                draft = form.data['customer_uuid']
 
                 if form.is_valid() and email_formset.is_valid() and phone_formset.is_valid():
-                    company_name = form.cleaned_data['company_name']
-                    forename = form.cleaned_data['forename']
-                    surname = form.cleaned_data['surname']
-                    rep_role = form.cleaned_data['rep_role']
-                    date = form.cleaned_data['date']
-                    address = form.cleaned_data['address']
-                    postcode = form.cleaned_data['postcode']
+                    business_customer = BusinessCustomer(company_name=form.cleaned_data['company_name'],
+                                                         forename=form.cleaned_data['forename'],
+                                                         surname=form.cleaned_data['surname'],
+                                                         rep_role=form.cleaned_data['rep_role'],
+                                                         date=form.cleaned_data['date'],
+                                                         address=form.cleaned_data['address'],
+                                                         postcode=form.cleaned_data['postcode'])
 
                     try:
                         with transaction.atomic():
-                            business_customer.company_name = company_name
-                            business_customer.forename = forename
-                            business_customer.surname = surname
-                            business_customer.rep_role = rep_role
-                            business_customer.date = date
-                            business_customer.address = address
-                            business_customer.postcode = postcode
-
-                            business_customer.save()
-
-                            for email_form in email_formset:
-                                email_address = email_form.cleaned_data.get('email_address')
-                                email_type = email_form.cleaned_data.get('email_type')
-
-                                if email_address and email_type:
-                                    email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                    email = email[0]
-                                    if email.is_deleted is True:
-                                        email.is_deleted = False
-                                        email.save()
-                                    business_customer.emails.add(email)
-                                    business_customer.save()
-
-                            for phone_form in phone_formset:
-                                phone_number = phone_form.cleaned_data.get('phone_number')
-                                phone_type = phone_form.cleaned_data.get('phone_type')
-
-                                if phone_number and phone_type:
-                                    phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                    phone = phone[0]
-                                    if phone.is_deleted is True:
-                                        phone.is_deleted = False
-                                        phone.save()
-                                    business_customer.phone_numbers.add(phone)
-                                    business_customer.save()
-
-                            business_customer.save()
+                            save_draft(request.session, draft, business_customer, email_formset, phone_formset)
 
                             return HttpResponseRedirect('/garits/customers/business_customers/')
 
@@ -1763,11 +1462,11 @@ def create_business_customer(request):
                         messages.error(request, "There was an error saving")
 
             else:
-                # creates business customers object every time the create drop in page is accessed in order to
-                # have a customer to assign to the vehicles. Customers left empty are then deleted every 30 minutes.
-                business_customer = BusinessCustomer.objects.create()
+                # the customer isn't saved until the form is submitted; vehicles added in the meantime are held
+                # against a draft in the session
+                draft = new_draft()
                 data = {}
-                data['customer_uuid'] = business_customer.uuid
+                data['customer_uuid'] = draft
                 form = BusinessCustomerForm(initial=data)
                 email_formset = EmailFormSet(initial=email_data, prefix='fs1')
                 phone_formset = PhoneFormSet(initial=phone_data, prefix='fs2')
@@ -1778,7 +1477,7 @@ def create_business_customer(request):
                 'phone_formset': phone_formset,
                 'email_helper': email_helper,
                 'phone_helper': phone_helper,
-                'business_customer': business_customer
+                'draft': draft,
             }
 
             return render(request, 'nod/create_business_customer.html', context)
@@ -1851,45 +1550,8 @@ def edit_business_customer(request, uuid):
 
                         business_customer.save()
 
-                        # sets all assigned emails to soft deleted
-                        old_emails = business_customer.emails.all()
-                        for e in old_emails:
-                            e.is_deleted = True
-                            e.save()
-
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            # either changes an existing email back to is_deleted=True, or creates a new assigned email
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                business_customer.emails.add(email)
-                                business_customer.save()
-
-                        # sets all assigned phones to soft deleted
-                        old_phones = business_customer.phone_numbers.all()
-                        for p in old_phones:
-                            p.is_deleted = True
-                            p.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            # either changes an existing phone back to is_deleted=True, or creates a new assigned phone
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                business_customer.phone_numbers.add(phone)
-                                business_customer.save()
+                        # replaces their emails and phone numbers with those submitted
+                        sync_contacts(business_customer, email_formset, phone_formset)
 
                         business_customer.save()
 
@@ -1983,47 +1645,8 @@ def edit_business_customer(request, uuid):
 
                             business_customer.save()
 
-                            # sets all assigned emails to soft deleted
-                            old_emails = business_customer.emails.all()
-                            for e in old_emails:
-                                e.is_deleted = True
-                                e.save()
-
-                            for email_form in email_formset:
-                                email_address = email_form.cleaned_data.get('email_address')
-                                email_type = email_form.cleaned_data.get('email_type')
-
-                                # either changes an existing email back to is_deleted=True, or creates a new
-                                # assigned email
-                                if email_address and email_type:
-                                    email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                    email = email[0]
-                                    if email.is_deleted is True:
-                                        email.is_deleted = False
-                                        email.save()
-                                    business_customer.emails.add(email)
-                                    business_customer.save()
-
-                            # sets all assigned phones to soft deleted
-                            old_phones = business_customer.phone_numbers.all()
-                            for p in old_phones:
-                                p.is_deleted = True
-                                p.save()
-
-                            for phone_form in phone_formset:
-                                phone_number = phone_form.cleaned_data.get('phone_number')
-                                phone_type = phone_form.cleaned_data.get('phone_type')
-
-                                # either changes an existing phone back to is_deleted=True, or creates a new
-                                # assigned phone
-                                if phone_number and phone_type:
-                                    phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                    phone = phone[0]
-                                    if phone.is_deleted is True:
-                                        phone.is_deleted = False
-                                        phone.save()
-                                    business_customer.phone_numbers.add(phone)
-                                    business_customer.save()
+                            # replaces their emails and phone numbers with those submitted
+                            sync_contacts(business_customer, email_formset, phone_formset)
 
                             business_customer.save()
 
@@ -2233,7 +1856,9 @@ def create_vehicle(request, customer_uuid):
                     request.user.staffmember.role == '2':
 
         # get customer from uuid. First try Business Customer customer with given uuid, if not found or if multiple found,
-        # check for account holder, if still not found, check drop in.
+        # check for account holder, if still not found, check drop in. If none is found, the uuid is that of a
+        # customer still being created, and the vehicle is staged against their draft.
+        customer = None
         try:
             customer = BusinessCustomer.objects.get(uuid=customer_uuid, is_deleted=False)
         except ObjectDoesNotExist:
@@ -2264,13 +1889,22 @@ def create_vehicle(request, customer_uuid):
                 mot_base_date = form.cleaned_data['mot_base_date']
                 type = form.cleaned_data['type']
 
-                # create vehicle object
-                vehicle = Vehicle.objects.create(customer=customer, reg_number=reg_number, make=make, model=model,
-                                                 engine_serial=engine_serial, chassis_number=chassis_number, color=color,
-                                                 mot_base_date=mot_base_date, type=type)
+                if customer is None:
+                    if reg_number_taken(request.session, customer_uuid, reg_number):
+                        form.add_error('reg_number', "A vehicle with this registration number already exists.")
+                    else:
+                        vehicle = stage_vehicle(request.session, customer_uuid, form.cleaned_data)
+                        return render(request, 'nod/create_vehicle_success.html', {'vehicle': vehicle})
+                elif reg_number_in_use(reg_number):
+                    form.add_error('reg_number', "A vehicle with this registration number already exists.")
+                else:
+                    # create vehicle object
+                    vehicle = Vehicle.objects.create(customer=customer, reg_number=reg_number, make=make, model=model,
+                                                     engine_serial=engine_serial, chassis_number=chassis_number,
+                                                     color=color, mot_base_date=mot_base_date, type=type)
 
-                # redirect to success modal
-                return render(request, 'nod/create_vehicle_success.html', {'vehicle': vehicle})
+                    # redirect to success modal
+                    return render(request, 'nod/create_vehicle_success.html', {'vehicle': vehicle})
 
         else:
             form = VehicleForm()
@@ -2278,6 +1912,7 @@ def create_vehicle(request, customer_uuid):
         context = {
             'form': form,
             'customer': customer,
+            'customer_uuid': customer_uuid,
         }
         return render(request, 'nod/create_vehicle.html', context)
     else:
@@ -2326,18 +1961,21 @@ def edit_vehicle(request, customer_uuid, uuid):
                 mot_base_date = form.cleaned_data['mot_base_date']
                 type = form.cleaned_data['type']
 
-                vehicle.reg_number = reg_number
-                vehicle.make = make
-                vehicle.model = model
-                vehicle.engine_serial = engine_serial
-                vehicle.chassis_number = chassis_number
-                vehicle.color = color
-                vehicle.mot_base_date = mot_base_date
-                vehicle.type = type
-
-                vehicle.save()
-
-                return redirect('view-customer', uuid=vehicle.get_customer().uuid)
+                if reg_number_in_use(reg_number, exclude=vehicle):
+                    form.add_error('reg_number', "A vehicle with this registration number already exists.")
+                else:
+                    vehicle.reg_number = reg_number
+                    vehicle.make = make
+                    vehicle.model = model
+                    vehicle.engine_serial = engine_serial
+                    vehicle.chassis_number = chassis_number
+                    vehicle.color = color
+                    vehicle.mot_base_date = mot_base_date
+                    vehicle.type = type
+
+                    vehicle.save()
+
+                    return redirect('view-customer', uuid=vehicle.get_customer().uuid)
             else:
                 messages.error(request, "There was an error with the data input.")
 
@@ -2385,7 +2023,9 @@ def delete_vehicle(request, uuid):
 # retrieves vehicles as serialised objects in json format as part of the api
 def get_vehicles(request, customer_uuid):
     # get customer from uuid. First try business customer customer with given uuid, if not found or if multiple found,
-    # check for account holder, if still not found, check drop in.
+    # check for account holder, if still not found, check drop in. If none is found, the uuid is that of a
+    # customer still being created, whose vehicles are staged against their draft.
+    customer = None
     try:
         customer = BusinessCustomer.objects.get(uuid=customer_uuid, is_deleted=False)
     except ObjectDoesNotExist:
@@ -2405,7 +2045,11 @@ def get_vehicles(request, customer_uuid):
 
     data = None
     if request.is_ajax():
-        vehicles = customer.vehicle_set.filter(is_deleted=False)
+        if customer is None:
+            vehicles = [Vehicle(uuid=v['uuid'], reg_number=v['reg_number'], make=v['make'], model=v['model'])
+                        for v in draft_vehicles(request.session, customer_uuid)]
+        else:
+            vehicles = customer.vehicle_set.filter(is_deleted=False)
         results = []
         for v in vehicles:
             v_json = {}
@@ -2437,10 +2081,17 @@ def create_part(request):
                 price = form.cleaned_data['price']
                 low_level_threshold = form.cleaned_data['low_level_threshold']
 
-                Part.objects.create(name=name, manufacturer=manufacturer, vehicle_type=vehicle_type, years=years,
-                                    code=code, quantity=quantity, price=price, low_level_threshold=low_level_threshold)
+                try:
+                    with transaction.atomic():
+                        part = Part.objects.create(name=name, manufacturer=manufacturer, vehicle_type=vehicle_type,
+                                                   years=years, code=code, quantity=quantity, price=price,
+                                                   low_level_threshold=low_level_threshold)
+                        open_stock(part, staff=request.user.staffmember)
+                        record_price(part, staff=request.user.staffmember)
 
-                return HttpResponseRedirect('/garits/parts/')
+                    return HttpResponseRedirect('/garits/parts/')
+                except IntegrityError:
+                    messages.error(request, "There was an error saving")
 
         else:
             form = CreatePartForm()
@@ -2451,6 +2102,147 @@ def create_part(request):
         return redirect('/garits/')
 
 
+# import parts form, creating and updating parts in bulk from an uploaded catalogue
+@login_required
+def import_parts_upload(request):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' or \
+                    request.user.staffmember.role == '2':
+        result = None
+        if request.method == 'POST':
+            form = ImportPartsForm(request.POST, request.FILES)
+
+            if form.is_valid():
+                dry_run = form.cleaned_data['dry_run']
+                # the upload is decoded and read a line at a time rather than all at once
+                lines = codecs.iterdecode(form.cleaned_data['file'], 'utf-8-sig')
+                try:
+                    result = import_parts(lines, staff=request.user.staffmember, dry_run=dry_run)
+                except (UnicodeDecodeError, ValueError) as e:
+                    messages.error(request, "The file couldn't be read: %s" % e)
+                except IntegrityError:
+                    messages.error(request, "There was an error saving")
+                else:
+                    if dry_run:
+                        messages.success(request, "%s Nothing was saved." % result)
+                    else:
+                        messages.success(request, str(result))
+        else:
+            form = ImportPartsForm()
+
+        return render(request, 'nod/import_parts.html', {'form': form, 'result': result})
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
+# reprice parts form, changing the prices of every part matching the filters given at once
+@login_required
+def reprice_parts(request):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' or \
+                    request.user.staffmember.role == '2':
+        if request.method == 'POST':
+            form = RepriceForm(request.POST)
+
+            if form.is_valid():
+                parts = pricing.filter_parts(manufacturer=form.cleaned_data['manufacturer'],
+                                             vehicle_type=form.cleaned_data['vehicle_type'],
+                                             supplier=form.cleaned_data['supplier'])
+                try:
+                    count = pricing.reprice(parts, form.cleaned_data['kind'], form.cleaned_data['change'],
+                                            staff=request.user.staffmember)
+                    messages.success(request, "%d parts were repriced." % count)
+                    return HttpResponseRedirect('/garits/parts/')
+                except IntegrityError:
+                    messages.error(request, "There was an error saving")
+        else:
+            form = RepriceForm()
+
+        return render(request, 'nod/reprice_parts.html', {'form': form})
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
+# create site form
+@login_required
+def create_site(request):
+    if request.user.staffmember.role == '3':
+        if request.method == 'POST':
+            form = SiteForm(request.POST)
+
+            if form.is_valid():
+                try:
+                    with transaction.atomic():
+                        Site.objects.create(name=form.cleaned_data['name'], address=form.cleaned_data['address'],
+                                            postcode=form.cleaned_data['postcode'])
+
+                    return redirect('site-stock')
+                except IntegrityError:
+                    messages.error(request, "There was an error saving")
+        else:
+            form = SiteForm()
+
+        return render(request, 'nod/create_site.html', {'form': form})
+    else:
+        messages.error(request, "You must be a franchisee in order to view this page.")
+        return redirect('/garits/')
+
+
+# stock transfer form, moving parts from the stock of one site to another
+@login_required
+def transfer_stock(request):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' or \
+                    request.user.staffmember.role == '2':
+        PartCreateFormSet = formset_factory(JobPartForm, formset=BaseJobPartForm)
+        part_helper = PartFormSetHelper()
+
+        if request.method == 'POST':
+            part_formset = PartCreateFormSet(request.POST, prefix='fs2')
+            form = StockTransferForm(request.POST)
+
+            if form.is_valid() and part_formset.is_valid():
+                from_site = form.cleaned_data['from_site']
+                to_site = form.cleaned_data['to_site']
+                parts = [(part_form.cleaned_data.get('part'), part_form.cleaned_data.get('quantity'))
+                         for part_form in part_formset]
+                parts = [(part, quantity) for part, quantity in parts if part and quantity]
+
+                # a site can't send more of a part than it holds
+                short = [part.name for part, quantity in parts if stock.site_quantity(part, from_site) < quantity]
+                if short:
+                    messages.error(request, "There isn't enough stock at " + from_site.name + " of " +
+                                   ", ".join(short))
+                else:
+                    try:
+                        with transaction.atomic():
+                            transfer = StockTransfer.objects.create(from_site=from_site, to_site=to_site,
+                                                                    staff=request.user.staffmember)
+                            for part, quantity in parts:
+                                transfer.transferpartrelationship_set.create(part=part, quantity=quantity)
+                                stock.transfer_stock(transfer, part, quantity, staff=request.user.staffmember)
+
+                        messages.success(request, "Parts were transferred to " + to_site.name + "!")
+                        return redirect('site-stock')
+                    except InsufficientStock as e:
+                        # the stock was taken by someone else since it was checked
+                        messages.error(request, str(e))
+                    except IntegrityError:
+                        messages.error(request, "There was an error saving")
+        else:
+            part_formset = PartCreateFormSet(prefix='fs2')
+            form = StockTransferForm(initial={'from_site': request.user.staffmember.site})
+
+        context = {
+            'part_formset': part_formset,
+            'part_helper': part_helper,
+            'form': form
+        }
+        return render(request, 'nod/transfer_stock.html', context)
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
 # edit part form
 @login_required
 def edit_part(request, uuid):
@@ -2466,19 +2258,28 @@ def edit_part(request, uuid):
                 price = form.cleaned_data['price']
                 low_level_threshold = form.cleaned_data['low_level_threshold']
 
-                part.quantity = quantity
-                part.price = price
-                part.low_level_threshold = low_level_threshold
-
-                part.save()
-
-                message = part.name + " was successfully edited!"
-                messages.success(request, message)
-                return HttpResponseRedirect('/garits/parts/')
+                try:
+                    with transaction.atomic():
+                        # a change of quantity is recorded in the stock ledger as a manual adjustment
+                        set_stock(part, quantity, staff=request.user.staffmember)
+                        price_changed = part.price != price
+                        part.price = price
+                        part.low_level_threshold = low_level_threshold
+
+                        part.save()
+                        # the old price is kept in the price history, for reports over earlier dates
+                        if price_changed:
+                            record_price(part, staff=request.user.staffmember)
+
+                    message = part.name + " was successfully edited!"
+                    messages.success(request, message)
+                    return HttpResponseRedirect('/garits/parts/')
+                except IntegrityError:
+                    messages.error(request, "There was an error saving")
 
         else:
             data = {}
-            data['quantity'] = part.quantity
+            data['quantity'] = site_quantity(part, staff_site(request.user.staffmember))
             data['price'] = part.price
             data['low_level_threshold'] = part.low_level_threshold
 
@@ -2511,19 +2312,102 @@ def delete_part(request, uuid):
         return redirect('/garits/')
 
 
+# seconds the vehicles matching a registration prefix are cached for; kept short so that new vehicles
+# show up almost straight away
+VEHICLE_SEARCH_TIMEOUT = 30
+
+
 # retrieves vehicles as serialised objects in json format as part of the api for the purpose of autocomplete
-# (different data to the previous get_vehicles method)
+# (different data to the previous get_vehicles method). Registrations are matched by prefix as a range over
+# the indexed normalised registration, and the results of each prefix are cached briefly, since every
+# keystroke asks again for a prefix of the last one.
 def get_vehicles_autocomplete(request):
     if request.is_ajax():
-        q = request.GET.get('term')
-        vehicles = Vehicle.objects.filter(reg_number__icontains=q, is_deleted=False)[:10]
+        q = normalize_reg(request.GET.get('term', ''))
+        key = 'vehicles:prefix:' + q
+        results = cache.get(key)
+        if results is None:
+            results = []
+            if q:
+                vehicles = Vehicle.objects.filter(reg_key__gte=q, reg_key__lt=q + '\uffff', is_deleted=False)\
+                    .order_by('reg_key').values_list('id', 'reg_number')[:10]
+                for v_id, reg_number in vehicles:
+                    v_json = {}
+                    v_json['id'] = v_id
+                    v_json['label'] = reg_number
+                    v_json['value'] = reg_number
+                    results.append(v_json)
+            cache.set(key, results, VEHICLE_SEARCH_TIMEOUT)
+        data = json.dumps(results)
+    else:
+        data = 'fail'
+    mimetype = 'application/json'
+    return HttpResponse(data, mimetype)
+
+
+# retrieves parts whose code or name starts with the search term, in json format for the part pickers.
+# The search runs as a range over the indexed lowercased keys, so it stays quick however large the
+# catalogue is.
+def get_parts_autocomplete(request):
+    if request.is_ajax():
+        q = request.GET.get('term', '').strip().lower()
         results = []
-        for v in vehicles:
-            v_json = {}
-            v_json['id'] = v.id
-            v_json['label'] = v.reg_number
-            v_json['value'] = v.reg_number
-            results.append(v_json)
+        if q:
+            parts = Part.objects.filter(is_deleted=False)
+            by_code = parts.filter(code_key__gte=q, code_key__lt=q + '\uffff').order_by('code_key')
+            by_name = parts.filter(name_key__gte=q, name_key__lt=q + '\uffff').order_by('name_key')
+            # on a job sheet, only the parts fitting the job's vehicle are offered, unless none of them match
+            vehicle = Vehicle.objects.filter(uuid=request.GET.get('vehicle')).first() \
+                if request.GET.get('vehicle') else None
+            if vehicle is not None:
+                fitting = vehicle_fitment(vehicle).values('part_id')
+                if by_code.filter(id__in=fitting).exists() or by_name.filter(id__in=fitting).exists():
+                    by_code = by_code.filter(id__in=fitting)
+                    by_name = by_name.filter(id__in=fitting)
+            by_code = list(by_code[:10])
+            by_name = list(by_name[:10])
+            seen = set()
+            for p in by_code + by_name:
+                if p.id in seen or len(results) == 10:
+                    continue
+                seen.add(p.id)
+                p_json = {}
+                p_json['id'] = p.id
+                p_json['label'] = p.code + ' - ' + p.name + ' (' + p.manufacturer + ', ' + p.vehicle_type + ')'
+                p_json['value'] = p.name
+                results.append(p_json)
+        data = json.dumps(results)
+    else:
+        data = 'fail'
+    mimetype = 'application/json'
+    return HttpResponse(data, mimetype)
+
+
+# retrieves the earliest free booking slot of each bay suited to the given job type, no sooner than the
+# given date, for a job made of the given tasks, in json format for the job sheets to offer valid slots
+def get_booking_slots(request):
+    if request.is_ajax():
+        bay_type = JOB_BAY_TYPES.get(request.GET.get('type'), '1')
+        try:
+            day = datetime.datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            day = datetime.date.today()
+        after = max(booking_start(day), timezone.now())
+        tasks = Task.objects.filter(id__in=request.GET.getlist('tasks'), is_deleted=False)
+        length = booking_length(tasks)
+        # a job being edited is left out so it doesn't clash with its own booking
+        job = Job.objects.filter(uuid=request.GET.get('job')).first() if request.GET.get('job') else None
+
+        results = []
+        for bay, start in free_slots(bay_type, after, length, exclude_job=job):
+            start = timezone.localtime(start)
+            s_json = {}
+            s_json['id'] = bay.id
+            s_json['label'] = str(bay) + " " + str(bay.id) + " - " + start.strftime('%d/%m/%Y %H:%M')
+            s_json['value'] = start.isoformat()
+            s_json['date'] = start.strftime('%Y-%m-%d')
+            s_json['time'] = start.strftime('%H:%M')
+            results.append(s_json)
         data = json.dumps(results)
     else:
         data = 'fail'
@@ -2556,18 +2440,19 @@ def replenish_stock(request):
                         order = PartOrder.objects.create(supplier=supplier, date=date)
 
                         for part_form in part_formset:
-                            part_name = part_form.cleaned_data['part_name']
-                            quantity = part_form.cleaned_data['quantity']
+                            part = part_form.cleaned_data.get('part')
+                            quantity = part_form.cleaned_data.get('quantity')
 
                             # adds the quantity specified to the database for each given part
-                            if part_name and quantity:
-                                part = get_object_or_404(Part, name=part_name)
+                            if part and quantity:
 
                                 order.orderpartrelationship_set.create(part=part, quantity=quantity,
                                                                        is_deleted=False)
 
-                                part.quantity += quantity
-                                part.save()
+                                move_stock(part, quantity, stock.DELIVERY, staff=request.user.staffmember,
+                                           part_order=order)
+
+                        order.update_total_price()
 
                         messages.success(request, "Parts were successfully added to the stock!")
                         return HttpResponseRedirect('/garits/parts/')
@@ -2598,9 +2483,9 @@ def edit_replenish_stock(request, uuid):
                     request.user.staffmember.role == '2':
         order = get_object_or_404(PartOrder, uuid=uuid)
         PartCreateFormSet = formset_factory(JobPartForm, formset=BaseJobPartForm, min_num=1, extra=0)
-        part_set = order.orderpartrelationship_set.all()
+        part_set = order.orderpartrelationship_set.all().select_related('part')
         # current parts assigned to the replenish stock order form
-        parts_data = [{'part_name': p.part, 'quantity': p.quantity}
+        parts_data = [{'part': p.part, 'quantity': p.quantity}
                       for p in part_set]
 
         part_helper = PartFormSetHelper()
@@ -2617,29 +2502,48 @@ def edit_replenish_stock(request, uuid):
 
                 try:
                     with transaction.atomic():
+                        # nothing in a draft order has gone into stock yet, so placing it delivers all of it
+                        draft = order.is_draft
+                        parts = [part_form.cleaned_data.get('part') for part_form in part_formset
+                                 if part_form.cleaned_data.get('part') and part_form.cleaned_data.get('quantity')]
+
+                        # lines taken off the order are removed, and what they delivered taken back out of stock
+                        for op in order.orderpartrelationship_set.exclude(part__in=parts).select_related('part'):
+                            op.is_deleted = True
+                            op.save()
+                            if not draft:
+                                move_stock(op.part, -op.quantity, stock.DELIVERY, staff=request.user.staffmember,
+                                           part_order=order)
+
                         for part_form in part_formset:
-                            part_name = part_form.cleaned_data['part_name']
-                            quantity = part_form.cleaned_data['quantity']
-
-                            if part_name and quantity:
-                                part = get_object_or_404(Part, name=part_name)
-                                op = order.orderpartrelationship_set.get_or_create(part=part, is_deleted=False)
-
-                                # if object was created
-                                if op[1] is True:
-                                    print('b')
-                                    op[0].quantity = quantity
-                                    op[0].save()
-                                    part.quantity += quantity
-                                    part.save()
-                                else:
-                                    part.quantity = part.quantity - op[0].quantity + quantity
-                                    part.save()
-                                    op[0].quantity = quantity
-                                    op[0].save()
+                            part = part_form.cleaned_data.get('part')
+                            quantity = part_form.cleaned_data.get('quantity')
 
-                        return HttpResponseRedirect('/thanks/')
+                            if part and quantity:
+                                op = order.orderpartrelationship_set.get_or_create(part=part, is_deleted=False,
+                                                                                   defaults={'quantity': 0})
+
+                                # only the difference from the quantity previously ordered (nothing, if the
+                                # object was created) goes into stock
+                                delivered = quantity if draft else quantity - op[0].quantity
+                                op[0].quantity = quantity
+                                op[0].save()
+                                if delivered:
+                                    move_stock(part, delivered, stock.DELIVERY, staff=request.user.staffmember,
+                                               part_order=order)
+
+                        order.supplier = supplier
+                        order.date = date
+                        order.is_draft = False
+                        order.total_price = order.order_value()
+                        order.save()
+
+                        messages.success(request, "The replenishment order was saved.")
+                        return HttpResponseRedirect('/garits/parts/')
 
+                except InsufficientStock as e:
+                    # lowering an order takes back stock which may have been used since it was delivered
+                    messages.error(request, str(e))
                 except IntegrityError:
                     messages.error(request, "There was an error saving")
 
@@ -2661,6 +2565,37 @@ def edit_replenish_stock(request, uuid):
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
         return redirect('/garits/')
 
+
+# streams every customer, vehicle, job, part or invoice as csv, or json lines, a chunk of rows at a time, so the
+# download starts straight away however many rows there are. Only the franchisee can export data.
+@login_required
+def export_data(request, kind):
+    if request.user.staffmember.role == '3':
+        if kind not in EXPORTS:
+            raise Http404
+        format = request.GET.get('format', 'csv')
+        if format not in FORMATS:
+            format = 'csv'
+        response = StreamingHttpResponse(export_lines(kind, format), content_type=FORMATS[format])
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (kind, format)
+        return response
+    else:
+        messages.error(request, "You must be a franchisee in order to view this page.")
+        return redirect('/garits/')
+
+
+# searches customers, vehicles, jobs and invoices at once, returning the best matches in json format, ranked by
+# how well they match
+@login_required
+def search(request):
+    if request.is_ajax():
+        data = json.dumps(site_search.search(request.GET.get('term', '')))
+    else:
+        data = 'fail'
+    mimetype = 'application/json'
+    return HttpResponse(data, mimetype)
+
+
 # retrieves suppliers as serialised objects in json format as part of the api for the purpose of autocomplete
 def get_suppliers_autocomplete(request):
     if request.is_ajax():
@@ -2709,33 +2644,8 @@ def create_supplier(request):
                         # create Supplier object using input data
                         supplier = Supplier.objects.create(company_name=company_name, address=address, postcode=postcode)
 
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                supplier.emails.add(email)
-                                supplier.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                supplier.phone_numbers.add(phone)
-                                supplier.save()
-
-                        supplier.save()
+                        # adds the emails and phone numbers submitted
+                        sync_contacts(supplier, email_formset, phone_formset)
 
                         return HttpResponseRedirect('/garits/suppliers/')
 
@@ -2803,45 +2713,8 @@ def edit_supplier(request, uuid):
 
                         supplier.save()
 
-                        # sets all assigned emails to soft deleted
-                        old_emails = supplier.emails.all()
-                        for e in old_emails:
-                            e.is_deleted = True
-                            e.save()
-
-                        for email_form in email_formset:
-                            email_address = email_form.cleaned_data.get('email_address')
-                            email_type = email_form.cleaned_data.get('email_type')
-
-                            # either changes an existing email back to is_deleted=True, or creates a new assigned email
-                            if email_address and email_type:
-                                email = EmailModel.objects.get_or_create(type=email_type, address=email_address)
-                                email = email[0]
-                                if email.is_deleted is True:
-                                    email.is_deleted = False
-                                    email.save()
-                                supplier.emails.add(email)
-                                supplier.save()
-
-                        # sets all assigned phones to soft deleted
-                        old_phones = supplier.phone_numbers.all()
-                        for p in old_phones:
-                            p.is_deleted = True
-                            p.save()
-
-                        for phone_form in phone_formset:
-                            phone_number = phone_form.cleaned_data.get('phone_number')
-                            phone_type = phone_form.cleaned_data.get('phone_type')
-
-                            # either changes an existing phone back to is_deleted=True, or creates a new assigned phone
-                            if phone_number and phone_type:
-                                phone = PhoneModel.objects.get_or_create(type=phone_type, phone_number=phone_number)
-                                phone = phone[0]
-                                if phone.is_deleted is True:
-                                    phone.is_deleted = False
-                                    phone.save()
-                                supplier.phone_numbers.add(phone)
-                                supplier.save()
+                        # replaces their emails and phone numbers with those submitted
+                        sync_contacts(supplier, email_formset, phone_formset)
 
                         supplier.save()
 
@@ -2925,6 +2798,19 @@ def sell_parts(request, customer_uuid):
             part_formset = PartCreateFormSet(request.POST, prefix='fs2')
             form = CustomerPartsOrderForm(request.POST)
 
+            if form.is_valid() and part_formset.is_valid():
+                date = form.cleaned_data['date']
+
+                # parts are sold from the stock of the staff member's site, which can't sell more than it holds
+                site = staff_site(request.user.staffmember)
+                for part_form in part_formset:
+                    part = part_form.cleaned_data.get('part')
+                    quantity = part_form.cleaned_data.get('quantity')
+                    if part and quantity and site is not None:
+                        available = site_quantity(part, site)
+                        if available < quantity:
+                            part_form.add_error('quantity', shortfall_message(part, site, quantity, available))
+
             if form.is_valid() and part_formset.is_valid():
                 date = form.cleaned_data['date']
 
@@ -2937,8 +2823,8 @@ def sell_parts(request, customer_uuid):
                         customer.save()
 
                         # defines invoice number to be the previous one + 1. If there are 0, it sets it to 1.
-                        if Invoice.objects.last() is not None:
-                            last_id = Invoice.objects.last().id
+                        if Invoice.all_objects.last() is not None:
+                            last_id = Invoice.all_objects.last().id
                             new_id = last_id + 1
                         else:
                             new_id = 1
@@ -2948,21 +2834,23 @@ def sell_parts(request, customer_uuid):
 
                         # adds the parts (and the quantity) defined to the order
                         for part_form in part_formset:
-                            part_name = part_form.cleaned_data['part_name']
-                            quantity = part_form.cleaned_data['quantity']
+                            part = part_form.cleaned_data.get('part')
+                            quantity = part_form.cleaned_data.get('quantity')
 
-                            if part_name and quantity:
-                                part = get_object_or_404(Part, name=part_name)
+                            if part and quantity:
                                 part_sold = SellPart.objects.create(part=part, quantity=quantity, order=order)
                                 invoice.parts_sold.add(part_sold)
-                                part.quantity -= quantity
-                                part.save()
+                                move_stock(part, -quantity, stock.SALE, staff=request.user.staffmember,
+                                           site=site, customer_order=order)
 
                         invoice.save()
 
                         messages.success(request, "Parts sold! Invoice created!")
                         return redirect('view-customer', uuid=customer.uuid)
 
+                except InsufficientStock as e:
+                    # the stock was taken by someone else since it was checked
+                    messages.error(request, str(e))
                 except IntegrityError:
                     messages.error(request, "There was an error saving")
 
@@ -3004,10 +2892,11 @@ def create_user(request):
                 user.set_password(password)
                 user.save()
                 # mechanic or foreperson
+                site = form.cleaned_data['site']
                 if role == '1' or role == '2':
-                    Mechanic.objects.create(user=user, role=role, hourly_pay=hourly_rate)
+                    Mechanic.objects.create(user=user, role=role, hourly_pay=hourly_rate, site=site)
                 else:
-                    StaffMember.objects.create(user=user, role=role)
+                    StaffMember.objects.create(user=user, role=role, site=site)
 
                 return HttpResponseRedirect('/garits/users/')
 
@@ -3067,6 +2956,7 @@ def edit_user(request, uuid):
                                                                user_id=staff.user_id, created=staff.created)
 
                 staff.role = role
+                staff.site = form.cleaned_data['site']
                 staff.save()
 
                 return HttpResponseRedirect('/garits/users/')
@@ -3079,6 +2969,7 @@ def edit_user(request, uuid):
             if staff.role == '1' or staff.role == '2':
                 data['hourly_rate'] = staff.hourly_pay
             data['role'] = staff.role
+            data['site'] = staff.site
             form = UserForm(initial=data)
 
         context = {
@@ -3461,8 +3352,8 @@ def generate_invoice_for_job(request, job_uuid):
                     request.user.staffmember.role == '2':
         job = get_object_or_404(Job, uuid=job_uuid)
 
-        if Invoice.objects.last() is not None:
-            last_id = Invoice.objects.last().id
+        if Invoice.all_objects.last() is not None:
+            last_id = Invoice.all_objects.last().id
             new_id = last_id + 1
         else:
             new_id = 1
@@ -3490,7 +3381,7 @@ def spare_parts_report_table(request):
     if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' or \
                     request.user.staffmember.role == '2':
         spare_parts_report_table = SparePartsReportTable(SparePartsReport.objects.filter(is_deleted=False))
-        RequestConfig(request).configure(spare_parts_report_table)
+        paginate_keyset(request, spare_parts_report_table)
         return render(request, "nod/spare_parts_reports.html", {'reports_table': spare_parts_report_table})
     else:
         messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
@@ -3507,28 +3398,7 @@ def generate_spare_parts_report(request):
 
         date = datetime.date(year, month, 1)
         today = datetime.date.today()
-        report = SparePartsReport.objects.create(start_date=date, end_date=today, date=today)
-        for part in Part.objects.filter(is_deleted=False):
-            spare = SparePart.objects.create(report=report, part=part, new_stock_level=part.quantity)
-            delivered = 0
-            for p in OrderPartRelationship.objects.filter(part=part, order__date__gte=report.start_date):
-                delivered += p.quantity
-            spare.delivery = delivered
-
-            # used = 0
-            # for p in JobPart.objects.filter(part=part, job__booking_date__gte=report.start_date):
-            #     used += p.quantity
-            # for p in SellPart.objects.filter(part=part, order__date__gte=report.start_date):
-            #     used +=p.quantity
-            used = part.total_used_parts(start_date=date, end_date=today)
-            spare.used = used
-
-            # assigns the initial stock level value to the new stock level defined + the quantity used - the
-            # amount ordered/delivered to the garage
-            spare.initial_stock_level = spare.new_stock_level + spare.used - spare.delivery
-            spare.save()
-            report.sparepart_set.add(spare)
-        report.save()
+        report = create_spare_parts_report(date, today, today)
 
         return view_spare_parts_report(request, report.uuid)
 
@@ -3546,6 +3416,7 @@ def view_spare_parts_report(request, uuid):
         template = loader.get_template('nod/view_spare_parts_report.html')
         context = RequestContext(request, {
             'report': report,
+            'spare_parts': report.sparepart_set.filter(is_deleted=False).select_related('part'),
         })
         return HttpResponse(template.render(context))
     else:
@@ -3553,12 +3424,24 @@ def view_spare_parts_report(request, uuid):
         return redirect('/garits/')
 
 
+# reprints a statement exactly as it was generated
+@login_required
+def view_statement(request, uuid):
+    if request.user.staffmember.role == '3' or request.user.staffmember.role == '4' or \
+                    request.user.staffmember.role == '2':
+        statement = get_object_or_404(Statement, uuid=uuid, is_deleted=False)
+        return HttpResponse(statement.html)
+    else:
+        messages.error(request, "You must be a franchisee/receptionist/foreperson in order to view this page.")
+        return redirect('/garits/')
+
+
 # configures time report table
 @login_required
 def time_report_table(request):
     if request.user.staffmember.role == '3':
         time_report_table = TimeReportTable(TimeReport.objects.filter(is_deleted=False))
-        RequestConfig(request).configure(time_report_table)
+        paginate_keyset(request, time_report_table)
         return render(request, "nod/time_reports.html", {'reports_table': time_report_table})
     else:
         messages.error(request, "You must be a franchisee in order to view this page.")